@@ -1,5 +1,14 @@
 # agents.py
-import streamlit as st
+import contextlib
+import logging
+import time
+
+from budget import BudgetExceeded
+from context import count_message_tokens, estimate_tokens
+from llm_cache import request_key
+from rate_limit import COMPLETION_TOKENS_ESTIMATE
+
+logger = logging.getLogger(__name__)  # Agents run headless too (engine, batch jobs); the UI shows the returned error text
 
 INTERACTION_PROTOCOL = """You are in a classroom environment.
 The other participants are: {other_agents}.
@@ -7,12 +16,28 @@ The other participants are: {other_agents}.
 
 
 class Agent:
-    def __init__(self, name, client, model, instruction):
+    def __init__(self, name, client, model, instruction, async_client=None, cache=None, context_window=None,
+                 prompt_cache_breakpoints=False, rate_limiter=None, single_flight=None, telemetry=None,
+                 budget=None, role=None, router=None, hedger=None):
         self.name = name
+        self.role = role  # "teacher" or "student"; with 'router', selects the models per call
         self.instruction = instruction
         self.client = client
+        self.async_client = async_client  # Optional AsyncOpenAI client used by achat()
+        self.cache = cache  # Optional llm_cache.ResponseCache shared between agents and sessions
+        self.context_window = context_window  # Optional context.ContextWindow bounding the history sent per call
+        self.prompt_cache_breakpoints = prompt_cache_breakpoints  # Mark cache_control breakpoints for provider prompt caching
+        self.rate_limiter = rate_limiter  # Optional rate_limit.RateLimiter shared by every agent using the same API key
+        self.single_flight = single_flight  # Optional singleflight.SingleFlight coalescing identical in-flight requests
+        self.telemetry = telemetry  # Optional telemetry.Telemetry receiving one record per call
+        self.budget = budget  # Optional budget.TokenBudget of the session or classroom (ceiling and model downgrade)
+        self.router = router  # Optional routing.ModelRouter; without it every call uses 'model'
+        self.hedger = hedger  # Optional hedging.Hedger duplicating calls stuck in the latency tail
         self.model = model
         self.state = {}  # For agents to store information if needed
+        self.token_usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        self.last_call_usage = None  # Token counts of the most recent provider call
+        self._history_epoch = 0  # Bumped by clear_messages() so replies to cancelled requests are dropped
 
         # Initialize messages with system prompt.
         system_prompt = self.instruction
@@ -36,28 +61,471 @@ class Agent:
             self.messages[0]["content"] = f"{base_instruction_part.strip()}\n\n{protocol_content}"
 
 
-    def chat(self, prompt):
+    def _cached_response(self, model, request_options=None):
+        """
+        Looks up the current message list in the response cache (None when disabled or on a miss).
+        The request options are part of the key: a structured (response_format) reply is never served as prose.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.get(model, self.messages, request_options)
+
+    def _cache_response(self, history, response, model, request_options=None):
+        """
+        Stores a successful response for the message list it answers, under the model that wrote it
+        (lookups use the route's first model, so fallback replies are never served in its place).
+        """
+        if self.cache is not None:
+            self.cache.put(model, history, response, request_options)
+
+    def _append_reply(self, history_epoch, content):
+        """Appends an assistant reply unless the history was cleared while the request was in flight."""
+        if history_epoch == self._history_epoch:
+            self.messages.append({"role": "assistant", "content": content})
+
+    def _discard_prompt(self, history_epoch):
+        """Drops the prompt of a failed call, so neither it nor the error text ends up in the conversation."""
+        if history_epoch == self._history_epoch and self.messages and self.messages[-1]["role"] == "user":
+            self.messages.pop()
+
+    def _estimated_call_tokens(self, request_messages):
+        return count_message_tokens(request_messages) + COMPLETION_TOKENS_ESTIMATE
+
+    def _models_for(self, interaction):
+        """Models to try for an interaction (the engine's job kind, e.g. "answer"), in order."""
+        if self.router is None:
+            return [self.model]
+        return self.router.models_for(self.role, interaction, default_model=self.model)
+
+    def _admit(self, request_messages, model=None):
+        """
+        Pre-flight check against the token budget, with a local estimate of the call's size.
+        Returns the model to call (the budget's fallback model near the ceiling); raises BudgetExceeded.
+        """
+        model = model or self.model
+        if self.budget is None:
+            return model
+        return self.budget.admit(model, self._estimated_call_tokens(request_messages))
+
+    def _record_route(self, interaction, model, started_at, usage=None, error=False, fallback=False):
+        """Adds a call (or failed attempt) to the router's statistics for its route."""
+        if self.router is None:
+            return
+        self.router.record(
+            self.role, interaction, model, time.time() - started_at,
+            prompt_tokens=getattr(usage, "prompt_tokens", None) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", None) or 0, error=error, fallback=fallback,
+        )
+
+    def _create(self, request_messages, model=None, **request_options):
+        """Provider call, through the key's rate limiter (which also retries transient failures) when one is set."""
+        model = model or self.model
+        def create():
+            return self.client.chat.completions.create(model=model, messages=request_messages, **request_options)
+        if self.rate_limiter is None:
+            return create()
+        return self.rate_limiter.call(create, self._estimated_call_tokens(request_messages))
+
+    async def _acreate(self, request_messages, model=None, **request_options):
+        """Async counterpart of _create() using the AsyncOpenAI client."""
+        model = model or self.model
+        def create():
+            return self.async_client.chat.completions.create(model=model, messages=request_messages, **request_options)
+        if self.rate_limiter is None:
+            return await create()
+        return await self.rate_limiter.acall(create, self._estimated_call_tokens(request_messages))
+
+    def _complete(self, request_messages, model=None, **request_options):
+        """
+        _create() behind the single-flight layer: an identical request (same model, messages and options)
+        already in flight for any agent is awaited instead of being sent again.
+        Returns (api_response, shared); a shared response's tokens were paid for by the leader.
+        """
+        model = model or self.model
+        if self.single_flight is None:
+            return self._create(request_messages, model, **request_options), False
+        key = request_key(model, request_messages, request_options)
+        return self.single_flight.do(key, lambda: self._create(request_messages, model, **request_options))
+
+    async def _acomplete(self, request_messages, model=None, **request_options):
+        """Async counterpart of _complete()."""
+        model = model or self.model
+        if self.single_flight is None:
+            return await self._acreate(request_messages, model, **request_options), False
+        key = request_key(model, request_messages, request_options)
+        return await self.single_flight.ado(key, lambda: self._acreate(request_messages, model, **request_options))
+
+    def _discard_hedge(self, result):
+        """Charges the tokens of a hedged call's losing response, which no one reads."""
+        api_response, shared, _ = result
+        tokens = getattr(api_response.usage, "total_tokens", None) if not shared else None
+        if tokens:
+            self.hedger.add_discarded_tokens(tokens)
+            if self.budget is not None:
+                self.budget.charge(tokens)
+
+    def _hedge_model(self, models, i):
+        """Model a hedge of models[i] goes to: the route's next model with an alternate-model hedger, else the same."""
+        if self.hedger is not None and self.hedger.alternate_model and i + 1 < len(models):
+            return models[i + 1]
+        return models[i]
+
+    def _complete_hedged(self, request_messages, model, hedge_model, **request_options):
+        """
+        _complete() behind the hedger, when one is set: a call slower than the model's recent tail
+        gets a duplicate sent to 'hedge_model' (bypassing the single-flight layer, which would
+        otherwise join it to the slow call) and the first success wins. Returns (api_response, shared, model).
+        """
+        def primary():
+            return (*self._complete(request_messages, model, **request_options), model)
+        if self.hedger is None:
+            return primary()
+        def hedge():
+            admitted_model = self._admit(request_messages, hedge_model)
+            return self._create(request_messages, admitted_model, **request_options), False, admitted_model
+        return self.hedger.call(model, primary, hedge, on_discarded=self._discard_hedge)
+
+    async def _acomplete_hedged(self, request_messages, model, hedge_model, **request_options):
+        """Async counterpart of _complete_hedged(); the losing request is cancelled."""
+        async def primary():
+            return (*await self._acomplete(request_messages, model, **request_options), model)
+        if self.hedger is None:
+            return await primary()
+        async def hedge():
+            admitted_model = self._admit(request_messages, hedge_model)
+            return await self._acreate(request_messages, admitted_model, **request_options), False, admitted_model
+        return await self.hedger.acall(model, primary, hedge, on_discarded=self._discard_hedge)
+
+    def _complete_routed(self, request_messages, interaction=None, **request_options):
+        """
+        _complete() on the interaction's route: when a model fails (after the rate limiter's retries),
+        the next model of the route is tried. Returns (api_response, shared, model). Raises BudgetExceeded
+        or the last model's error.
+        """
+        models = self._models_for(interaction)
+        for i, candidate in enumerate(models):
+            model = self._admit(request_messages, candidate)
+            started_at = time.time()
+            try:
+                api_response, shared, model = self._complete_hedged(
+                    request_messages, model, self._hedge_model(models, i), **request_options
+                )
+            except Exception as e:
+                self._record_route(interaction, model, started_at, error=True, fallback=i > 0)
+                if i == len(models) - 1:
+                    raise
+                logger.warning("Model %s failed for agent %s (%s); trying %s", model, self.name, e, models[i + 1])
+                continue
+            self._record_route(interaction, model, started_at, None if shared else api_response.usage, fallback=i > 0)
+            return api_response, shared, model
+
+    async def _acomplete_routed(self, request_messages, interaction=None, **request_options):
+        """Async counterpart of _complete_routed()."""
+        models = self._models_for(interaction)
+        for i, candidate in enumerate(models):
+            model = self._admit(request_messages, candidate)
+            started_at = time.time()
+            try:
+                api_response, shared, model = await self._acomplete_hedged(
+                    request_messages, model, self._hedge_model(models, i), **request_options
+                )
+            except Exception as e:
+                self._record_route(interaction, model, started_at, error=True, fallback=i > 0)
+                if i == len(models) - 1:
+                    raise
+                logger.warning("Model %s failed for agent %s (%s); trying %s", model, self.name, e, models[i + 1])
+                continue
+            self._record_route(interaction, model, started_at, None if shared else api_response.usage, fallback=i > 0)
+            return api_response, shared, model
+
+    def _record_usage(self, usage, request_messages, response_text):
+        """Accumulates provider-reported token counts, falling back to local estimates."""
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        if prompt_tokens is None:
+            prompt_tokens = count_message_tokens(request_messages)
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens(response_text)
+        # Prompt tokens the provider served from its prefix cache (0 when not reported)
+        cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+        self.last_call_usage = {
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "cached_tokens": cached_tokens
+        }
+        self.token_usage["calls"] += 1
+        self.token_usage["prompt_tokens"] += prompt_tokens
+        self.token_usage["completion_tokens"] += completion_tokens
+        self.token_usage["cached_tokens"] += cached_tokens
+        if self.budget is not None:
+            self.budget.charge(prompt_tokens + completion_tokens)
+        return self.last_call_usage
+
+    def _record_call(self, kind, started_at, usage=None, ttft=None, outcome="ok", error=None, model=None):
+        """Reports one call (latency measured from 'started_at') to the telemetry collector, if any."""
+        if self.telemetry is None:
+            return
+        usage = usage or {}
+        self.telemetry.record(
+            self.name, model or self.model, kind, time.time() - started_at, ttft=ttft,
+            prompt_tokens=usage.get("prompt_tokens", 0), completion_tokens=usage.get("completion_tokens", 0),
+            cached_tokens=usage.get("cached_tokens", 0), outcome=outcome, error=error,
+        )
+
+    def _request_messages(self):
+        """
+        Message list as sent to the provider.
+        The history is already laid out prefix-first (system prompt, rolling summary, older turns,
+        newest prompt last), so consecutive calls share a byte-identical prefix that providers can cache.
+        With prompt_cache_breakpoints, cache_control markers are added on the system prompt and on the
+        last message before the new prompt, for providers that only cache explicitly marked prefixes.
+        """
+        if not self.prompt_cache_breakpoints:
+            return self.messages
+        request_messages = list(self.messages)
+        breakpoints = {0}
+        if len(request_messages) > 2:
+            breakpoints.add(len(request_messages) - 2) # End of the older history block
+        for i in breakpoints:
+            message = request_messages[i]
+            if isinstance(message.get("content"), str):
+                request_messages[i] = {
+                    **message,
+                    "content": [{"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}],
+                }
+        return request_messages
+
+    def context_tokens(self):
+        """Estimated size of the history that the next call would send."""
+        return count_message_tokens(self.messages)
+
+    def _compact_context(self):
+        """Keeps the history within the context window by summarizing or dropping older turns."""
+        if self.context_window is None:
+            return
+        plan = self.context_window.plan(self.messages)
+        if plan is None:
+            return
+        summary_text = ""
+        if self.context_window.policy == "summarize":
+            summary_text = self.context_window.fallback_summary(plan)
+            if self.client is not None:
+                summary_request = [{"role": "user", "content": self.context_window.summarization_prompt(plan)}]
+                started_at = time.time()
+                try:
+                    model = self._admit(summary_request, self._models_for("summary")[0])
+                    api_response = self._create(summary_request, model)
+                    summary_text = api_response.choices[0].message.content.strip() or summary_text
+                    usage = self._record_usage(api_response.usage, summary_request, summary_text)
+                    self._record_call("summary", started_at, usage=usage, ttft=time.time() - started_at, model=model)
+                except Exception as e:
+                    self._record_call("summary", started_at, outcome="error", error=str(e))
+                    # Keep the extractive fallback summary
+        self.messages = self.context_window.assemble(plan, summary_text)
+
+    async def _acompact_context(self):
+        """Async counterpart of _compact_context() using the AsyncOpenAI client."""
+        if self.context_window is None:
+            return
+        plan = self.context_window.plan(self.messages)
+        if plan is None:
+            return
+        summary_text = ""
+        if self.context_window.policy == "summarize":
+            summary_text = self.context_window.fallback_summary(plan)
+            if self.async_client is not None:
+                summary_request = [{"role": "user", "content": self.context_window.summarization_prompt(plan)}]
+                started_at = time.time()
+                try:
+                    model = self._admit(summary_request, self._models_for("summary")[0])
+                    api_response = await self._acreate(summary_request, model)
+                    summary_text = api_response.choices[0].message.content.strip() or summary_text
+                    usage = self._record_usage(api_response.usage, summary_request, summary_text)
+                    self._record_call("summary", started_at, usage=usage, ttft=time.time() - started_at, model=model)
+                except Exception as e:
+                    self._record_call("summary", started_at, outcome="error", error=str(e))
+                    # Keep the extractive fallback summary
+        self.messages = self.context_window.assemble(plan, summary_text)
+
+    def chat(self, prompt, response_format=None, interaction=None):
+        """
+        Sends the prompt with the conversation history and returns the assistant's reply.
+        'response_format' is passed through to the provider (e.g. a JSON schema for structured output).
+        'interaction' (e.g. "answer", "ranking") selects the model route when the agent has a router.
+        """
         self.messages.append({"role": "user", "content": prompt})
+        self._compact_context()
+        started_at = time.time()
+        request_options = {"response_format": response_format} if response_format else {}
+        cached_response = self._cached_response(self._models_for(interaction)[0], request_options)
+        if cached_response is not None:
+            self.messages.append({"role": "assistant", "content": cached_response})
+            self._record_call("chat", started_at, outcome="cache_hit")
+            return cached_response
+        history, history_epoch = list(self.messages), self._history_epoch
         try:
             # Ensure the client is not None (API key might not be set)
             if self.client is None:
-                st.error(f"API Client for agent {self.name} is not initialized. Please check API key.")
+                logger.error("API Client for agent %s is not initialized. Please check API key.", self.name)
+                self._discard_prompt(history_epoch)
+                self._record_call("chat", started_at, outcome="error", error="API client not initialized")
+                return "Error: API client not initialized."
+            api_response, shared, model = self._complete_routed(self._request_messages(), interaction, **request_options)
+            assistant_response_content = api_response.choices[0].message.content
+            if shared: # Tokens were paid for (and recorded) by the leader
+                self._record_call("chat", started_at, ttft=time.time() - started_at, outcome="coalesced", model=model)
+            else:
+                usage = self._record_usage(api_response.usage, history, assistant_response_content)
+                # Not streamed: the first token arrives with the whole reply
+                self._record_call("chat", started_at, usage=usage, ttft=time.time() - started_at, model=model)
+            self._cache_response(history, assistant_response_content, model, request_options)
+            self._append_reply(history_epoch, assistant_response_content)
+            return assistant_response_content
+        except Exception as e:
+            logger.error("Error during API call for agent %s: %s", self.name, e)
+            self._discard_prompt(history_epoch) # Retries are exhausted; keep the history as if the turn never happened
+            self._record_call("chat", started_at, outcome="error", error=str(e))
+            return f"Error: Could not get a response. Details: {str(e)}"
+
+    async def achat(self, prompt, response_format=None, interaction=None):
+        """
+        Async counterpart of chat() backed by the AsyncOpenAI client.
+        Awaiting it does not pin a thread while the completion is pending,
+        so many agents' turns can share one event loop.
+        """
+        self.messages.append({"role": "user", "content": prompt})
+        await self._acompact_context()
+        started_at = time.time()
+        request_options = {"response_format": response_format} if response_format else {}
+        cached_response = self._cached_response(self._models_for(interaction)[0], request_options)
+        if cached_response is not None:
+            self.messages.append({"role": "assistant", "content": cached_response})
+            self._record_call("chat", started_at, outcome="cache_hit")
+            return cached_response
+        history, history_epoch = list(self.messages), self._history_epoch
+        try:
+            if self.async_client is None:
+                logger.error("Async API Client for agent %s is not initialized. Please check API key.", self.name)
+                self._discard_prompt(history_epoch)
+                self._record_call("chat", started_at, outcome="error", error="API client not initialized")
                 return "Error: API client not initialized."
-            api_response = self.client.chat.completions.create(
-                model=self.model, messages=self.messages
-            )
+            api_response, shared, model = await self._acomplete_routed(self._request_messages(), interaction, **request_options)
             assistant_response_content = api_response.choices[0].message.content
-            self.messages.append(
-                {"role": "assistant", "content": assistant_response_content}
-            )
+            if shared: # Tokens were paid for (and recorded) by the leader
+                self._record_call("chat", started_at, ttft=time.time() - started_at, outcome="coalesced", model=model)
+            else:
+                usage = self._record_usage(api_response.usage, history, assistant_response_content)
+                self._record_call("chat", started_at, usage=usage, ttft=time.time() - started_at, model=model)
+            self._cache_response(history, assistant_response_content, model, request_options)
+            self._append_reply(history_epoch, assistant_response_content)
             return assistant_response_content
         except Exception as e:
-            st.error(f"Error during API call for agent {self.name}: {e}")
-            error_message = f"Error: Could not get a response. Details: {str(e)}"
-            self.messages.append({"role": "assistant", "content": error_message})
-            return error_message
+            logger.error("Error during API call for agent %s: %s", self.name, e)
+            self._discard_prompt(history_epoch) # Retries are exhausted; keep the history as if the turn never happened
+            self._record_call("chat", started_at, outcome="error", error=str(e))
+            return f"Error: Could not get a response. Details: {str(e)}"
+
+    def chat_stream(self, prompt, interaction=None):
+        """
+        Streaming variant of chat(): yields the response text piece by piece as tokens arrive,
+        so it can be passed straight to st.write_stream.
+        The assembled response is appended to self.messages once the stream is exhausted.
+        """
+        self.messages.append({"role": "user", "content": prompt})
+        self._compact_context()
+        started_at = time.time()
+        models = self._models_for(interaction)
+        cached_response = self._cached_response(models[0])
+        if cached_response is not None:
+            self.messages.append({"role": "assistant", "content": cached_response})
+            self._record_call("stream", started_at, outcome="cache_hit")
+            yield cached_response
+            return
+        if self.client is None:
+            logger.error("API Client for agent %s is not initialized. Please check API key.", self.name)
+            self._discard_prompt(self._history_epoch)
+            self._record_call("stream", started_at, outcome="error", error="API client not initialized")
+            yield "Error: API client not initialized."
+            return
+
+        received_chunks = []
+        stream_usage = None
+        first_token_at = None
+        history, history_epoch = list(self.messages), self._history_epoch
+        request_messages = self._request_messages()
+        model_index = 0
+        attempt = 0
+        while True:
+            try:
+                model = self._admit(request_messages, models[model_index])
+            except BudgetExceeded as e:
+                logger.warning("Call of agent %s refused: %s", self.name, e)
+                self._discard_prompt(history_epoch)
+                self._record_call("stream", started_at, outcome="error", error=str(e))
+                yield f"Error: Could not get a response. Details: {str(e)}"
+                return
+            attempt_started_at = time.time()
+            retry_delay = None
+            # The in-flight slot is held until the stream is exhausted
+            slot = (self.rate_limiter.slot(self._estimated_call_tokens(request_messages))
+                    if self.rate_limiter is not None else contextlib.nullcontext({}))
+            with slot as reservation:
+                try:
+                    stream = self.client.chat.completions.create(
+                        model=model, messages=request_messages, stream=True,
+                        stream_options={"include_usage": True}, # Usage arrives in a final chunk without choices
+                    )
+                    for chunk in stream:
+                        if getattr(chunk, "usage", None) is not None:
+                            stream_usage = chunk.usage
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if first_token_at is None:
+                                first_token_at = time.time()
+                            received_chunks.append(delta)
+                            yield delta
+                    reservation["actual_tokens"] = getattr(stream_usage, "total_tokens", None)
+                    break
+                except Exception as e:
+                    if self.rate_limiter is not None and not received_chunks: # Nothing shown yet, so it can be retried
+                        retry_delay = self.rate_limiter.retry_delay(attempt, e)
+                    if retry_delay is None:
+                        self._record_route(interaction, model, attempt_started_at, error=True, fallback=model_index > 0)
+                    if retry_delay is None and not received_chunks and model_index + 1 < len(models):
+                        logger.warning("Model %s failed for agent %s (%s); trying %s",
+                                       model, self.name, e, models[model_index + 1])
+                        model_index += 1 # Next model of the route, with a fresh retry budget
+                        attempt = 0
+                        continue
+                    if retry_delay is None:
+                        logger.error("Error during API call for agent %s: %s", self.name, e)
+                        self._discard_prompt(history_epoch)
+                        self._record_call("stream", started_at, outcome="error", error=str(e), model=model,
+                                          ttft=first_token_at - started_at if first_token_at else None)
+                        yield f"Error: Could not get a response. Details: {str(e)}"
+                        return
+            time.sleep(retry_delay)
+            attempt += 1
+
+        assistant_response_content = "".join(received_chunks)
+        self._record_route(interaction, model, attempt_started_at, stream_usage, fallback=model_index > 0)
+        usage = self._record_usage(stream_usage, history, assistant_response_content)
+        self._record_call("stream", started_at, usage=usage, model=model,
+                          ttft=first_token_at - started_at if first_token_at else None)
+        self._cache_response(history, assistant_response_content, model)
+        self._append_reply(history_epoch, assistant_response_content)
+
+    def replay(self, prompt, response):
+        """
+        Appends a prompt and its reply to the history as if chat() had produced them, without calling
+        the provider (e.g. a reply pre-generated in a lesson pack). Recorded as a cache hit.
+        """
+        self.messages.append({"role": "user", "content": prompt})
+        self.messages.append({"role": "assistant", "content": response})
+        self._record_call("replay", time.time(), outcome="cache_hit")
 
     def clear_messages(self, keep_system_prompt=True):
+        self._history_epoch += 1
         if keep_system_prompt and self.messages:
             self.messages = [self.messages[0]]
         else:
@@ -70,6 +538,16 @@ class Agent:
     def set_state(self, key, value):
         self.state[key] = value
 
+    # Async variants so orchestration code can treat every agent operation as awaitable
+    async def aclear_messages(self, keep_system_prompt=True):
+        self.clear_messages(keep_system_prompt)
+
+    async def aclear_state(self):
+        self.clear_state()
+
+    async def aset_state(self, key, value):
+        self.set_state(key, value)
+
 
 class UserAgent:
     def __init__(self, name, instruction="You are a student in the class."):
@@ -121,4 +599,61 @@ class UserAgent:
         pass
 
     def set_state(self, key, value):
-        pass
\ No newline at end of file
+        pass
+
+    async def aclear_messages(self, keep_system_prompt=True):
+        self.clear_messages(keep_system_prompt)
+
+    async def aclear_state(self):
+        pass
+
+    async def aset_state(self, key, value):
+        pass
+
+
+def student_agent_instructions(subject):
+    """Personas of the AI classmates, keyed by name."""
+    return {
+        "Marc": f"You are an enthusiastic and humorous student named Marc in a class about {subject}. You're an Emerging Mover which break the ice. You speak up first, offering initial ideas — even if rough or unpolished. Your value lies in creating momentum and encouraging others to react, refine, or build further. Keep responses concise. You use emojis to express your emotions",
+        "Paola": f"You are a knowledgeable student named Paola in a class about {subject}. You're a Reflective Bystanders observing before acting. You catch what others might miss and ensure shared understanding. Your quiet presence promotes thoughtful, inclusive learning. Keep responses concise. You use emojis to express your emotions",
+        "Alex": f"You are a curious student named Alex in a class about {subject}. You're a Selective Opposers challenging ideas with precision. You speak when you're confident, spotting flaws or offering sharper alternatives. Keep responses concise. You use emojis to express your emotions",
+    }
+
+
+def build_classroom_agents(client, model, subject, topic, user_name="User", async_client=None, cache=None,
+                           context_window=None, prompt_cache_breakpoints=False, rate_limiter=None, single_flight=None,
+                           telemetry=None, budget=None, router=None, hedger=None):
+    """Creates the teacher, the AI students and the user agent of one classroom, keyed by name."""
+    instructions = student_agent_instructions(subject)
+    ai_student_names = list(instructions.keys())
+    all_participant_names = ai_student_names + [user_name]
+    agent_options = {
+        "async_client": async_client, "cache": cache, "context_window": context_window,
+        "prompt_cache_breakpoints": prompt_cache_breakpoints, "rate_limiter": rate_limiter,
+        "single_flight": single_flight, "telemetry": telemetry,
+        "budget": budget, "router": router, "hedger": hedger,
+    }
+
+    agents = {}
+
+    # Teacher Agent
+    teacher_base_prompt = f"You are an experienced and engaging teacher leading a class on {subject}, specifically focusing on {topic}. Your goal is to educate, facilitate discussions, and assess student understanding. Be clear and encouraging."
+    agents["teacher"] = Agent(name="teacher", client=client, model=model, instruction=teacher_base_prompt, role="teacher",
+                              **agent_options)
+    teacher_protocol = INTERACTION_PROTOCOL.format(other_agents=", ".join(all_participant_names))
+    agents["teacher"].update_system_prompt_with_protocol(teacher_protocol)
+
+    # AI Student Agents
+    for name, instruction in instructions.items():
+        agents[name] = Agent(name=name, client=client, model=model, instruction=instruction, role="student",
+                             **agent_options)
+        student_sees_others = ["teacher"] + [p_name for p_name in all_participant_names if p_name != name]
+        student_protocol = INTERACTION_PROTOCOL.format(other_agents=", ".join(student_sees_others))
+        agents[name].update_system_prompt_with_protocol(student_protocol)
+
+    # User-controlled Agent
+    agents[user_name] = UserAgent(name=user_name, instruction=f"You are a student named {user_name} in a class on {subject}.")
+    user_sees_others = ["teacher"] + ai_student_names
+    user_protocol_for_user_agent = INTERACTION_PROTOCOL.format(other_agents=", ".join(user_sees_others))
+    agents[user_name].update_system_prompt_with_protocol(user_protocol_for_user_agent)
+    return agents
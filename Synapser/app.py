@@ -2,13 +2,28 @@
 import streamlit as st
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
 # import random # Not directly used in this version of app.py
 import time
-from agents import Agent, UserAgent, INTERACTION_PROTOCOL
+import uuid
+from agents import build_classroom_agents
 from quiz import run_streamlit_quiz
 from critical_thinking import run_streamlit_critical_thinking
-from utils import get_focal_points, display_media_content
+from utils import get_focal_points, display_media_content, lesson_image_urls
+from engine import OverviewMachine, focal_description_prompt, focal_points_prompt, run_jobs
+from llm_cache import ResponseCache
+from context import ContextWindow
+from llm_client import OPENROUTER_BASE_URL, get_client, get_async_client, key_fingerprint, validate_api_key
+from session_store import SessionRelease, SessionStore
+from rate_limit import get_rate_limiter
+from singleflight import get_single_flight
+from budget import TokenBudget
+from routing import ModelRouter, default_routes, load_prices, load_routes
+from hedging import Hedger
+from media_store import DEFAULT_MEDIA_DIR, MediaStore
+from media_catalog import DEFAULT_CATALOG_PATH, get_media_catalog
+from lesson_pack import DEFAULT_PACK_PATH, load_lesson_pack
+from telemetry import Telemetry, get_telemetry, module_scope, set_current_module
+from reruns import RerunProfiler, fragment_panel, get_rerun_profiler, rerun_panel
 
 # --- Constants ---
 SUBJECT = "The First Industrial Revolution"
@@ -16,10 +31,58 @@ TOPIC = "The Invention of the Steam Engine and its Societal Impact"
 MODEL_NAME = "mistralai/mistral-7b-instruct:free" # A free option
 # MODEL_NAME = "google/gemini-2.5-flash-preview" #     A capable model on OpenRouter (check for free tier if needed)
 USER_AGENT_NAME = "User" # Define the user's agent name
+USE_ASYNC_AGENTS = True # Run concurrent AI turns on one event loop (AsyncOpenAI) instead of a thread pool
+MAX_CONTEXT_TOKENS = 6000 # Per-agent history budget; older turns are folded into a rolling summary
+KEEP_RECENT_MESSAGES = 8 # Turns always sent verbatim
+PIPELINED_QUIZ = True # Prepare the next quiz question and AI answers while the user is answering
+STRUCTURED_QUIZ = True # Generate all quiz questions in one JSON response instead of one call per question
+DEMO_MODULES = { # Module tag of the LLM calls made by each page (telemetry)
+    "🎓 Classroom Overview": "overview",
+    "💡 Focal Points & Media": "focal",
+    "📝 Interactive Quiz": "quiz",
+    "🤔 Critical Thinking Challenge": "critical_thinking",
+}
 
 # Load environment variables from .env file  (override = True give priority to .env file instead of env in the O.S)
 load_dotenv(override=True) #
 
+# Opt-in response cache for deterministic prompts: set SYNAPSER_LLM_CACHE to an SQLite file path to enable it
+LLM_CACHE_PATH = os.getenv("SYNAPSER_LLM_CACHE", "")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("SYNAPSER_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Add cache_control breakpoints for providers that need explicit prompt-cache markers (Anthropic, Gemini on OpenRouter)
+PROMPT_CACHE_BREAKPOINTS = os.getenv("SYNAPSER_PROMPT_CACHE_BREAKPOINTS", "0") == "1"
+# OpenAI-compatible endpoint (e.g. a local mock provider for benchmarks)
+LLM_BASE_URL = os.getenv("SYNAPSER_BASE_URL", OPENROUTER_BASE_URL)
+# Keep-alive connections in the process-wide LLM client pool
+LLM_POOL_SIZE = int(os.getenv("SYNAPSER_LLM_POOL_SIZE", "20"))
+# Client-side limits shared by every session using the same API key (0 disables a bucket)
+RATE_LIMIT_RPM = int(os.getenv("SYNAPSER_RATE_LIMIT_RPM", "20"))
+RATE_LIMIT_TPM = int(os.getenv("SYNAPSER_RATE_LIMIT_TPM", "0"))
+MAX_IN_FLIGHT_PER_KEY = int(os.getenv("SYNAPSER_MAX_IN_FLIGHT", "8"))
+# Append-only session log so reconnects and restarts resume without new LLM calls. Off by default: anyone
+# holding a session id (it is in the URL) can replay that session (e.g. ".cache/sessions.sqlite3" enables it)
+SESSION_DB_PATH = os.getenv("SYNAPSER_SESSION_DB", "")
+# Local cache of the lesson images and their resized variants ("" hot-links the remote URLs instead)
+MEDIA_CACHE_DIR = os.getenv("SYNAPSER_MEDIA_CACHE", DEFAULT_MEDIA_DIR)
+# Manifest of the lesson images, diagrams and timelines (see media_catalog.py)
+MEDIA_CATALOG_PATH = os.getenv("SYNAPSER_MEDIA_CATALOG", DEFAULT_CATALOG_PATH)
+# Pre-generated lesson content (see lesson_pack.py); used when the file exists
+LESSON_PACK_PATH = os.getenv("SYNAPSER_LESSON_PACK", DEFAULT_PACK_PATH)
+# Optional JSON-lines file receiving one record per LLM call of every session
+TELEMETRY_LOG_PATH = os.getenv("SYNAPSER_TELEMETRY_LOG", "")
+# Model routing: AI students' short turns go to the fast model, the teacher's ranking, wrap-up and quiz
+# generation to the strong one. Both default to MODEL_NAME, so routing only changes models once they are set;
+# SYNAPSER_MODEL_ROUTES (JSON, see routing.py) overrides individual routes.
+FAST_MODEL = os.getenv("SYNAPSER_FAST_MODEL", MODEL_NAME)
+STRONG_MODEL = os.getenv("SYNAPSER_STRONG_MODEL", MODEL_NAME)
+MODEL_ROUTES = load_routes(os.getenv("SYNAPSER_MODEL_ROUTES", ""), default_routes(MODEL_NAME, FAST_MODEL, STRONG_MODEL))
+MODEL_PRICES = load_prices(os.getenv("SYNAPSER_MODEL_PRICES", "")) # USD per 1M prompt/completion tokens, for route costs
+# Hedged requests: "same" duplicates a call stuck in the latency tail to the same model, "alternate" to the
+# route's next model; the first response wins. "off" (default) disables hedging.
+HEDGING_MODE = os.getenv("SYNAPSER_HEDGING", "off")
+HEDGE_PERCENTILE = float(os.getenv("SYNAPSER_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MAX_RATE = float(os.getenv("SYNAPSER_HEDGE_MAX_RATE", "0.05")) # Share of calls that may be duplicated
+
 # --- Page Configuration ---
 st.set_page_config(
     page_title="AI Classroom Companion",
@@ -35,22 +98,104 @@ def init_session_state():
         st.session_state.api_key_valid = False
     if "client" not in st.session_state:
         st.session_state.client = None
+    if "async_client" not in st.session_state:
+        st.session_state.async_client = None
+    if "rate_limiter" not in st.session_state:
+        st.session_state.rate_limiter = None
+    if "api_key_fingerprint" not in st.session_state:
+        st.session_state.api_key_fingerprint = None
     if "agents" not in st.session_state:
         st.session_state.agents = {}
+    if "telemetry" not in st.session_state:
+        # Per-session call records (sidebar); the process-wide collector also receives them
+        st.session_state.telemetry = Telemetry(parent=get_telemetry(TELEMETRY_LOG_PATH))
+    if "rerun_profiler" not in st.session_state:
+        # Script-run timing of this session (sidebar); the process-wide profiler also receives the runs
+        st.session_state.rerun_profiler = RerunProfiler(parent=get_rerun_profiler())
+    if "token_budget" not in st.session_state:
+        # Tokens the session may spend (SYNAPSER_SESSION_TOKEN_BUDGET, unlimited by default); near the ceiling
+        # calls switch to the cheaper fallback model
+        st.session_state.token_budget = TokenBudget.from_env("SYNAPSER_SESSION_TOKEN_BUDGET", FAST_MODEL)
     if "focal_points" not in st.session_state:
         st.session_state.focal_points = []
     if "app_initialized" not in st.session_state: # Changed from "initialized" to avoid conflict
         st.session_state.app_initialized = False
     if "current_focal_point_descriptions" not in st.session_state:
         st.session_state.current_focal_point_descriptions = {} # Store {fp_text: description}
+    if "session_id" not in st.session_state:
+        # Kept in the URL so a reconnecting browser (or a restarted server) finds the same session log
+        st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex
+        st.query_params["session"] = st.session_state.session_id
     # quiz_state and ct_state are managed within their respective modules
 
 # Call initialization
 init_session_state()
+rerun_profiler = st.session_state.rerun_profiler
+rerun_profiler.begin("app") # Full run of the script; panel fragments time their own reruns
+
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache(path, ttl_seconds):
+    """One response cache per process, shared by every session's agents."""
+    return ResponseCache(path=path, ttl_seconds=ttl_seconds)
+
+response_cache = get_response_cache(LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS) if LLM_CACHE_PATH else None
+
+
+@st.cache_resource(show_spinner=False)
+def get_session_store(path):
+    """One session event log per process, shared by every session."""
+    return SessionStore(path=path)
+
+session_store = get_session_store(SESSION_DB_PATH) if SESSION_DB_PATH else None
+
+
+@st.cache_resource(show_spinner=False)
+def get_media_store(path):
+    """One media cache per process; images are downloaded once for every session."""
+    return MediaStore(root=path)
+
+media_store = get_media_store(MEDIA_CACHE_DIR) if MEDIA_CACHE_DIR else None
+media_catalog = get_media_catalog(MEDIA_CATALOG_PATH) # Loaded and indexed once per process
+
+
+@st.cache_resource(show_spinner=False)
+def get_lesson_pack(path):
+    """Lesson pack loaded once per process; None when there is no (readable) pack."""
+    return load_lesson_pack(path)
+
+lesson_pack = get_lesson_pack(LESSON_PACK_PATH)
+packed_lesson = lesson_pack.lesson(SUBJECT, TOPIC) if lesson_pack is not None else None # Replies served without the LLM
+
+
+@st.cache_resource(show_spinner=False)
+def get_model_router():
+    """One router per process, so the per-route statistics cover every session."""
+    return ModelRouter(MODEL_ROUTES, prices=MODEL_PRICES)
+
+model_router = get_model_router()
+
+
+@st.cache_resource(show_spinner=False)
+def get_hedger():
+    """One hedger per process: the latency percentiles and the hedge-rate cap span every session."""
+    if HEDGING_MODE not in ("same", "alternate"):
+        return None
+    return Hedger(percentile=HEDGE_PERCENTILE, max_hedge_rate=HEDGE_MAX_RATE, alternate_model=HEDGING_MODE == "alternate")
+
+hedger = get_hedger()
+
+
+def checkpoint_session():
+    """Appends this session's new messages and module state changes to the session log."""
+    if session_store is not None and st.session_state.app_initialized:
+        session_store.checkpoint(st.session_state.session_id, st.session_state.agents, st.session_state)
+        if "session_release" not in st.session_state: # The store forgets the session when Streamlit drops it
+            st.session_state.session_release = SessionRelease(session_store, st.session_state.session_id)
 
 
 # --- Sidebar for Configuration and Navigation ---
-with st.sidebar:
+with st.sidebar, rerun_profiler.section("sidebar"):
     st.image("media/logo.png", width=100) # Add a logo if you have one in media folder
     st.header("⚙️ Configuration")
     
@@ -64,26 +209,44 @@ with st.sidebar:
     )
 
     if api_key_input:
-        if st.session_state.client is None or not st.session_state.api_key_valid:
+        input_fingerprint = key_fingerprint(api_key_input)
+        if (st.session_state.client is None or not st.session_state.api_key_valid
+                or st.session_state.api_key_fingerprint != input_fingerprint):
             try:
-                st.session_state.client = OpenAI(
-                    base_url="https://openrouter.ai/api/v1",
-                    api_key=api_key_input,
+                # Test call to verify key (cached per process, so new sessions usually skip the round trip)
+                validate_api_key(api_key_input, base_url=LLM_BASE_URL, pool_size=LLM_POOL_SIZE)
+                # Pooled clients shared by every session using this key
+                st.session_state.client = get_client(api_key_input, base_url=LLM_BASE_URL, pool_size=LLM_POOL_SIZE)
+                if USE_ASYNC_AGENTS:
+                    st.session_state.async_client = get_async_client(
+                        api_key_input, base_url=LLM_BASE_URL, pool_size=LLM_POOL_SIZE
+                    )
+                st.session_state.rate_limiter = get_rate_limiter(
+                    input_fingerprint, requests_per_minute=RATE_LIMIT_RPM, tokens_per_minute=RATE_LIMIT_TPM,
+                    max_in_flight=MAX_IN_FLIGHT_PER_KEY
                 )
-                # Test call to verify key (optional, but good for UX)
-                st.session_state.client.models.list() 
                 st.session_state.api_key_valid = True
+                st.session_state.api_key_fingerprint = input_fingerprint
+                # Agents created with a previous key switch to the new clients
+                for agent_obj in st.session_state.agents.values():
+                    if hasattr(agent_obj, "client"):
+                        agent_obj.client = st.session_state.client
+                        agent_obj.async_client = st.session_state.async_client
+                        agent_obj.rate_limiter = st.session_state.rate_limiter
                 st.success("API key validated!")
                 # Persist the validated key for OpenRouter if needed by agents
                 os.environ["OPENROUTER_API_KEY"] = api_key_input 
             except Exception as e:
                 st.session_state.client = None
+                st.session_state.async_client = None
                 st.session_state.api_key_valid = False
+                st.session_state.api_key_fingerprint = None
                 st.error(f"Invalid API key or connection error: {e}")
     else:
         st.warning("API key is required to enable AI features.")
         st.session_state.api_key_valid = False
         st.session_state.client = None
+        st.session_state.async_client = None
 
 
     st.divider()
@@ -93,6 +256,108 @@ with st.sidebar:
         ["🎓 Classroom Overview", "💡 Focal Points & Media", "📝 Interactive Quiz", "🤔 Critical Thinking Challenge"],
         key="demo_selection"
     )
+    if response_cache is not None:
+        cache_stats = response_cache.stats
+        st.caption(
+            f"LLM cache: {cache_stats['memory_hits'] + cache_stats['disk_hits']} hits / "
+            f"{cache_stats['misses']} misses ({response_cache.hit_rate():.0%})"
+        )
+    if get_single_flight().avoided_calls():
+        st.caption(f"Coalesced: {get_single_flight().avoided_calls()} duplicate in-flight calls avoided")
+    if st.session_state.rate_limiter is not None:
+        limiter_stats = st.session_state.rate_limiter.stats
+        st.caption(
+            f"Rate limiter: {st.session_state.rate_limiter.in_flight} in flight · {limiter_stats['retries']} retries "
+            f"({limiter_stats['rate_limited']} rate-limited) · {limiter_stats['failures']} failed"
+        )
+    if st.session_state.app_initialized:
+        with st.expander("📊 Token Usage", expanded=False):
+            token_budget = st.session_state.token_budget
+            if token_budget.max_tokens:
+                st.progress(
+                    min(1.0, token_budget.fraction_used()),
+                    text=f"Session budget: {token_budget.used_tokens} / {token_budget.max_tokens} tokens"
+                )
+                if token_budget.stats["downgraded"] or token_budget.stats["refused"]:
+                    st.caption(
+                        f"{token_budget.stats['downgraded']} calls sent to {token_budget.fallback_model} · "
+                        f"{token_budget.stats['refused']} refused"
+                    )
+            for agent_name, agent_obj in st.session_state.agents.items():
+                if not hasattr(agent_obj, "token_usage"): # The user agent makes no LLM calls
+                    continue
+                usage = agent_obj.token_usage
+                last_call = agent_obj.last_call_usage
+                st.markdown(
+                    f"**{agent_name}**: {usage['calls']} calls, "
+                    f"{usage['prompt_tokens']} prompt + {usage['completion_tokens']} completion tokens"
+                )
+                st.caption(
+                    f"History ≈ {agent_obj.context_tokens()} tokens · {usage['cached_tokens']} prompt tokens served from provider cache"
+                    + (f" · last call {last_call['prompt_tokens']} + {last_call['completion_tokens']}" if last_call else "")
+                )
+        with st.expander("⏱️ Performance", expanded=False):
+            session_telemetry = st.session_state.telemetry
+            totals = session_telemetry.totals()
+            st.markdown(
+                f"**{totals['calls']} LLM calls** · {totals['latency_s']:.1f}s total · "
+                f"p50 {totals['p50_latency_s']:.2f}s · p95 {totals['p95_latency_s']:.2f}s · "
+                f"first token {totals['mean_ttft_s']:.2f}s avg"
+            )
+            st.caption(
+                f"{totals['prompt_tokens']} prompt + {totals['completion_tokens']} completion tokens · "
+                f"{totals['cache_hits']} cache hits · {totals['coalesced']} coalesced · {totals['errors']} errors"
+            )
+            for module_name, module_totals in sorted(totals["by_module"].items(), key=lambda item: -item[1]["latency_s"]):
+                st.caption(
+                    f"{module_name}: {module_totals['calls']} calls, {module_totals['latency_s']:.1f}s, "
+                    f"{module_totals['tokens']} tokens"
+                )
+            slowest_calls = session_telemetry.slowest(5)
+            if slowest_calls:
+                st.markdown("**Slowest calls**")
+                for call in slowest_calls:
+                    st.caption(
+                        f"{call['latency_s']:.2f}s · {call['agent']} · {call['module']} · {call['kind']}"
+                        + (f" · {call['error'][:60]}" if call["error"] else "")
+                    )
+            route_rows = model_router.summary()
+            if route_rows:
+                st.markdown("**Model routes** (all sessions)")
+                for row in route_rows:
+                    st.caption(
+                        f"{row['route']} → {row['model']}: {row['calls']} calls, {row['mean_latency_s']:.2f}s avg, "
+                        f"{row['tokens']} tokens, ${row['cost_usd']:.4f}"
+                        + (f" · {row['errors']} errors" if row["errors"] else "")
+                        + (f" · {row['fallbacks']} as fallback" if row["fallbacks"] else "")
+                    )
+            rerun_totals = rerun_profiler.totals()
+            st.markdown("**Script runs**")
+            for scope, label in (("app", "Full runs"), ("fragment", "Panel reruns")):
+                scope_totals = rerun_totals["by_scope"][scope]
+                if scope_totals["runs"]:
+                    st.caption(
+                        f"{label}: {scope_totals['runs']} · p50 {scope_totals['p50_s'] * 1000:.0f} ms · "
+                        f"p95 {scope_totals['p95_s'] * 1000:.0f} ms · {scope_totals['total_s']:.1f}s total"
+                    )
+            for (module_name, scope), module_totals in rerun_totals["by_module"].items():
+                st.caption(
+                    f"{module_name} ({'full' if scope == 'app' else 'panel'}): {module_totals['runs']} runs, "
+                    f"p50 {module_totals['p50_s'] * 1000:.0f} ms"
+                )
+            if rerun_totals["sections"]:
+                st.caption("Mean per section: " + " · ".join(
+                    f"{name} {seconds * 1000:.0f} ms" for name, seconds in rerun_totals["sections"].items()
+                ))
+            if hedger is not None and hedger.stats["hedged"]:
+                st.caption(
+                    f"Hedged: {hedger.stats['hedged']} of {hedger.stats['calls']} calls, "
+                    f"{hedger.stats['hedge_wins']} won by the duplicate, {hedger.stats['discarded_tokens']} tokens discarded"
+                )
+            st.download_button("Export calls (JSONL)", session_telemetry.to_jsonl(), file_name="synapser_calls.jsonl",
+                               mime="application/x-ndjson", key="telemetry_jsonl")
+            st.download_button("Export metrics (Prometheus)", session_telemetry.prometheus() + rerun_profiler.prometheus(),
+                               file_name="synapser_metrics.prom", mime="text/plain", key="telemetry_prometheus")
     st.divider()
     st.markdown("<sub>Powered by AI Classroom Companion v0.2</sub>", unsafe_allow_html=True)
 
@@ -107,48 +372,46 @@ def initialize_classroom_agents():
         return True
 
     with st.spinner("Setting up the AI classroom... Please wait."):
-        student_agent_instructions = {
-            "Marc": f"You are an enthusiastic and humorous student named Marc in a class about {SUBJECT}. You're an Emerging Mover which break the ice. You speak up first, offering initial ideas — even if rough or unpolished. Your value lies in creating momentum and encouraging others to react, refine, or build further. Keep responses concise. You use emojis to express your emotions",
-            "Paola": f"You are a knowledgeable student named Paola in a class about {SUBJECT}. You're a Reflective Bystanders observing before acting. You catch what others might miss and ensure shared understanding. Your quiet presence promotes thoughtful, inclusive learning. Keep responses concise. You use emojis to express your emotions",
-            "Alex": f"You are a curious student named Alex in a class about {SUBJECT}. You're a Selective Opposers challenging ideas with precision. You speak when you're confident, spotting flaws or offering sharper alternatives. Keep responses concise. You use emojis to express your emotions",
-        }
-        ai_student_names = list(student_agent_instructions.keys())
-        all_participant_names = ai_student_names + [USER_AGENT_NAME]
-
-        temp_agents = {}
-
-        # Teacher Agent
-        teacher_base_prompt = f"You are an experienced and engaging teacher leading a class on {SUBJECT}, specifically focusing on {TOPIC}. Your goal is to educate, facilitate discussions, and assess student understanding. Be clear and encouraging."
-        temp_agents["teacher"] = Agent(
-            name="teacher", client=st.session_state.client, model=MODEL_NAME, instruction=teacher_base_prompt
+        context_window = ContextWindow(max_tokens=MAX_CONTEXT_TOKENS, keep_recent_messages=KEEP_RECENT_MESSAGES)
+        temp_agents = build_classroom_agents(
+            st.session_state.client, MODEL_NAME, SUBJECT, TOPIC, user_name=USER_AGENT_NAME,
+            async_client=st.session_state.async_client, cache=response_cache, context_window=context_window,
+            prompt_cache_breakpoints=PROMPT_CACHE_BREAKPOINTS, rate_limiter=st.session_state.rate_limiter,
+            single_flight=get_single_flight(), telemetry=st.session_state.telemetry,
+            budget=st.session_state.token_budget, router=model_router,
+            hedger=hedger
         )
-        teacher_protocol = INTERACTION_PROTOCOL.format(other_agents=", ".join(all_participant_names))
-        temp_agents["teacher"].update_system_prompt_with_protocol(teacher_protocol)
-
-        # AI Student Agents
-        for name, instruction in student_agent_instructions.items():
-            temp_agents[name] = Agent(name=name, client=st.session_state.client, model=MODEL_NAME, instruction=instruction)
-            student_sees_others = ["teacher"] + [p_name for p_name in all_participant_names if p_name != name]
-            student_protocol = INTERACTION_PROTOCOL.format(other_agents=", ".join(student_sees_others))
-            temp_agents[name].update_system_prompt_with_protocol(student_protocol)
-
-        # User-controlled Agent
-        temp_agents[USER_AGENT_NAME] = UserAgent(
-            name=USER_AGENT_NAME, instruction=f"You are a student named {USER_AGENT_NAME} in a class on {SUBJECT}."
-        )
-        user_sees_others = ["teacher"] + ai_student_names
-        user_protocol_for_user_agent = INTERACTION_PROTOCOL.format(other_agents=", ".join(user_sees_others))
-        temp_agents[USER_AGENT_NAME].update_system_prompt_with_protocol(user_protocol_for_user_agent)
         
         st.session_state.agents = temp_agents
+
+        # Resume a previous run of this session from its log (no provider calls), if there is one
+        restored = session_store is not None and session_store.restore(
+            st.session_state.session_id, temp_agents, st.session_state
+        )
+        if restored and st.session_state.focal_points:
+            if media_store is not None:
+                media_store.prefetch(lesson_image_urls(st.session_state.focal_points, SUBJECT, media_catalog))
+            st.session_state.app_initialized = True
+            st.success("Welcome back! Your classroom session was restored.")
+            st.rerun()
         
-        # Get focal points early
-        fetched_focal_points = get_focal_points(st.session_state.agents["teacher"], SUBJECT, TOPIC, num_focal_points=3)
+        # Get focal points early (from the lesson pack when it has them)
+        focal_prompt = focal_points_prompt(SUBJECT, TOPIC, 3)
+        packed_focal_points = packed_lesson.focal_points(focal_prompt) if packed_lesson is not None else None
+        if packed_focal_points:
+            fetched_focal_points, focal_reply = packed_focal_points
+            st.session_state.agents["teacher"].replay(focal_prompt, focal_reply)
+        else:
+            with module_scope("focal"):
+                fetched_focal_points = get_focal_points(st.session_state.agents["teacher"], SUBJECT, TOPIC, num_focal_points=3)
         st.session_state.focal_points = fetched_focal_points
         st.session_state.agents["teacher"].set_state("focal_points_list", fetched_focal_points)
+        if media_store is not None: # Images are downloaded and resized while the student is in the overview
+            media_store.prefetch(lesson_image_urls(fetched_focal_points, SUBJECT, media_catalog))
 
 
         st.session_state.app_initialized = True
+        checkpoint_session()
         st.success("AI Classroom is ready!")
         time.sleep(1) # Let user see the success message
         st.rerun() # Rerun to reflect initialized state
@@ -157,7 +420,130 @@ def initialize_classroom_agents():
 
 # Attempt to initialize agents if API key is valid and not already done
 if st.session_state.api_key_valid and not st.session_state.app_initialized:
-    initialize_classroom_agents()
+    with rerun_profiler.section("init"):
+        initialize_classroom_agents()
+
+
+# --- Module Panels ---
+# Each panel is a Streamlit fragment: its buttons rerun the panel only, not the sidebar and the whole page
+def module_panel(module):
+    return fragment_panel(module, lambda: st.session_state.rerun_profiler, after_rerun=checkpoint_session)
+
+
+@module_panel("overview")
+def render_overview_interaction(ai_students_only_names, all_students_with_user_names):
+    teacher_agent = st.session_state.agents["teacher"]
+    user_as_agent = st.session_state.agents[USER_AGENT_NAME]
+    st.subheader("📝 Sample Interaction: What is a Steam Engine?")
+    overview_machine = OverviewMachine(all_students_with_user_names)
+
+    if "overview_interaction" not in st.session_state:
+         st.session_state.overview_interaction = overview_machine.initial_state()
+
+    interaction_state = st.session_state.overview_interaction
+
+    def dispatch_overview(event):
+        st.session_state.overview_interaction = overview_machine.apply(st.session_state.overview_interaction, event)
+        return st.session_state.overview_interaction
+
+    with st.chat_message("teacher", avatar="🧑‍🏫"):
+        st.markdown(interaction_state["question"])
+
+    # AI student responses (get them if not already present, all at once)
+    response_slots = {}
+    for student_name in ai_students_only_names:
+        with st.chat_message(student_name, avatar="🤖" if student_name == "Marc" else "🧐"): # Specific avatars
+            response_slots[student_name] = st.empty()
+        if student_name in interaction_state["responses"]:
+            response_slots[student_name].markdown(interaction_state["responses"][student_name])
+        else:
+            response_slots[student_name].markdown(f"*{student_name} is typing...*")
+
+    def show_response(job, response):
+        dispatch_overview({"type": "llm_result", "job_id": job.job_id, "text": response})
+        response_slots[job.agent_name].markdown(response)
+
+    run_jobs(st.session_state.agents, overview_machine.pending_jobs(interaction_state), on_result=show_response,
+             packed=packed_lesson)
+    interaction_state = st.session_state.overview_interaction
+
+    # User response
+    user_response_overview = st.text_input("Your brief explanation:", key="overview_user_response")
+    if st.button("Send My Explanation", key="overview_submit"):
+        if user_response_overview.strip():
+            interaction_state = dispatch_overview({"type": "user_response", "text": user_response_overview})
+            user_as_agent.add_message("assistant", user_response_overview) # Log it
+
+            # Teacher feedback
+            with st.spinner("Teacher is preparing feedback..."):
+                for event in run_jobs(st.session_state.agents, overview_machine.pending_jobs(interaction_state)):
+                    interaction_state = dispatch_overview(event) # Rendered below, no rerun needed
+        else:
+            st.warning("Please enter your explanation.")
+
+    if USER_AGENT_NAME in interaction_state["responses"]:
+         with st.chat_message(USER_AGENT_NAME, avatar="🧑‍💻"):
+            st.markdown(interaction_state["responses"][USER_AGENT_NAME])
+
+
+    if interaction_state["feedback"]:
+        with st.chat_message("teacher", avatar="🧑‍🏫"):
+            st.markdown("**Teacher's Feedback:**")
+            st.markdown(interaction_state["feedback"])
+
+    if st.button("Clear Sample Interaction", key="clear_overview"):
+        del st.session_state.overview_interaction
+        # Optionally clear agent messages related to this interaction if needed
+        for name in ai_students_only_names:
+            st.session_state.agents[name].clear_messages()
+        teacher_agent.clear_messages()
+        user_as_agent.clear_messages()
+        rerun_panel()
+
+
+@module_panel("focal")
+def render_focal_point(i, fp_text):
+    teacher_agent = st.session_state.agents["teacher"]
+    user_as_agent = st.session_state.agents[USER_AGENT_NAME]
+    with st.expander(f"**Focal Point {i+1}: {fp_text}**", expanded=(i==0)):
+        # Get description for the focal point if not already fetched
+        if fp_text not in st.session_state.current_focal_point_descriptions:
+            # teacher_agent.clear_messages() # Make it stateless or provide context
+            desc_prompt = focal_description_prompt(fp_text, SUBJECT, TOPIC)
+            description = (packed_lesson.reply(f"focal_description:{fp_text}", desc_prompt)
+                           if packed_lesson is not None else None)
+            if description is not None: # Pre-generated in the lesson pack
+                teacher_agent.replay(desc_prompt, description)
+                st.markdown(description)
+            else:
+                description = st.write_stream(teacher_agent.chat_stream(desc_prompt, interaction="focal_description")) # Rendered progressively
+            st.session_state.current_focal_point_descriptions[fp_text] = description
+        else:
+            st.markdown(st.session_state.current_focal_point_descriptions[fp_text])
+
+        st.subheader("Visual Aid & Media")
+        display_media_content(fp_text, i, media_store=media_store, subject=SUBJECT, catalog=media_catalog) # From utils.py
+
+        st.subheader("Quick Check")
+        q_key = f"fp_q_{i}"
+        fp_question = f"In one sentence, what is the main takeaway regarding '{fp_text}'?"
+        user_fp_answer = st.text_input(fp_question, key=q_key)
+
+        if st.button("Submit Takeaway", key=f"fp_submit_{i}"):
+            if user_fp_answer.strip():
+                user_as_agent.add_message("assistant", user_fp_answer)
+                with st.spinner("Teacher is reviewing your takeaway..."):
+                    # teacher_agent.clear_messages()
+                    feedback_prompt = f"A student provided this takeaway for the focal point '{fp_text}': '{user_fp_answer}'. Is this a good summary? Provide brief, encouraging feedback (1-2 sentences)."
+                    feedback = teacher_agent.chat(feedback_prompt, interaction="takeaway_feedback")
+                st.success(f"Teacher's Feedback: {feedback}")
+            else:
+                st.warning("Please enter your takeaway.")
+        st.divider()
+
+
+quiz_panel = module_panel("quiz")(run_streamlit_quiz)
+critical_thinking_panel = module_panel("critical_thinking")(run_streamlit_critical_thinking)
 
 
 # --- Main Content Area ---
@@ -172,9 +558,10 @@ elif not st.session_state.app_initialized:
 else:
     # Classroom is initialized, proceed with selected demo option
     teacher_agent = st.session_state.agents["teacher"]
-    user_as_agent = st.session_state.agents[USER_AGENT_NAME]
     ai_students_only_names = [name for name in st.session_state.agents.keys() if name not in ["teacher", USER_AGENT_NAME]]
     all_students_with_user_names = ai_students_only_names + [USER_AGENT_NAME]
+    set_current_module(DEMO_MODULES[demo_option]) # Tags this run's LLM calls (and the threads they start)
+    rerun_profiler.tag(DEMO_MODULES[demo_option])
 
 
     if demo_option == "🎓 Classroom Overview":
@@ -197,66 +584,7 @@ else:
                     st.caption(st.session_state.agents[name].instruction.split('.')[0]) # Show first sentence of instruction
 
 
-        st.subheader("📝 Sample Interaction: What is a Steam Engine?")
-        sample_question = "Can anyone briefly explain what a steam engine is and its primary purpose during the Industrial Revolution?"
-        
-        if "overview_interaction" not in st.session_state:
-             st.session_state.overview_interaction = {"question": sample_question, "responses": {}, "feedback": None}
-
-        interaction_state = st.session_state.overview_interaction
-
-        with st.chat_message("teacher", avatar="🧑‍🏫"):
-            st.markdown(interaction_state["question"])
-
-        # AI student responses (get them if not already present)
-        for student_name in ai_students_only_names:
-            if student_name not in interaction_state["responses"]:
-                with st.spinner(f"{student_name} is typing..."):
-                    # student_agent.clear_messages() # Make it stateless for this question
-                    response = st.session_state.agents[student_name].chat(interaction_state["question"])
-                    interaction_state["responses"][student_name] = response
-            
-            with st.chat_message(student_name, avatar="🤖" if student_name == "Marc" else "🧐"): # Specific avatars
-                st.markdown(interaction_state["responses"][student_name])
-        
-        # User response
-        user_response_overview = st.text_input("Your brief explanation:", key="overview_user_response")
-        if st.button("Send My Explanation", key="overview_submit"):
-            if user_response_overview.strip():
-                interaction_state["responses"][USER_AGENT_NAME] = user_response_overview
-                user_as_agent.add_message("assistant", user_response_overview) # Log it
-                
-                # Teacher feedback
-                with st.spinner("Teacher is preparing feedback..."):
-                    feedback_prompt = f"The question was: '{interaction_state['question']}'\n"
-                    for name, resp_text in interaction_state["responses"].items():
-                        feedback_prompt += f"{name} answered: '{resp_text}'\n"
-                    feedback_prompt += "\nPlease provide a brief, consolidated feedback on these explanations, highlighting correct points and gently correcting any misconceptions. Address the class generally."
-                    # teacher_agent.clear_messages()
-                    feedback_text = teacher_agent.chat(feedback_prompt)
-                    interaction_state["feedback"] = feedback_text
-                st.rerun()
-            else:
-                st.warning("Please enter your explanation.")
-
-        if USER_AGENT_NAME in interaction_state["responses"]:
-             with st.chat_message(USER_AGENT_NAME, avatar="🧑‍💻"):
-                st.markdown(interaction_state["responses"][USER_AGENT_NAME])
-
-
-        if interaction_state["feedback"]:
-            with st.chat_message("teacher", avatar="🧑‍🏫"):
-                st.markdown("**Teacher's Feedback:**")
-                st.markdown(interaction_state["feedback"])
-        
-        if st.button("Clear Sample Interaction", key="clear_overview"):
-            del st.session_state.overview_interaction
-            # Optionally clear agent messages related to this interaction if needed
-            for name in ai_students_only_names:
-                st.session_state.agents[name].clear_messages()
-            teacher_agent.clear_messages()
-            user_as_agent.clear_messages()
-            st.rerun()
+        render_overview_interaction(ai_students_only_names, all_students_with_user_names)
 
 
     elif demo_option == "💡 Focal Points & Media":
@@ -266,54 +594,30 @@ else:
         if not st.session_state.focal_points:
             st.warning("Focal points are not yet defined. The teacher agent might be working on them or an error occurred.")
             if st.button("Try to Fetch Focal Points Again"):
-                st.session_state.focal_points = get_focal_points(teacher_agent, SUBJECT, TOPIC)
+                with module_scope("focal"):
+                    st.session_state.focal_points = get_focal_points(teacher_agent, SUBJECT, TOPIC)
                 st.rerun()
         else:
             for i, fp_text in enumerate(st.session_state.focal_points):
-                with st.expander(f"**Focal Point {i+1}: {fp_text}**", expanded=(i==0)):
-                    # Get description for the focal point if not already fetched
-                    if fp_text not in st.session_state.current_focal_point_descriptions:
-                        with st.spinner(f"Teacher is preparing details for: {fp_text}..."):
-                            # teacher_agent.clear_messages() # Make it stateless or provide context
-                            desc_prompt = f"Please provide a concise and engaging description (around 100-150 words) for the lesson's focal point: '{fp_text}'. Explain its significance in the context of {SUBJECT} and {TOPIC}."
-                            description = teacher_agent.chat(desc_prompt)
-                            st.session_state.current_focal_point_descriptions[fp_text] = description
-                    
-                    st.markdown(st.session_state.current_focal_point_descriptions[fp_text])
-                    
-                    st.subheader("Visual Aid & Media")
-                    display_media_content(fp_text, i) # From utils.py
-                    
-                    st.subheader("Quick Check")
-                    q_key = f"fp_q_{i}"
-                    fp_question = f"In one sentence, what is the main takeaway regarding '{fp_text}'?"
-                    user_fp_answer = st.text_input(fp_question, key=q_key)
-
-                    if st.button("Submit Takeaway", key=f"fp_submit_{i}"):
-                        if user_fp_answer.strip():
-                            user_as_agent.add_message("assistant", user_fp_answer)
-                            with st.spinner("Teacher is reviewing your takeaway..."):
-                                # teacher_agent.clear_messages()
-                                feedback_prompt = f"A student provided this takeaway for the focal point '{fp_text}': '{user_fp_answer}'. Is this a good summary? Provide brief, encouraging feedback (1-2 sentences)."
-                                feedback = teacher_agent.chat(feedback_prompt)
-                            st.success(f"Teacher's Feedback: {feedback}")
-                        else:
-                            st.warning("Please enter your takeaway.")
-                    st.divider()
+                render_focal_point(i, fp_text)
 
 
     elif demo_option == "📝 Interactive Quiz":
         st.header("📝 Interactive Quiz Time!")
         st.markdown(f"Test your knowledge about **{SUBJECT}**. The quiz will have {3} questions.") # Hardcoded num_questions for demo
-        run_streamlit_quiz(st.session_state.agents, SUBJECT, 3, all_students_with_user_names)
+        quiz_panel(st.session_state.agents, SUBJECT, 3, all_students_with_user_names, pipelined=PIPELINED_QUIZ,
+                   structured_generation=STRUCTURED_QUIZ)
 
 
     elif demo_option == "🤔 Critical Thinking Challenge":
         st.header("🤔 Critical Thinking Challenge")
         st.markdown(f"Engage in a deeper discussion about **{SUBJECT}**.")
-        run_streamlit_critical_thinking(st.session_state.agents, SUBJECT, all_students_with_user_names)
+        critical_thinking_panel(st.session_state.agents, SUBJECT, all_students_with_user_names, packed=packed_lesson)
 
 
+# Persist what this run changed (runs cut short by st.rerun() are picked up by the next run)
+checkpoint_session()
+
 # --- Footer ---
 st.divider()
 st.markdown(
@@ -324,4 +628,5 @@ st.markdown(
         Streamlit Framework
     </div>
     """, unsafe_allow_html=True
-)
\ No newline at end of file
+)
+rerun_profiler.end()
\ No newline at end of file
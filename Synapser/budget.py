@@ -0,0 +1,97 @@
+# budget.py
+import os
+import threading
+
+from context import estimate_tokens
+
+DEFAULT_DOWNGRADE_AT = 0.8  # Share of the budget after which calls go to the fallback model
+TRUNCATION_MARKER = " […]"
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class TokenBudget:
+    """
+    Token ceiling for one session (Streamlit) or classroom (server), shared by all its agents.
+    Calls are checked before they are sent, against the tokens already used plus a local estimate
+    of the new call; concurrent calls are not reserved, so the ceiling can be overshot by the calls
+    already in flight. Past 'downgrade_at' of the budget, calls use 'fallback_model' when one is set.
+    """
+
+    def __init__(self, max_tokens, fallback_model=None, downgrade_at=DEFAULT_DOWNGRADE_AT):
+        self.max_tokens = max_tokens  # 0 disables the ceiling
+        self.fallback_model = fallback_model
+        self.downgrade_at = downgrade_at
+        self.used_tokens = 0
+        self.stats = {"downgraded": 0, "refused": 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, variable, default_fallback_model=None):
+        """
+        Budget configured by the environment: 'variable' (e.g. SYNAPSER_SESSION_TOKEN_BUDGET) holds the
+        ceiling (unset or 0 disables it) and SYNAPSER_BUDGET_FALLBACK_MODEL the model used near it ("" for none).
+        """
+        fallback_model = os.getenv("SYNAPSER_BUDGET_FALLBACK_MODEL", default_fallback_model or "")
+        return cls(int(os.getenv(variable, "0")), fallback_model=fallback_model or None)
+
+    def fraction_used(self):
+        return self.used_tokens / self.max_tokens if self.max_tokens else 0.0
+
+    def remaining(self):
+        return max(0, self.max_tokens - self.used_tokens) if self.max_tokens else None
+
+    def admit(self, model, estimated_tokens):
+        """Returns the model to use for a call of about 'estimated_tokens'; raises BudgetExceeded when it does not fit."""
+        if not self.max_tokens:
+            return model
+        with self._lock:
+            if self.used_tokens + estimated_tokens > self.max_tokens:
+                self.stats["refused"] += 1
+                raise BudgetExceeded(
+                    f"Token budget exhausted ({self.used_tokens} of {self.max_tokens} tokens used)."
+                )
+            if self.fallback_model and self.used_tokens >= self.max_tokens * self.downgrade_at:
+                self.stats["downgraded"] += 1
+                return self.fallback_model
+        return model
+
+    def charge(self, tokens):
+        with self._lock:
+            self.used_tokens += tokens
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cuts 'text' to about 'max_tokens', on a word boundary, marking the cut."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:  # Longest prefix of words that fits with the marker
+        middle = (low + high + 1) // 2
+        if estimate_tokens(" ".join(words[:middle]) + TRUNCATION_MARKER) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low]) + TRUNCATION_MARKER
+
+
+def fit_texts(texts, max_tokens):
+    """
+    Shrinks a list of texts (e.g. every answer of a quiz) to about 'max_tokens' in total.
+    Short texts are kept whole; the remaining room is shared equally by the longer ones,
+    so one rambling answer cannot crowd out the others.
+    """
+    sizes = [estimate_tokens(text) for text in texts]
+    if sum(sizes) <= max_tokens:
+        return list(texts)
+    share, remaining_budget, remaining_texts = 0, max_tokens, len(texts)
+    for size in sorted(sizes):
+        share = remaining_budget // remaining_texts
+        if size > share:
+            break
+        remaining_budget -= size
+        remaining_texts -= 1
+    return [text if size <= share else truncate_to_tokens(text, max(1, share)) for text, size in zip(texts, sizes)]
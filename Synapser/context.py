@@ -0,0 +1,112 @@
+# context.py
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to a character heuristic
+    _ENCODING = None
+
+SUMMARY_PREFIX = "Summary of the earlier classroom conversation:"
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators added by the chat format
+
+
+def estimate_tokens(text):
+    """Approximate token count of a string (exact when tiktoken is installed)."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return max(1, len(text) // 4)
+
+
+def count_message_tokens(messages):
+    """Approximate prompt size of a chat message list."""
+    total = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):  # Content parts, e.g. with cache_control markers
+            content = "".join(part.get("text", "") for part in content)
+        total += estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    return total
+
+
+def is_summary_message(message):
+    return message.get("role") == "user" and str(message.get("content", "")).startswith(SUMMARY_PREFIX)
+
+
+class CompactionPlan:
+    """What ContextWindow.plan() decided to do with a message list that went over budget."""
+
+    def __init__(self, system_message, previous_summary, folded, recent):
+        self.system_message = system_message  # Pinned, never folded
+        self.previous_summary = previous_summary  # Text of the existing rolling summary ("" if none)
+        self.folded = folded  # Older turns leaving the window
+        self.recent = recent  # Turns kept verbatim
+
+
+class ContextWindow:
+    """
+    Token budget for an agent's conversation.
+    The system prompt and the most recent turns are always kept; older turns are
+    folded into a rolling summary ("summarize") or discarded ("drop") once the
+    history exceeds max_tokens.
+    """
+
+    def __init__(self, max_tokens=6000, keep_recent_messages=8, policy="summarize", summary_max_tokens=300):
+        if policy not in ("summarize", "drop"):
+            raise ValueError(f"Unknown context policy: {policy}")
+        self.max_tokens = max_tokens
+        self.keep_recent_messages = keep_recent_messages
+        self.policy = policy
+        self.summary_max_tokens = summary_max_tokens
+
+    def plan(self, messages):
+        """Returns a CompactionPlan when the messages exceed the budget, otherwise None."""
+        if count_message_tokens(messages) <= self.max_tokens:
+            return None
+
+        system_message = messages[0] if messages and messages[0]["role"] == "system" else None
+        rest = messages[1:] if system_message else list(messages)
+        previous_summary = ""
+        if rest and is_summary_message(rest[0]):
+            previous_summary = rest[0]["content"][len(SUMMARY_PREFIX):].strip()
+            rest = rest[1:]
+
+        # Shrink the verbatim window until it fits next to the system prompt and a summary,
+        # but always keep the latest message (the prompt being answered).
+        pinned_tokens = count_message_tokens([system_message] if system_message else [])
+        summary_allowance = self.summary_max_tokens if self.policy == "summarize" else 0
+        keep = min(self.keep_recent_messages, len(rest))
+        while keep > 1 and pinned_tokens + summary_allowance + count_message_tokens(rest[-keep:]) > self.max_tokens:
+            keep -= 1
+        keep = max(keep, 1) if rest else 0
+
+        folded = rest[:-keep] if keep else rest
+        if not folded:
+            return None  # Nothing left to fold; the recent turns alone are over budget
+        return CompactionPlan(system_message, previous_summary, folded, rest[len(rest) - keep:])
+
+    def assemble(self, plan, summary_text=""):
+        """Builds the compacted message list from a plan and (for "summarize") the new summary."""
+        compacted = [plan.system_message] if plan.system_message else []
+        if self.policy == "summarize" and summary_text:
+            # Sent as a user turn: several chat templates reject a second system message
+            compacted.append({"role": "user", "content": f"{SUMMARY_PREFIX}\n{summary_text}"})
+        return compacted + plan.recent
+
+    def summarization_prompt(self, plan):
+        """Prompt asking a model to merge the folded turns into the rolling summary."""
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in plan.folded)
+        previous = f"Current summary:\n{plan.previous_summary}\n\n" if plan.previous_summary else ""
+        return (
+            f"{previous}New conversation turns:\n{transcript}\n\n"
+            f"Update the summary so it covers everything above. Keep names, questions asked and key answers. "
+            f"Stay under {self.summary_max_tokens * 3 // 4} words and reply with the summary only."
+        )
+
+    def fallback_summary(self, plan):
+        """Extractive summary used when no model call is possible: clipped lines, newest last."""
+        budget_chars = self.summary_max_tokens * 4
+        lines = [plan.previous_summary] if plan.previous_summary else []
+        lines += [f"- {m['role']}: {' '.join(str(m['content']).split())[:200]}" for m in plan.folded]
+        summary = "\n".join(lines)
+        return summary[-budget_chars:]
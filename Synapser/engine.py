@@ -0,0 +1,845 @@
+# engine.py
+import ast
+import asyncio
+import contextvars
+import copy
+import json
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from budget import fit_texts
+from orchestration import MAX_CONCURRENT_TURNS, get_event_loop, run_concurrent_chats
+from telemetry import module_scope
+
+USER_NAME = "User"
+ANSWERS_PROMPT_TOKENS = 2500  # Room for the answers quoted in the ranking and wrap-up prompts; longer ones are cut
+
+
+class LLMJob:
+    """One LLM call a state machine is waiting for. The result is fed back as an "llm_result" event."""
+
+    def __init__(self, job_id, agent_name, prompt, kind, response_format=None):
+        self.job_id = job_id  # Deterministic, e.g. "answer:2:Marc", so results can be applied out of order
+        self.agent_name = agent_name
+        self.prompt = prompt
+        self.kind = kind
+        self.response_format = response_format
+
+    def __repr__(self):
+        return f"LLMJob({self.job_id!r}, agent={self.agent_name!r})"
+
+
+def llm_result(job, text):
+    return {"type": "llm_result", "job_id": job.job_id, "text": text}
+
+
+class TaskGraph:
+    """
+    Steps of a multi-phase exercise and the steps each one needs first. A step is done once its
+    result is in the machine's state; it is ready once every step it depends on is done. Steps of
+    the user are nodes like the others: they are ready when the user can answer, and the steps
+    depending on them wait for that answer while the rest of the graph keeps running.
+    """
+
+    def __init__(self):
+        self.nodes = {}  # {node_id: (owner, dependencies)}
+
+    def add(self, node_id, owner, depends_on=()):
+        self.nodes[node_id] = (owner, tuple(depends_on))
+
+    def ready(self, done):
+        """Nodes not done yet whose dependencies all are, in insertion order."""
+        return [
+            node_id for node_id, (_, dependencies) in self.nodes.items()
+            if node_id not in done and all(dependency in done for dependency in dependencies)
+        ]
+
+    def owner(self, node_id):
+        return self.nodes[node_id][0]
+
+
+# --- Quiz ---
+
+def build_question_prompt(question_formulation_instruction, previous_questions, question_number):
+    """Prompt asking the teacher for the next question, listing earlier ones to avoid repetition."""
+    previous_questions_summary = ""
+    if previous_questions:
+        previous_questions_summary = "You have already asked the following questions:\n"
+        for i, q_text in enumerate(previous_questions):
+            previous_questions_summary += f"- Q{i+1}: {q_text}\n"
+        previous_questions_summary += "\nPlease formulate a new, distinct question."
+    return f"{question_formulation_instruction}\n{previous_questions_summary}\nProvide Question {question_number}."
+
+
+def build_student_prompt(student_name, question_text):
+    return f'The teacher asks you, {student_name}: "{question_text}". Provide your answer.'
+
+
+def quiz_response_format(num_questions):
+    """JSON schema for generating the whole quiz in one structured response."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "quiz",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "questions": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "minItems": num_questions,
+                        "maxItems": num_questions,
+                    }
+                },
+                "required": ["questions"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def parse_quiz_questions(llm_output):
+    """Extracts the list of questions from the teacher's JSON reply (tolerates text around the JSON)."""
+    match = re.search(r"\{.*\}", llm_output or "", re.DOTALL)
+    if not match:
+        return []
+    try:
+        parsed = json.loads(match.group(0))
+    except ValueError:
+        return []
+    questions = parsed.get("questions") if isinstance(parsed, dict) else None
+    return questions if isinstance(questions, list) else []
+
+
+def validate_question(question, accepted_questions):
+    """Returns the cleaned question, or None if it is empty, too long, not a question or a repeat."""
+    if not isinstance(question, str):
+        return None
+    cleaned = question.strip().strip('"').strip()
+    if not cleaned or len(cleaned) > 400 or not cleaned.endswith("?"):
+        return None
+    normalized = " ".join(cleaned.lower().split())
+    if any(" ".join(q.lower().split()) == normalized for q in accepted_questions if q):
+        return None
+    return cleaned
+
+
+class QuizMachine:
+    """
+    Quiz flow as a pure state machine.
+    apply(state, event) returns a new state; pending_jobs(state) lists the LLM calls the state is waiting for.
+    Events: {"type": "llm_result", "job_id", "text"}, {"type": "user_answer", "text"}.
+    """
+
+    MAX_REPAIRS_PER_QUESTION = 2
+
+    def __init__(self, subject, num_questions, student_names, structured=False):
+        self.subject = subject
+        self.num_questions = num_questions
+        self.student_names = student_names  # Includes the user
+        self.ai_student_names = [name for name in student_names if name != USER_NAME]
+        self.structured = structured
+
+        self.question_formulation_instruction = f"""Your task is to act as a teacher for a quiz on {subject}.
+When prompted for 'Question X', formulate a distinct and clear question appropriate for the subject.
+Focus on different aspects of {subject} for each question.
+Your response should ONLY be the question itself, without any preamble like "Here is the question:"."""
+
+        self.final_ranking_instruction = f"""The quiz on {subject} has concluded.
+You have received answers from all students for {num_questions} questions.
+Based on all the answers provided (which will be summarized for you), your task is to:
+1. Rank the students ({', '.join(student_names)}) from 1st to last.
+2. Briefly explain the reasoning behind your ranking for each student, considering accuracy, thoughtfulness, and clarity.
+Start your response *exactly* with "Final Ranking:" for easy parsing.
+Example:
+Final Ranking:
+1. Paola - Consistently accurate and well-explained answers.
+2. User - Showed good understanding in later questions.
+3. Marc - Enthusiastic but sometimes incorrect.
+"""
+
+    def initial_state(self):
+        return {
+            "current_question_idx": 0, # Use index for questions list
+            "questions_text": [], # List to store question strings
+            "all_answers": {}, # {q_idx: {student_name: answer}}
+            "quiz_complete": False,
+            "final_ranking": None,
+            "teacher_feedback_on_answers": {}, # {q_idx: feedback_text}
+            "question_drafts": None, # Structured mode: [question or None] while items are being repaired
+            "question_repairs": {}, # Structured mode: {q_idx: attempts}
+        }
+
+    # Prompts
+
+    def quiz_prompt(self):
+        return f"""Your task is to act as a teacher preparing a quiz on {self.subject}.
+Write {self.num_questions} distinct and clear questions, each focusing on a different aspect of {self.subject}.
+Each question must be a single sentence ending with a question mark.
+Respond ONLY with JSON of the form {{"questions": ["Question 1?", "Question 2?"]}}."""
+
+    def repair_prompt(self, accepted_questions):
+        already_asked = "\n".join(f"- {q}" for q in accepted_questions if q)
+        return f"""Write one new quiz question about {self.subject}, different from these:
+{already_asked or "- (none yet)"}
+Respond with ONLY the question itself, ending with a question mark."""
+
+    def ranking_prompt(self, state):
+        answered = [(i, s_name, ans) for i in range(self.num_questions)
+                    for s_name, ans in state["all_answers"].get(i, {}).items()]
+        fitted = iter(fit_texts([ans for _, _, ans in answered], ANSWERS_PROMPT_TOKENS))
+        summary_for_ranking = ["Here are all the questions and answers for the quiz:"]
+        for i in range(self.num_questions):
+            summary_for_ranking.append(f"\nQuestion {i+1}: {state['questions_text'][i]}")
+            for s_name in state["all_answers"].get(i, {}):
+                summary_for_ranking.append(f"- {s_name}: {next(fitted)}")
+        summary_for_ranking.append(f"\n\n{self.final_ranking_instruction}")
+        return "\n".join(summary_for_ranking)
+
+    # Jobs
+
+    def pending_jobs(self, state):
+        if state["quiz_complete"]:
+            if state["final_ranking"] is None:
+                return [LLMJob("ranking", "teacher", self.ranking_prompt(state), "ranking")]
+            return []
+
+        idx = state["current_question_idx"]
+        if self.structured and not state["questions_text"]:
+            drafts = state["question_drafts"]
+            if drafts is None:
+                return [LLMJob("quiz_questions", "teacher", self.quiz_prompt(), "quiz_questions",
+                               response_format=quiz_response_format(self.num_questions))]
+            missing = [i for i, q in enumerate(drafts) if q is None]
+            if missing: # One repair at a time so each prompt lists every accepted question
+                return [LLMJob(f"repair:{missing[0]}", "teacher", self.repair_prompt(drafts), "question_repair")]
+
+        if idx >= len(state["questions_text"]):
+            prompt = build_question_prompt(self.question_formulation_instruction, state["questions_text"], idx + 1)
+            return [LLMJob(f"question:{idx}", "teacher", prompt, "question")]
+
+        question_text = state["questions_text"][idx]
+        answers = state["all_answers"].get(idx, {})
+        return [
+            LLMJob(f"answer:{idx}:{name}", name, build_student_prompt(name, question_text), "answer")
+            for name in self.ai_student_names if name not in answers
+        ]
+
+    def awaiting_user(self, state):
+        """True when the flow is blocked on the user's answer rather than on the LLM."""
+        return not state["quiz_complete"] and not self.pending_jobs(state)
+
+    def advance_preview(self, state):
+        """
+        The state as it will look once the user has answered the current question, without the answer.
+        Its pending jobs are what the pipelined quiz can prepare in the background.
+        """
+        preview = copy.deepcopy(state)
+        if preview["current_question_idx"] + 1 < self.num_questions:
+            preview["current_question_idx"] += 1
+        else:
+            preview["quiz_complete"] = True
+            preview["final_ranking"] = "" # Nothing to prefetch: the ranking needs the user's answer
+        return preview
+
+    # Transitions
+
+    def apply(self, state, event):
+        state = copy.deepcopy(state)
+        if event["type"] == "user_answer":
+            if state["quiz_complete"]:
+                return state # Late or duplicate submission
+            idx = state["current_question_idx"]
+            state["all_answers"].setdefault(idx, {})[USER_NAME] = event["text"]
+            state["current_question_idx"] += 1
+            if state["current_question_idx"] >= self.num_questions:
+                state["quiz_complete"] = True
+            return state
+
+        if event["type"] != "llm_result":
+            raise ValueError(f"Unknown quiz event: {event['type']}")
+        kind, *params = event["job_id"].split(":")
+        text = event["text"]
+        if kind == "question":
+            idx = int(params[0])
+            if idx == len(state["questions_text"]):
+                state["questions_text"].append(text)
+                state["all_answers"].setdefault(idx, {})
+        elif kind == "answer":
+            idx, name = int(params[0]), params[1]
+            state["all_answers"].setdefault(idx, {})[name] = text
+        elif kind == "ranking":
+            state["final_ranking"] = text
+        elif kind == "quiz_questions":
+            candidates = parse_quiz_questions(text)
+            drafts = []
+            for i in range(self.num_questions):
+                drafts.append(validate_question(candidates[i], drafts) if i < len(candidates) else None)
+            self._store_drafts(state, drafts)
+        elif kind == "repair":
+            idx = int(params[0])
+            drafts = state["question_drafts"]
+            attempts = state["question_repairs"].get(idx, 0) + 1
+            state["question_repairs"][idx] = attempts
+            question = validate_question(text, drafts)
+            if question is None and attempts >= self.MAX_REPAIRS_PER_QUESTION:
+                question = text.strip() # Keep the teacher's last answer rather than leaving a gap
+            drafts[idx] = question
+            self._store_drafts(state, drafts)
+        return state
+
+    def _store_drafts(self, state, drafts):
+        state["question_drafts"] = drafts
+        if all(q is not None for q in drafts):
+            state["questions_text"] = list(drafts)
+            for i in range(self.num_questions):
+                state["all_answers"].setdefault(i, {})
+
+
+# --- Critical thinking ---
+
+class CriticalThinkingMachine:
+    """
+    Critical-thinking exercise as a pure state machine over a TaskGraph: the teacher's question,
+    then one initial answer per student, then one elaboration per student on a peer's answer, then
+    the wrap-up. An elaboration only needs the elaborator's and its target's initial answers, so it
+    can start while other students (including the user) are still answering.
+    Events: {"type": "llm_result", "job_id", "text"}, {"type": "user_initial_answer", "text"},
+    {"type": "user_elaboration", "text"}.
+    """
+
+    def __init__(self, subject, student_names):
+        self.subject = subject
+        self.student_names = student_names  # Includes the user
+        self.num_students = len(student_names)
+
+        self.question_formulation_prompt = f"""Your task is to formulate a single, insightful, open-ended critical thinking question about {subject}.
+The question should encourage deep thought, diverse perspectives, and constructive discussion among students.
+Respond with ONLY the question itself. No preamble."""
+
+        self.final_feedback_prompt_header = f"""The critical thinking exercise on {subject} has concluded.
+You have the original question, all student initial answers, and their elaborations.
+Your task is to:
+1.  Provide a comprehensive wrap-up of the discussion, highlighting key themes or divergent viewpoints.
+2.  Offer constructive feedback to the students as a group, focusing on their critical thinking, the depth of their analysis, how well they built upon or challenged others' ideas, and their engagement.
+Avoid individual call-outs unless illustrating a general point positively.
+Start your response *exactly* with "Final Wrap-up and Feedback:" for parsing."""
+        self.graph = self._build_graph()
+
+    def _build_graph(self):
+        graph = TaskGraph()
+        graph.add("ct_question", "teacher")
+        for name in self.student_names:
+            graph.add(f"initial:{name}", name, depends_on=["ct_question"])
+        for elaborator, target in self.elaboration_pairs():
+            graph.add(f"elaboration:{elaborator}", elaborator, depends_on=[f"initial:{elaborator}", f"initial:{target}"])
+        graph.add("wrapup", "teacher", depends_on=[node_id for node_id in graph.nodes if node_id != "ct_question"])
+        return graph
+
+    def done_nodes(self, state):
+        done = {f"initial:{name}" for name in state["initial_answers"]}
+        done |= {f"elaboration:{name}" for name in state["elaborations"]}
+        if state["question"] is not None:
+            done.add("ct_question")
+        if state["final_feedback_text"]:
+            done.add("wrapup")
+        return done
+
+    def ready_nodes(self, state):
+        return self.graph.ready(self.done_nodes(state))
+
+    def awaiting_user(self, state):
+        """The user's steps that can be answered now ("initial:User", "elaboration:User")."""
+        return [node_id for node_id in self.ready_nodes(state) if self.graph.owner(node_id) == USER_NAME]
+
+    def stage(self, state):
+        """Stage shown to the user: formulate_question, initial_answers, elaboration or feedback."""
+        if state["question"] is None:
+            return "formulate_question"
+        if USER_NAME not in state["initial_answers"]:
+            return "initial_answers"
+        if len(state["elaborations"]) < len(self.elaboration_pairs()):
+            return "elaboration"
+        return "feedback"
+
+    def initial_state(self):
+        return {
+            "question": None,
+            "initial_answers": {},  # {student_name: answer_text}
+            "elaborations": {},  # {elaborator_name: {on_student: name, text: elaboration}}
+            "current_stage": "formulate_question",  # Stages: formulate_question, initial_answers, elaboration, feedback
+            "final_feedback_text": None,
+        }
+
+    def elaboration_pairs(self):
+        """(elaborator, student_to_elaborate_on): each student elaborates on the next one in the list."""
+        pairs = []
+        shuffled_students = self.student_names[:] # Create a mutable copy
+        # random.shuffle(shuffled_students) # Make it more dynamic
+        for i in range(self.num_students):
+            elaborator = shuffled_students[i]
+            elaborate_on_student = shuffled_students[(i + 1) % self.num_students]
+            if elaborator != elaborate_on_student: # Avoid self-elaboration if only 1 student
+                pairs.append((elaborator, elaborate_on_student))
+        return pairs
+
+    def user_elaboration_target(self):
+        return next((pair[1] for pair in self.elaboration_pairs() if pair[0] == USER_NAME), None)
+
+    def initial_answer_prompt(self, state):
+        return f'The teacher posed this critical thinking question: "{state["question"]}". Please provide your thoughtful initial answer.'
+
+    def elaboration_prompt(self, state, elaborated_on_name):
+        answer_to_elaborate = state["initial_answers"].get(elaborated_on_name, "Their answer was not found.")
+        return f"""Regarding the critical thinking question: "{state["question"]}"
+Your classmate, {elaborated_on_name}, provided this initial answer: "{answer_to_elaborate}"
+Please elaborate on {elaborated_on_name}'s perspective. You can build upon their points, offer a counter-argument, or explore a different facet. Be constructive."""
+
+    def wrapup_prompt(self, state):
+        fitted = iter(fit_texts(
+            list(state["initial_answers"].values()) + [elab["text"] for elab in state["elaborations"].values()],
+            ANSWERS_PROMPT_TOKENS,
+        ))
+        summary_for_feedback = [self.final_feedback_prompt_header]
+        summary_for_feedback.append(f"\nOriginal Question: {state['question']}")
+        summary_for_feedback.append("\n\nInitial Answers:")
+        for name in state["initial_answers"]:
+            summary_for_feedback.append(f"- {name}: {next(fitted)}")
+        summary_for_feedback.append("\n\nElaborations:")
+        for name, elab in state["elaborations"].items():
+            summary_for_feedback.append(f"- {name} (on {elab['on_student']}'s answer): {next(fitted)}")
+        return "\n".join(summary_for_feedback)
+
+    def job_for(self, state, node_id):
+        kind, _, name = node_id.partition(":")
+        if kind == "ct_question":
+            return LLMJob("ct_question", "teacher", self.question_formulation_prompt, "ct_question")
+        if kind == "initial":
+            return LLMJob(node_id, name, self.initial_answer_prompt(state), "initial_answer")
+        if kind == "elaboration":
+            return LLMJob(node_id, name, self.elaboration_prompt(state, dict(self.elaboration_pairs())[name]), "elaboration")
+        return LLMJob("wrapup", "teacher", self.wrapup_prompt(state), "wrapup")
+
+    def pending_jobs(self, state):
+        """LLM jobs of every ready node, whatever phase the other students are in."""
+        return [
+            self.job_for(state, node_id) for node_id in self.ready_nodes(state)
+            if self.graph.owner(node_id) != USER_NAME
+        ]
+
+    def apply(self, state, event):
+        state = copy.deepcopy(state)
+        if event["type"] == "user_initial_answer":
+            if f"initial:{USER_NAME}" not in self.awaiting_user(state):
+                return state # Late or duplicate submission
+            state["initial_answers"][USER_NAME] = event["text"]
+        elif event["type"] == "user_elaboration":
+            if f"elaboration:{USER_NAME}" not in self.awaiting_user(state):
+                return state
+            state["elaborations"][USER_NAME] = {"on_student": self.user_elaboration_target(), "text": event["text"]}
+        elif event["type"] == "llm_result":
+            kind, _, name = event["job_id"].partition(":")
+            if kind == "ct_question":
+                state["question"] = event["text"]
+            elif kind == "initial":
+                state["initial_answers"][name] = event["text"]
+            elif kind == "elaboration":
+                state["elaborations"][name] = {"on_student": dict(self.elaboration_pairs())[name], "text": event["text"]}
+            elif kind == "wrapup":
+                state["final_feedback_text"] = event["text"]
+        else:
+            raise ValueError(f"Unknown critical thinking event: {event['type']}")
+        state["current_stage"] = self.stage(state)
+        return state
+
+
+# --- Classroom overview ---
+
+class OverviewMachine:
+    """
+    Classroom overview sample interaction as a pure state machine.
+    Events: {"type": "llm_result", "job_id", "text"}, {"type": "user_response", "text"}.
+    """
+
+    SAMPLE_QUESTION = "Can anyone briefly explain what a steam engine is and its primary purpose during the Industrial Revolution?"
+
+    def __init__(self, student_names, question=SAMPLE_QUESTION):
+        self.student_names = student_names  # Includes the user
+        self.ai_student_names = [name for name in student_names if name != USER_NAME]
+        self.question = question
+
+    def initial_state(self):
+        return {"question": self.question, "responses": {}, "feedback": None}
+
+    def feedback_prompt(self, state):
+        feedback_prompt = f"The question was: '{state['question']}'\n"
+        fitted = fit_texts(list(state["responses"].values()), ANSWERS_PROMPT_TOKENS)
+        for name, resp_text in zip(state["responses"], fitted):
+            feedback_prompt += f"{name} answered: '{resp_text}'\n"
+        feedback_prompt += "\nPlease provide a brief, consolidated feedback on these explanations, highlighting correct points and gently correcting any misconceptions. Address the class generally."
+        return feedback_prompt
+
+    def pending_jobs(self, state):
+        jobs = [
+            LLMJob(f"response:{name}", name, state["question"], "overview_response")
+            for name in self.ai_student_names if name not in state["responses"]
+        ]
+        if not jobs and USER_NAME in state["responses"] and state["feedback"] is None:
+            jobs.append(LLMJob("feedback", "teacher", self.feedback_prompt(state), "overview_feedback"))
+        return jobs
+
+    def apply(self, state, event):
+        state = copy.deepcopy(state)
+        if event["type"] == "user_response":
+            state["responses"][USER_NAME] = event["text"]
+        elif event["type"] == "llm_result":
+            kind, _, name = event["job_id"].partition(":")
+            if kind == "response":
+                state["responses"][name] = event["text"]
+            elif kind == "feedback":
+                state["feedback"] = event["text"]
+        else:
+            raise ValueError(f"Unknown overview event: {event['type']}")
+        return state
+
+
+# --- Focal points ---
+
+def focal_points_prompt(subject, topic, num_focal_points=3):
+    return f"Identify the {num_focal_points} Key Concepts of the lesson on {subject} about {topic} and list them ordered by prerequisite logic. Output just a python list of strings. Example: ['Concept 1', 'Concept 2', 'Concept 3']"
+
+
+def parse_focal_points(llm_output):
+    """The list of focal points in the teacher's reply, or None when it has no Python list of strings."""
+    match = re.search(r"\[.*?\]", llm_output, re.DOTALL)
+    if not match:
+        return None
+    try:
+        focal_points = ast.literal_eval(match.group(0))
+    except (ValueError, SyntaxError):
+        return None
+    if isinstance(focal_points, list) and focal_points and all(isinstance(item, str) for item in focal_points):
+        return focal_points
+    return None
+
+
+def focal_description_prompt(focal_point, subject, topic):
+    return f"Please provide a concise and engaging description (around 100-150 words) for the lesson's focal point: '{focal_point}'. Explain its significance in the context of {subject} and {topic}."
+
+
+# --- Driver ---
+
+def serve_packed_jobs(agents, jobs, packed):
+    """
+    Answers the jobs a pre-generated lesson (lesson_pack.PackedLesson) holds a reply for, replaying
+    each exchange into its agent's history as if it had been sent. Returns (events, remaining jobs).
+    """
+    if packed is None:
+        return [], jobs
+    events, remaining_jobs = [], []
+    for job in jobs:
+        text = packed.reply(job.job_id, job.prompt)
+        if text is None:
+            remaining_jobs.append(job)
+            continue
+        agents[job.agent_name].replay(job.prompt, text)
+        events.append(llm_result(job, text))
+    return events, remaining_jobs
+
+
+def run_jobs(agents, jobs, on_result=None, reveal_delay=0.0, packed=None):
+    """
+    Executes LLM jobs and returns their "llm_result" events.
+    Jobs for different agents run concurrently; a structured (response_format) job runs on its own.
+    'on_result(job, text)' is called on the calling thread as each job finishes.
+    Jobs answered by the 'packed' lesson are delivered first, without a provider call.
+    """
+    jobs_by_id = {job.job_id: job for job in jobs}
+    events = []
+
+    def deliver(job_id, text):
+        events.append(llm_result(jobs_by_id[job_id], text))
+        if on_result is not None:
+            on_result(jobs_by_id[job_id], text)
+
+    packed_events, jobs = serve_packed_jobs(agents, jobs, packed)
+    for event in packed_events:
+        deliver(event["job_id"], event["text"])
+
+    plain_jobs = [job for job in jobs if job.response_format is None]
+    for job in jobs:
+        if job.response_format is not None:
+            deliver(job.job_id, agents[job.agent_name].chat(job.prompt, response_format=job.response_format,
+                                                            interaction=job.kind))
+    run_concurrent_chats(
+        [(job.job_id, agents[job.agent_name], job.prompt, job.kind) for job in plain_jobs],
+        on_result=deliver, reveal_delay=reveal_delay,
+    )
+    return events
+
+
+def one_job_per_agent(jobs):
+    """Keeps the first job of each agent so one agent's history never receives two turns at once."""
+    seen_agents = set()
+    batch = []
+    for job in jobs:
+        if job.agent_name not in seen_agents:
+            seen_agents.add(job.agent_name)
+            batch.append(job)
+    return batch
+
+
+_IDLE = object()  # Queued by GraphScheduler when its last job in flight finished
+
+
+class GraphScheduler:
+    """
+    Dataflow driver for a state machine: every job starts as soon as the machine reports it (its
+    inputs exist) and its agent is free, instead of waiting for the slowest job of a batch. Results
+    are applied to the scheduler's state as they arrive and queued as (job, event) for the caller;
+    user events go through dispatch() and start the jobs that were waiting for them. It keeps
+    running between Streamlit reruns, so a script only has to render what it produced.
+    'kinds' restricts the jobs it starts (e.g. to leave a streamed turn to the caller).
+    """
+
+    def __init__(self, machine, state, agents, packed=None, kinds=None, max_workers=MAX_CONCURRENT_TURNS):
+        self.machine = machine
+        self.agents = agents
+        self.packed = packed
+        self.kinds = kinds
+        self._state = state
+        self._in_flight = {}  # {job_id: LLMJob}
+        self._results = queue.Queue()
+        self._cancelled = False
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="graph-turn")
+        self._context = contextvars.copy_context()  # Every turn runs in a copy (e.g. the telemetry module tag)
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def start(self):
+        self._start_ready()
+        return self
+
+    def dispatch(self, event):
+        """Applies a user event and starts the jobs it unblocked; returns the new state."""
+        with self._lock:
+            self._state = self.machine.apply(self._state, event)
+            self._start_ready()
+            return self._state
+
+    def cancel(self):
+        """Starts no new job; replies still in flight are dropped."""
+        with self._lock:
+            self._cancelled = True
+            self._in_flight.clear()
+            self._results.put(_IDLE)
+        self._executor.shutdown(wait=False)
+
+    def _start_ready(self):
+        """
+        Starts the jobs that became ready. Called with the lock held by whoever changed the state, so
+        next_result() never sees a moment with a result read, nothing in flight and the next jobs not yet registered.
+        """
+        with self._lock:
+            if self._cancelled:
+                return
+            busy_agents = {job.agent_name for job in self._in_flight.values()}
+            jobs = one_job_per_agent([
+                job for job in self.machine.pending_jobs(self._state)
+                if job.job_id not in self._in_flight and job.agent_name not in busy_agents
+                and (self.kinds is None or job.kind in self.kinds)
+            ])
+            jobs_by_id = {job.job_id: job for job in jobs}
+            packed_events, jobs = serve_packed_jobs(self.agents, jobs, self.packed)
+            for event in packed_events:
+                self._state = self.machine.apply(self._state, event)
+                self._results.put((jobs_by_id[event["job_id"]], event))
+            for job in jobs: # All registered first: a turn answered at once (e.g. a cache hit) re-enters here
+                self._in_flight[job.job_id] = job
+            for job in jobs:
+                self._submit(job)
+            if packed_events:
+                self._start_ready() # Packed replies may have unblocked more jobs
+            elif not self._in_flight:
+                self._results.put(_IDLE)
+
+    def _submit(self, job):
+        agent = self.agents[job.agent_name]
+        if getattr(agent, "async_client", None) is not None: # The turn awaits on the shared event loop
+            future = self._context.copy().run(
+                asyncio.run_coroutine_threadsafe,
+                agent.achat(job.prompt, response_format=job.response_format, interaction=job.kind), get_event_loop(),
+            )
+        else:
+            future = self._executor.submit(self._context.copy().run, agent.chat, job.prompt,
+                                           response_format=job.response_format, interaction=job.kind)
+        future.add_done_callback(lambda done, job=job: self._finish(job, done))
+
+    def _finish(self, job, future):
+        try:
+            text = future.result()
+        except Exception as e: # Agent.chat already turns API errors into a message; this is anything else
+            text = f"Error: {e}"
+        with self._lock:
+            if self._cancelled or self._in_flight.pop(job.job_id, None) is None:
+                return
+            event = llm_result(job, text)
+            self._state = self.machine.apply(self._state, event)
+            self._results.put((job, event))
+            self._start_ready()
+
+    def idle(self):
+        with self._lock:
+            return not self._in_flight
+
+    def next_result(self):
+        """Blocks until a job finishes and returns (job, event); None once nothing is in flight and all results were read."""
+        while True:
+            with self._lock:
+                if not self._in_flight and self._results.empty():
+                    return None
+            item = self._results.get()
+            if item is not _IDLE:
+                return item
+
+    def results(self):
+        """Yields (job, event) as jobs finish, until the machine waits for the user (or is done)."""
+        while True:
+            item = self.next_result()
+            if item is None:
+                return
+            yield item
+
+    def close(self):
+        """Releases the worker threads once idle."""
+        self._executor.shutdown(wait=False)
+
+
+def run_until_idle(machine, state, agents, cancel_event=None, on_result=None, packed=None):
+    """
+    Runs the machine's LLM jobs until it waits for the user (or is done), each one as soon as its
+    inputs exist (see GraphScheduler). 'on_result(job, text)' is called on the calling thread.
+    Returns (state, events) so callers can replay the same events onto another copy of the state.
+    """
+    scheduler = GraphScheduler(machine, state, agents, packed=packed).start()
+    events = []
+    for job, event in scheduler.results():
+        if cancel_event is not None and cancel_event.is_set():
+            scheduler.cancel()
+            break
+        state = machine.apply(state, event)
+        events.append(event)
+        if on_result is not None:
+            on_result(job, event["text"])
+    scheduler.close()
+    return state, events
+
+
+async def _arun_job(agents, job, turn_slots=None):
+    agent = agents[job.agent_name]
+    if turn_slots is None:
+        return llm_result(job, await agent.achat(job.prompt, response_format=job.response_format, interaction=job.kind))
+    async with turn_slots:
+        return llm_result(job, await agent.achat(job.prompt, response_format=job.response_format, interaction=job.kind))
+
+
+async def arun_jobs(agents, jobs, turn_slots=None, packed=None):
+    """
+    Async counterpart of run_jobs() for callers already on an event loop (e.g. the classroom server).
+    'turn_slots' is an optional asyncio.Semaphore bounding agent turns in flight across all callers.
+    """
+    packed_events, jobs = serve_packed_jobs(agents, jobs, packed)
+    return packed_events + list(await asyncio.gather(*(_arun_job(agents, job, turn_slots) for job in jobs)))
+
+
+async def arun_until_idle(machine, state, agents, turn_slots=None, packed=None):
+    """Async counterpart of run_until_idle(): each job starts as soon as it is ready; returns (state, events)."""
+    events = []
+    in_flight = {}  # {task: LLMJob}
+    while True:
+        busy_agents = {job.agent_name for job in in_flight.values()}
+        running_ids = {job.job_id for job in in_flight.values()}
+        jobs = one_job_per_agent([
+            job for job in machine.pending_jobs(state)
+            if job.job_id not in running_ids and job.agent_name not in busy_agents
+        ])
+        packed_events, jobs = serve_packed_jobs(agents, jobs, packed)
+        for event in packed_events:
+            state = machine.apply(state, event)
+            events.append(event)
+        if packed_events:
+            continue # They may have unblocked more jobs
+        for job in jobs:
+            in_flight[asyncio.ensure_future(_arun_job(agents, job, turn_slots))] = job
+        if not in_flight:
+            return state, events
+        done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            in_flight.pop(task)
+            event = task.result()
+            state = machine.apply(state, event)
+            events.append(event)
+
+
+def clear_agent_histories(agents, names):
+    """Clears the conversation histories of the teacher and the given students (system prompts are kept)."""
+    for agent_name, agent_obj in agents.items():
+        if agent_name == "teacher" or agent_name in names:
+            agent_obj.clear_messages()
+
+
+class ClassroomEngine:
+    """
+    Headless classroom: Overview, Quiz and Critical Thinking machines plus their states and agents.
+    It can drive a whole classroom without Streamlit (batch runs, benchmarks, servers);
+    the Streamlit modules are views over the same machines.
+    """
+
+    MODULES = ("overview", "quiz", "critical_thinking")
+
+    def __init__(self, agents, subject, student_names, num_questions=3, structured_quiz=False, packed=None):
+        self.agents = agents
+        self.packed = packed  # Optional lesson_pack.PackedLesson answering the lesson's fixed turns
+        self.student_names = student_names
+        self.machines = {
+            "overview": OverviewMachine(student_names),
+            "quiz": QuizMachine(subject, num_questions, student_names, structured=structured_quiz),
+            "critical_thinking": CriticalThinkingMachine(subject, student_names),
+        }
+        self.states = {module: machine.initial_state() for module, machine in self.machines.items()}
+
+    def pending_jobs(self, module):
+        return self.machines[module].pending_jobs(self.states[module])
+
+    def dispatch(self, module, event):
+        """Applies a user or LLM event and returns the jobs the module now waits for."""
+        if event["type"] != "llm_result" and event.get("text") is not None and USER_NAME in self.agents:
+            self.agents[USER_NAME].add_message("assistant", event["text"]) # Log the user's contribution
+        self.states[module] = self.machines[module].apply(self.states[module], event)
+        return self.pending_jobs(module)
+
+    def run_until_idle(self, module, on_result=None):
+        """Runs LLM jobs until the module needs user input or is finished; returns the new state."""
+        with module_scope(module):
+            self.states[module], _ = run_until_idle(
+                self.machines[module], self.states[module], self.agents, on_result=on_result, packed=self.packed
+            )
+        return self.states[module]
+
+    async def arun_until_idle(self, module, turn_slots=None):
+        with module_scope(module):
+            self.states[module], _ = await arun_until_idle(
+                self.machines[module], self.states[module], self.agents, turn_slots=turn_slots, packed=self.packed
+            )
+        return self.states[module]
+
+    def restart(self, module):
+        clear_agent_histories(self.agents, self.student_names)
+        self.states[module] = self.machines[module].initial_state()
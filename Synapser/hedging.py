@@ -0,0 +1,154 @@
+# hedging.py
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import threading
+import time
+
+DEFAULT_PERCENTILE = 0.95  # A call slower than this share of recent calls gets a duplicate
+DEFAULT_MAX_HEDGE_RATE = 0.05  # At most this share of calls is duplicated (extra spend cap)
+MIN_SAMPLES = 20  # Latencies observed for a model before its calls are hedged
+LATENCY_WINDOW = 200  # Recent latencies kept per model
+MIN_HEDGE_DELAY = 0.5  # Seconds; never hedge earlier than this, whatever the percentile says
+
+
+class Hedger:
+    """
+    Hedged requests against the provider's latency tail. Each model's recent latencies are tracked;
+    a call still running after the configured percentile of them gets a duplicate request (to the
+    same model, or to the route's next model with 'alternate_model'), and the first successful
+    response wins. The hedge rate is capped at 'max_hedge_rate' of all calls.
+    Async losers are cancelled, which closes their HTTP request. Sync calls cannot be interrupted,
+    so the losing thread finishes in the background and its response is discarded ('on_discarded'
+    still sees it, so its tokens can be charged).
+    """
+
+    def __init__(self, percentile=DEFAULT_PERCENTILE, max_hedge_rate=DEFAULT_MAX_HEDGE_RATE, alternate_model=False,
+                 min_samples=MIN_SAMPLES, window=LATENCY_WINDOW, min_delay=MIN_HEDGE_DELAY):
+        self.percentile = percentile
+        self.max_hedge_rate = max_hedge_rate
+        self.alternate_model = alternate_model
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay = min_delay
+        self.stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "discarded_tokens": 0}
+        self._latencies = {}  # {model: deque of recent latencies in seconds}
+        self._lock = threading.Lock()
+
+    def observe(self, key, latency):
+        with self._lock:
+            self._latencies.setdefault(key, collections.deque(maxlen=self.window)).append(latency)
+
+    def hedge_delay(self, key):
+        """Seconds after which a call to 'key' is hedged; None until enough latencies were observed."""
+        with self._lock:
+            latencies = sorted(self._latencies.get(key, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, latencies[int(self.percentile * (len(latencies) - 1))])
+
+    def _count_call(self):
+        with self._lock:
+            self.stats["calls"] += 1
+
+    def _take_hedge(self):
+        """Reserves a hedge if the cap allows one."""
+        with self._lock:
+            if self.stats["hedged"] + 1 > self.max_hedge_rate * self.stats["calls"]:
+                return False
+            self.stats["hedged"] += 1
+            return True
+
+    def _hedge_won(self):
+        with self._lock:
+            self.stats["hedge_wins"] += 1
+
+    def add_discarded_tokens(self, tokens):
+        with self._lock:
+            self.stats["discarded_tokens"] += tokens
+
+    @staticmethod
+    def _start(fn):
+        """Runs fn() on a daemon thread (in a copy of the caller's context); returns its Future."""
+        future = concurrent.futures.Future()
+        context = contextvars.copy_context()
+        def run():
+            try:
+                future.set_result(context.run(fn))
+            except BaseException as e:
+                future.set_exception(e)
+        threading.Thread(target=run, daemon=True, name="synapser-hedge").start()
+        return future
+
+    def call(self, key, primary, hedge, on_discarded=None):
+        """
+        Returns primary(), or hedge() when the primary call is slow and the hedge answers first.
+        Raises the primary's error when both fail (or when it fails before the hedge delay).
+        """
+        self._count_call()
+        delay = self.hedge_delay(key)
+        started_at = time.time()
+        if delay is None:  # Still learning this model's latencies
+            result = primary()
+            self.observe(key, time.time() - started_at)
+            return result
+        primary_future = self._start(primary)
+        # Late primaries still count towards the latency window, or the tail would be forgotten
+        primary_future.add_done_callback(
+            lambda future: self.observe(key, time.time() - started_at) if future.exception() is None else None
+        )
+        try:
+            return primary_future.result(timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+        if not self._take_hedge():
+            return primary_future.result()
+        hedge_future = self._start(hedge)
+        for future in concurrent.futures.as_completed((primary_future, hedge_future)):
+            if future.exception() is not None:
+                continue
+            loser = hedge_future if future is primary_future else primary_future
+            if on_discarded is not None:
+                loser.add_done_callback(lambda f: on_discarded(f.result()) if f.exception() is None else None)
+            if future is hedge_future:
+                self._hedge_won()
+            return future.result()
+        raise primary_future.exception()
+
+    async def acall(self, key, primary, hedge, on_discarded=None):
+        """Async counterpart of call(); 'primary' and 'hedge' return the awaitables to run. The loser is cancelled."""
+        self._count_call()
+        delay = self.hedge_delay(key)
+        started_at = time.time()
+        if delay is None:
+            result = await primary()
+            self.observe(key, time.time() - started_at)
+            return result
+        primary_task = asyncio.ensure_future(primary())
+        done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        if done or not self._take_hedge():
+            result = await primary_task
+            self.observe(key, time.time() - started_at)
+            return result
+        hedge_task = asyncio.ensure_future(hedge())
+        pending = {primary_task, hedge_task}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                if not winners:
+                    continue
+                for task in winners[1:]:  # Both answered at once
+                    if on_discarded is not None:
+                        on_discarded(task.result())
+                if winners[0] is hedge_task:
+                    self._hedge_won()
+                return winners[0].result()
+        finally:
+            # A cancelled primary was at least this slow
+            if not primary_task.done() or primary_task.exception() is None:
+                self.observe(key, time.time() - started_at)
+            for task in pending:
+                task.cancel()
+        raise primary_task.exception()
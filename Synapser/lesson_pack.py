@@ -0,0 +1,193 @@
+# lesson_pack.py
+"""
+Lesson packs: the fixed content of a lesson (focal points and their descriptions, the AI students'
+overview answers, the critical-thinking question) generated offline, so a new classroom's first
+screens render without waiting for the provider. Build one with
+
+    python Synapser/lesson_pack.py Synapser/lesson_catalog.json -o lesson_pack.json.gz
+
+Each entry keeps the exact prompt it answers; when a prompt changes in the code, the entry is
+ignored and the turn goes to the provider as usual.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from agents import build_classroom_agents
+from engine import (USER_NAME, CriticalThinkingMachine, OverviewMachine, focal_description_prompt, focal_points_prompt,
+                    parse_focal_points)
+from llm_client import OPENROUTER_BASE_URL, get_client, key_fingerprint
+from rate_limit import get_rate_limiter
+
+PACK_FORMAT = "synapser-lesson-pack"
+PACK_VERSION = 1
+DEFAULT_PACK_PATH = "lesson_pack.json.gz"
+NUM_FOCAL_POINTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+def lesson_key(subject, topic):
+    return f"{subject}\n{topic}"
+
+
+class PackedLesson:
+    """The pre-generated replies of one subject/topic, keyed by slot (the engine's job ids, e.g. "response:Marc")."""
+
+    def __init__(self, entries):
+        self.entries = entries  # {slot: {"agent", "prompt", "text", ...}}
+
+    def reply(self, slot, prompt):
+        """The packed reply of 'slot', or None when there is none or it answered a different prompt."""
+        entry = self.entries.get(slot)
+        if entry is None or entry["prompt"] != prompt:
+            return None
+        return entry["text"]
+
+    def focal_points(self, prompt):
+        """(focal points, raw reply) when the pack answers this focal-points prompt, else None."""
+        text = self.reply("focal_points", prompt)
+        return (self.entries["focal_points"]["focal_points"], text) if text is not None else None
+
+
+class LessonPack:
+    """A versioned, gzip-compressed JSON file of PackedLessons, loaded once at startup."""
+
+    def __init__(self, lessons=None, meta=None):
+        self.lessons = lessons or {}  # {lesson_key: {slot: entry}}
+        self.meta = meta or {}
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format") != PACK_FORMAT or data.get("version") != PACK_VERSION:
+            raise ValueError(f"{path} is not a version {PACK_VERSION} lesson pack.")
+        return cls(data["lessons"], data.get("meta"))
+
+    def save(self, path):
+        data = {"format": PACK_FORMAT, "version": PACK_VERSION, "meta": self.meta, "lessons": self.lessons}
+        temporary_path = f"{path}.tmp"
+        with gzip.open(temporary_path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temporary_path, path)
+
+    def lesson(self, subject, topic):
+        entries = self.lessons.get(lesson_key(subject, topic))
+        return PackedLesson(entries) if entries else None
+
+
+def load_lesson_pack(path):
+    """The pack at 'path', or None when there is none or it cannot be read (the app then generates everything)."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return LessonPack.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Ignoring lesson pack %s: %s", path, e)
+        return None
+
+
+# --- Compiler ---
+
+def lesson_jobs(subject, student_names):
+    """Engine jobs of a lesson that do not depend on the user: overview answers and the critical-thinking question."""
+    overview = OverviewMachine(student_names)
+    critical_thinking = CriticalThinkingMachine(subject, student_names)
+    return (overview.pending_jobs(overview.initial_state())
+            + critical_thinking.pending_jobs(critical_thinking.initial_state()))
+
+
+def compile_lessons(lessons, new_agents, workers=8):
+    """
+    Generates the packed entries of every {"subject", "topic"} lesson, in parallel.
+    'new_agents(subject, topic)' returns a fresh classroom (agents.build_classroom_agents); every
+    turn gets its own, so turns of one lesson can run at the same time. Focal-point descriptions
+    are generated once the focal points are known, on a teacher that has the focal-points exchange
+    in its history, as in a live session. Failed turns are left out (the app asks the provider).
+    Returns ({lesson_key: {slot: entry}}, number of failed turns).
+    """
+    packed = {lesson_key(lesson["subject"], lesson["topic"]): {} for lesson in lessons}
+    failures = 0
+
+    def run_turn(subject, topic, agent_name, prompt, interaction, history=()):
+        agents = new_agents(subject, topic)
+        for previous_prompt, previous_reply in history:
+            agents[agent_name].replay(previous_prompt, previous_reply)
+        return agents[agent_name].chat(prompt, interaction=interaction)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        def submit(lesson, slot, agent_name, prompt, interaction, history=()):
+            future = executor.submit(run_turn, lesson["subject"], lesson["topic"], agent_name, prompt, interaction, history)
+            futures[future] = (lesson, slot, agent_name, prompt)
+
+        for lesson in lessons:
+            student_names = [name for name in new_agents(lesson["subject"], lesson["topic"]) if name != "teacher"]
+            submit(lesson, "focal_points", "teacher",
+                   focal_points_prompt(lesson["subject"], lesson["topic"], NUM_FOCAL_POINTS), "focal_points")
+            for job in lesson_jobs(lesson["subject"], student_names):
+                submit(lesson, job.job_id, job.agent_name, job.prompt, job.kind)
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                lesson, slot, agent_name, prompt = futures.pop(future)
+                text = future.result()
+                entry = {"agent": agent_name, "prompt": prompt, "text": text}
+                if slot == "focal_points":
+                    entry["focal_points"] = parse_focal_points(text)
+                if text.startswith("Error:") or (slot == "focal_points" and not entry["focal_points"]):
+                    failures += 1
+                    logger.warning("No %s for %r: %s", slot, lesson["subject"], text[:200])
+                    continue
+                packed[lesson_key(lesson["subject"], lesson["topic"])][slot] = entry
+                if slot == "focal_points":
+                    for focal_point in entry["focal_points"]:
+                        submit(lesson, f"focal_description:{focal_point}", "teacher",
+                               focal_description_prompt(focal_point, lesson["subject"], lesson["topic"]),
+                               "focal_description", history=[(prompt, text)])
+    return packed, failures
+
+
+def main():
+    load_dotenv(override=True)
+    parser = argparse.ArgumentParser(description="Pre-generate the fixed content of lessons into a lesson pack")
+    parser.add_argument("catalog", help='JSON list of lessons: [{"subject": ..., "topic": ...}, ...]')
+    parser.add_argument("-o", "--output", default=DEFAULT_PACK_PATH)
+    parser.add_argument("--model", default=os.getenv("SYNAPSER_MODEL", "mistralai/mistral-7b-instruct:free"))
+    parser.add_argument("--base-url", default=os.getenv("SYNAPSER_BASE_URL", OPENROUTER_BASE_URL))
+    parser.add_argument("--workers", type=int, default=8, help="Provider calls in flight")
+    parser.add_argument("--rpm", type=int, default=int(os.getenv("SYNAPSER_RATE_LIMIT_RPM", "20")))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    api_key = os.getenv("OPENROUTER_API_KEY", "")
+    if not api_key:
+        sys.exit("Set OPENROUTER_API_KEY (or a key for the endpoint given with --base-url).")
+    with open(args.catalog, encoding="utf-8") as f:
+        lessons = json.load(f)
+    client = get_client(api_key, base_url=args.base_url, pool_size=args.workers)
+    rate_limiter = get_rate_limiter(key_fingerprint(api_key), requests_per_minute=args.rpm, max_in_flight=args.workers)
+
+    def new_agents(subject, topic):
+        return build_classroom_agents(client, args.model, subject, topic, user_name=USER_NAME, rate_limiter=rate_limiter)
+
+    started_at = time.time()
+    packed, failures = compile_lessons(lessons, new_agents, workers=args.workers)
+    pack = LessonPack(packed, meta={"model": args.model, "created_at": round(time.time())})
+    pack.save(args.output)
+    entries = sum(len(entries) for entries in packed.values())
+    print(f"{entries} entries for {len(lessons)} lessons in {time.time() - started_at:.1f}s "
+          f"({failures} failed turns) -> {args.output} ({os.path.getsize(args.output)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# llm_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "llm_responses.sqlite3")
+
+
+def request_key(model, messages, options=None):
+    """Canonical hash of a chat request: the model plus the exact message list (and extra options) sent to it."""
+    request = {"model": model, "messages": messages}
+    if options:
+        request["options"] = options
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of assistant responses, keyed by request_key().
+    An in-memory LRU sits in front of an SQLite file so warm sessions (and restarts)
+    can reuse completions for prompts that never change, such as the focal points
+    or the overview's sample question.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, memory_entries=256, max_disk_entries=5000, ttl_seconds=7 * 24 * 3600):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()  # {key: (created_at, response)}
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL, last_access REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._db.commit()
+
+    def _is_expired(self, created_at, now):
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def _remember(self, key, created_at, response):
+        self._memory[key] = (created_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, model, messages, options=None):
+        """Returns the cached response for this request (its 'options' too, e.g. response_format), or None on a miss."""
+        key = request_key(model, messages, options)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._is_expired(entry[0], now):
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+
+            row = self._db.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                response, created_at = row
+                if not self._is_expired(created_at, now):
+                    self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, created_at, response)
+                    self.stats["disk_hits"] += 1
+                    return response
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, model, messages, response, options=None):
+        """Stores a successful response for this request, evicting the least recently used entries if needed."""
+        key = request_key(model, messages, options)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, response)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now),
+            )
+            self.stats["writes"] += 1
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        if self.ttl_seconds is not None:
+            expired = self._db.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)
+            ).rowcount
+            self.stats["evictions"] += max(expired, 0)
+        (count,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+            self.stats["evictions"] += overflow
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def hit_rate(self):
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
@@ -0,0 +1,73 @@
+# llm_client.py
+import hashlib
+import threading
+import time
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+DEFAULT_POOL_SIZE = 20  # Keep-alive connections per client, shared by every session using the same key
+KEY_VALIDATION_TTL_SECONDS = 600  # How long a successful key check is trusted
+
+_clients = {}  # {(base_url, key_fingerprint, pool_size): OpenAI}
+_async_clients = {}  # {(base_url, key_fingerprint, pool_size): AsyncOpenAI}
+_validated_at = {}  # {(base_url, key_fingerprint): timestamp of the last successful check}
+_lock = threading.Lock()
+
+
+def key_fingerprint(api_key):
+    """Short, non-reversible identifier for an API key, safe to use in cache keys and logs."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def _pool_limits(pool_size):
+    return httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size, keepalive_expiry=60.0)
+
+
+def get_client(api_key, base_url=OPENROUTER_BASE_URL, pool_size=DEFAULT_POOL_SIZE):
+    """
+    Returns the process-wide OpenAI client for this base URL and key.
+    Every session with the same key reuses one keep-alive connection pool
+    instead of paying a fresh TLS handshake per session.
+    """
+    registry_key = (base_url, key_fingerprint(api_key), pool_size)
+    with _lock:
+        client = _clients.get(registry_key)
+        if client is None:
+            client = OpenAI(
+                base_url=base_url, api_key=api_key, max_retries=0,  # Retries are owned by rate_limit.RateLimiter
+                http_client=DefaultHttpxClient(limits=_pool_limits(pool_size)),
+            )
+            _clients[registry_key] = client
+    return client
+
+
+def get_async_client(api_key, base_url=OPENROUTER_BASE_URL, pool_size=DEFAULT_POOL_SIZE):
+    """Async counterpart of get_client(); used on the shared event loop from orchestration.py."""
+    registry_key = (base_url, key_fingerprint(api_key), pool_size)
+    with _lock:
+        client = _async_clients.get(registry_key)
+        if client is None:
+            client = AsyncOpenAI(
+                base_url=base_url, api_key=api_key, max_retries=0,
+                http_client=DefaultAsyncHttpxClient(limits=_pool_limits(pool_size)),
+            )
+            _async_clients[registry_key] = client
+    return client
+
+
+def validate_api_key(api_key, base_url=OPENROUTER_BASE_URL, pool_size=DEFAULT_POOL_SIZE,
+                     ttl_seconds=KEY_VALIDATION_TTL_SECONDS):
+    """
+    Checks the key with a models.list() round trip, unless it was validated less than ttl_seconds ago.
+    Only successes are remembered; an invalid key raises the provider's error every time.
+    The check goes through the pooled client, so it also warms the connection for the first real call.
+    """
+    validation_key = (base_url, key_fingerprint(api_key))
+    validated_at = _validated_at.get(validation_key)
+    if validated_at is not None and time.time() - validated_at < ttl_seconds:
+        return True
+    get_client(api_key, base_url=base_url, pool_size=pool_size).models.list()
+    _validated_at[validation_key] = time.time()
+    return True
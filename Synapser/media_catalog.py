@@ -0,0 +1,140 @@
+# media_catalog.py
+import heapq
+import json
+import math
+import os
+import re
+import threading
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "media_catalog", "manifest.json")
+ASSET_TYPES = ("image", "svg", "timeline", "markdown")
+FEATURE_TYPES = ("svg", "timeline")  # Shown under a focal point's images, at most one
+STOPWORDS = frozenset("a an and as at by for from in into is its of on or the to with".split())
+_SUFFIXES = ("ations", "ation", "ings", "ing", "ies", "ers", "er", "ed", "es", "s", "e")
+
+_catalogs = {}  # {path: MediaCatalog}
+_catalogs_lock = threading.Lock()
+
+
+def stem(word):
+    """Crude suffix stripping, so "manufacturing", "manufacture" and "manufacturers" share one token."""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + ("y" if suffix == "ies" else "")
+    return word
+
+
+def tokenize(text):
+    return [stem(word) for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in STOPWORDS]
+
+
+def minify_markup(markup):
+    """Drops comments and the indentation between tags of an SVG/HTML snippet."""
+    markup = re.sub(r"<!--.*?-->", "", markup, flags=re.DOTALL)
+    markup = re.sub(r">\s+<", "><", markup.strip())
+    return re.sub(r"\s+", " ", markup)
+
+
+class MediaCatalog:
+    """
+    Lesson media (images, inline SVG diagrams, timelines, fallback texts) loaded from a JSON manifest.
+    Assets are tagged; an inverted index maps each stemmed tag to the assets carrying it, weighted
+    by how rare the tag is across the catalog, so any focal-point text can be ranked
+    against every asset without scanning them. SVGs are read and minified once, at load time.
+    """
+
+    def __init__(self, assets, base_dir=""):
+        self.assets = [self._prepare(asset, base_dir) for asset in assets]
+        self._by_subject = {}  # {subject: frozenset of asset positions}
+        self._by_type = {}  # {(subject or "*", type): [assets]}
+        self._fallbacks = {}  # {subject: position of its fallback text}
+        postings = {}  # {token: {positions}}
+        for position, asset in enumerate(self.assets):
+            self._by_subject.setdefault(asset.get("subject"), set()).add(position)
+            self._by_type.setdefault((asset.get("subject"), asset["type"]), []).append(asset)
+            self._by_type.setdefault(("*", asset["type"]), []).append(asset)
+            if asset.get("fallback"):
+                self._fallbacks.setdefault(asset.get("subject"), position)
+            # Only tags are indexed: a title word such as "Revolution" would match nearly any focal point
+            for token in set(tokenize(" ".join(asset.get("tags", ())))):
+                postings.setdefault(token, set()).add(position)
+        self._by_subject = {subject: frozenset(positions) for subject, positions in self._by_subject.items()}
+        # Rare tokens say more about a focal point than ones carried by half the catalog
+        self._index = {
+            token: {position: math.log(1 + len(self.assets) / len(positions)) for position in positions}
+            for token, positions in postings.items()
+        }
+
+    @classmethod
+    def load(cls, path=DEFAULT_CATALOG_PATH):
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        return cls(manifest.get("assets", []), base_dir=os.path.dirname(path))
+
+    @staticmethod
+    def _prepare(asset, base_dir):
+        """Validates an asset and renders what can be rendered ahead of time."""
+        asset = dict(asset)
+        if asset.get("type") not in ASSET_TYPES or not asset.get("id"):
+            raise ValueError(f"Media asset {asset.get('id')!r} needs an id and a type among {ASSET_TYPES}.")
+        if asset["type"] == "image" and not asset.get("url"):
+            raise ValueError(f"Image asset {asset['id']!r} has no url.")
+        if asset["type"] == "svg":
+            markup = asset.get("svg")
+            if markup is None:
+                with open(os.path.join(base_dir, asset["file"]), encoding="utf-8") as f:
+                    markup = f.read()
+            asset["html"] = minify_markup(markup)
+        if asset["type"] == "timeline":
+            asset["lines"] = [f"##### {item['icon']} **{item['year']}**: {item['event']}" for item in asset["items"]]
+        return asset
+
+    def search(self, text, subject=None, types=None, limit=None):
+        """Assets matching 'text', best first, as (score, asset); restricted to 'subject' when it has assets."""
+        allowed = self._by_subject.get(subject)
+        scores = {}
+        for token in set(tokenize(text)):
+            for position, weight in self._index.get(token, {}).items():
+                if allowed is not None and position not in allowed:
+                    continue
+                if types is not None and self.assets[position]["type"] not in types:
+                    continue
+                scores[position] = scores.get(position, 0.0) + weight
+        ranked = ((-score, position) for position, score in scores.items())  # Ties keep manifest order
+        best = heapq.nsmallest(limit, ranked) if limit else sorted(ranked)
+        return [(-negative_score, self.assets[position]) for negative_score, position in best]
+
+    def assets_of(self, subject, asset_type):
+        """Assets of a type for 'subject' (every subject's when it has none)."""
+        return self._by_type.get((subject if subject in self._by_subject else "*", asset_type), [])
+
+    def images_for(self, text, subject=None, count=2, offset=0):
+        """
+        'count' images for a focal point. The best-scoring images are rotated by 'offset' (the focal
+        point's position in the lesson) so neighbouring focal points on one topic do not repeat the
+        same pictures; weaker matches, then the subject's other images, fill the remaining slots.
+        """
+        matches = self.search(text, subject, types=("image",))
+        top = [asset for score, asset in matches if score == matches[0][0]] if matches else []
+        start = offset % len(top) if top else 0
+        candidates = top[start:] + top[:start] + [asset for _, asset in matches] + self.assets_of(subject, "image")
+        return list({asset["id"]: asset for asset in candidates}.values())[:count]  # First occurrence wins
+
+    def feature_for(self, text, subject=None):
+        """Best diagram or timeline for a focal point, else the subject's fallback text (None if it has none)."""
+        matches = self.search(text, subject, types=FEATURE_TYPES, limit=1)
+        if matches:
+            return matches[0][1]
+        position = self._fallbacks.get(subject)
+        if position is None and subject not in self._by_subject and self._fallbacks:  # Unknown subject: any fallback
+            position = next(iter(self._fallbacks.values()))
+        return self.assets[position] if position is not None else None
+
+
+def get_media_catalog(path=DEFAULT_CATALOG_PATH):
+    """Returns the process-wide catalog of a manifest, loading and indexing it on first use."""
+    with _catalogs_lock:
+        catalog = _catalogs.get(path)
+        if catalog is None:
+            catalog = _catalogs[path] = MediaCatalog.load(path)
+    return catalog
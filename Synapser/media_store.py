@@ -0,0 +1,177 @@
+# media_store.py
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow every variant is the original file
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEDIA_DIR = os.path.join(".cache", "media")
+VARIANT_WIDTHS = {"thumb": 320, "display": 800}  # Pixels; "original" is always kept as downloaded
+JPEG_QUALITY = 82
+DOWNLOAD_TIMEOUT_SECONDS = 15.0
+PREFETCH_WORKERS = 4
+FAILURE_RETRY_SECONDS = 300  # A URL that failed (e.g. an expired signed link) is not retried before this
+
+
+def media_type(data):
+    """MIME type of stored image bytes, from their magic number."""
+    for prefix, mime_type in ((b"\xff\xd8", "image/jpeg"), (b"\x89PNG", "image/png"), (b"GIF8", "image/gif"),
+                              (b"RIFF", "image/webp")):
+        if data.startswith(prefix):
+            return mime_type
+    return "application/octet-stream"
+
+
+class MediaStore:
+    """
+    Content-addressed disk cache for lesson images. A remote image is downloaded once, stored under
+    the SHA-256 of its bytes, and resized into the VARIANT_WIDTHS variants right away, so pages read
+    small local files instead of hot-linking full-size images from a third-party CDN (whose signed
+    links also expire). The URL -> digest index is kept in index.json next to the files, so a
+    restart does not download anything again.
+    """
+
+    def __init__(self, root=DEFAULT_MEDIA_DIR, variant_widths=None, timeout=DOWNLOAD_TIMEOUT_SECONDS):
+        self.root = root
+        self.variant_widths = VARIANT_WIDTHS if variant_widths is None else variant_widths
+        self.timeout = timeout
+        self.stats = {"downloads": 0, "download_bytes": 0, "hits": 0, "served_bytes": 0, "failures": 0}
+        self._index_path = os.path.join(root, "index.json")
+        self._index = {}  # {url: digest}
+        self._url_locks = {}  # {url: Lock}, so concurrent requests for one URL download it once
+        self._failed_at = {}  # {url: time of the last failed download}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._prefetcher = None
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        if os.path.exists(self._index_path):
+            with open(self._index_path, encoding="utf-8") as f:
+                self._index = json.load(f)
+
+    def _object_path(self, digest, variant="original"):
+        name = digest if variant == "original" else f"{digest}_{variant}.jpg"
+        return os.path.join(self.root, "objects", digest[:2], name)
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.tmp{threading.get_ident()}"
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, path)  # Readers never see a partial file
+
+    def _save_index(self):
+        with self._save_lock:  # Serialized, so an older snapshot never overwrites a newer one
+            with self._lock:
+                data = json.dumps(self._index, indent=0, sort_keys=True).encode("utf-8")
+            self._write(self._index_path, data)
+
+    def _make_variants(self, digest, data):
+        """Resized JPEGs for every variant narrower than the original (others fall back to the original)."""
+        if Image is None:
+            return
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image = image.convert("RGB")
+                for variant, width in self.variant_widths.items():
+                    if image.width <= width:
+                        continue
+                    resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+                    buffer = io.BytesIO()
+                    resized.save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+                    self._write(self._object_path(digest, variant), buffer.getvalue())
+        except Exception as e:  # Not an image Pillow can read: serve the original only
+            logger.warning("Could not create variants of %s: %s", digest, e)
+
+    def cached_digest(self, url):
+        """Digest of an already ingested URL, or None."""
+        with self._lock:
+            digest = self._index.get(url)
+        return digest if digest and os.path.exists(self._object_path(digest)) else None
+
+    def ingest(self, url):
+        """Downloads 'url' unless it is already stored; returns its digest. Raises on download errors."""
+        digest = self.cached_digest(url)
+        if digest:
+            return digest
+        with self._lock:
+            url_lock = self._url_locks.setdefault(url, threading.Lock())
+        with url_lock:
+            digest = self.cached_digest(url)  # Another thread may have finished the download meanwhile
+            if digest:
+                return digest
+            response = httpx.get(url, timeout=self.timeout, follow_redirects=True)
+            response.raise_for_status()
+            data = response.content
+            digest = hashlib.sha256(data).hexdigest()
+            if not os.path.exists(self._object_path(digest)):  # Identical bytes behind another URL are stored once
+                self._write(self._object_path(digest), data)
+                self._make_variants(digest, data)
+            with self._lock:
+                self._index[url] = digest
+                self.stats["downloads"] += 1
+                self.stats["download_bytes"] += len(data)
+            self._save_index()
+            return digest
+
+    def _stored_variant(self, digest, variant):
+        """(path, variant) actually stored for a variant: the original when that variant was not needed."""
+        path = self._object_path(digest, variant)
+        if variant != "original" and not os.path.exists(path):
+            return self._object_path(digest), "original"
+        return path, variant
+
+    def etag(self, digest, variant="display"):
+        """ETag of a stored variant; content-addressed, so it never changes."""
+        return f'"{digest[:32]}-{self._stored_variant(digest, variant)[1]}"'
+
+    def read(self, digest, variant="display"):
+        """Returns (bytes, etag) of a stored variant, or None."""
+        path, stored_variant = self._stored_variant(digest, variant)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+            self.stats["served_bytes"] += len(data)
+        return data, self.etag(digest, stored_variant)
+
+    def try_ingest(self, url):
+        """ingest() that logs failures and returns None, without retrying a failed URL for FAILURE_RETRY_SECONDS."""
+        with self._lock:
+            if time.time() - self._failed_at.get(url, 0) < FAILURE_RETRY_SECONDS:
+                return None
+        try:
+            return self.ingest(url)
+        except Exception as e:
+            with self._lock:
+                self._failed_at[url] = time.time()
+                self.stats["failures"] += 1
+            logger.warning("Could not fetch media %s: %s", url, e)
+            return None
+
+    def image(self, url, variant="display"):
+        """Bytes of a variant of the image at 'url', downloading it first if needed; None when unavailable."""
+        digest = self.try_ingest(url)
+        stored = self.read(digest, variant) if digest else None
+        return stored[0] if stored else None
+
+    def prefetch(self, urls):
+        """Ingests 'urls' in the background (e.g. every image of the current lesson); returns the futures."""
+        with self._lock:
+            if self._prefetcher is None:
+                self._prefetcher = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="media-prefetch")
+        return [self._prefetcher.submit(self.try_ingest, url) for url in dict.fromkeys(urls) if not self.cached_digest(url)]
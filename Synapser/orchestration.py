@@ -0,0 +1,148 @@
+# orchestration.py
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:  # Older Streamlit versions or running outside Streamlit
+    add_script_run_ctx = None
+    get_script_run_ctx = None
+
+MAX_CONCURRENT_TURNS = 4  # Upper bound on simultaneous LLM calls for one fan-out
+
+BACKGROUND_WORKERS = 8  # Threads for work that outlives a script run (e.g. quiz prefetch)
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+_background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="agent-background")
+
+
+def _script_ctx_initializer():
+    """
+    Returns a thread initializer that lets worker threads touch Streamlit state
+    without "missing ScriptRunContext" warnings. Outside a script run it returns None.
+    """
+    if get_script_run_ctx is None:
+        return None
+    try:
+        ctx = get_script_run_ctx(suppress_warning=True)  # Headless callers (engine, batch runs) have no context
+    except TypeError:  # Streamlit versions without suppress_warning
+        ctx = get_script_run_ctx()
+    if ctx is None:
+        return None
+    return lambda: add_script_run_ctx(threading.current_thread(), ctx)
+
+
+def get_event_loop():
+    """
+    Returns the process-wide event loop that runs async agent turns, starting it on first use.
+    A single long-lived loop lets the AsyncOpenAI connection pools be reused across script runs
+    and sessions (a fresh asyncio.run() per call would tie them to a closed loop).
+    """
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="agent-event-loop", daemon=True).start()
+            _event_loop = loop
+    return _event_loop
+
+
+async def gather_agent_turns(turns, on_result=None):
+    """
+    Awaits several agents' achat() turns together on the current event loop.
+    'turns' is a list of (name, agent, prompt) or (name, agent, prompt, interaction) tuples;
+    'on_result(name, response)' is called as each turn finishes. Returns {name: response}.
+    """
+    async def run_turn(name, agent, prompt, interaction=None):
+        return name, await agent.achat(prompt, interaction=interaction)
+
+    results = {}
+    for next_done in asyncio.as_completed([run_turn(*turn) for turn in turns]):
+        name, response = await next_done
+        results[name] = response
+        if on_result is not None:
+            on_result(name, response)
+    return results
+
+
+def run_agent_turns(turns, on_result=None, reveal_delay=0.0):
+    """
+    Synchronous entry point for gather_agent_turns, usable from a Streamlit script.
+    The turns run on the shared event loop; results are handed back to the calling thread
+    so 'on_result' can safely render with st.*.
+    """
+    results = {}
+    if not turns:
+        return results
+
+    results_queue = queue.Queue()
+    gathering = asyncio.run_coroutine_threadsafe(
+        gather_agent_turns(turns, on_result=lambda name, response: results_queue.put((name, response))),
+        get_event_loop(),
+    )
+    gathering.add_done_callback(lambda _: results_queue.put(None))  # Unblocks the loop below on failure
+    while len(results) < len(turns):
+        item = results_queue.get()
+        if item is None:
+            gathering.result()  # Re-raises whatever stopped the gathering
+            break
+        name, response = item
+        if reveal_delay and results:
+            time.sleep(reveal_delay)
+        results[name] = response
+        if on_result is not None:
+            on_result(name, response)
+    return results
+
+
+def run_concurrent_chats(turns, on_result=None, max_workers=MAX_CONCURRENT_TURNS, reveal_delay=0.0):
+    """
+    Runs several agents' chat turns concurrently.
+    'turns' is a list of (name, agent, prompt) tuples, optionally with the interaction type as a fourth
+    item (it selects the model route of agents with a router).
+    'on_result(name, response)' is called from the calling thread as soon as each response arrives,
+    so Streamlit rendering stays on the script thread.
+    'reveal_delay' is an optional cosmetic pause between two reveals; requests keep running meanwhile.
+    When every agent has an async client the turns share the async event loop,
+    otherwise they go through a bounded thread pool.
+    Returns {name: response}.
+    """
+    results = {}
+    if not turns:
+        return results
+
+    if all(getattr(turn[1], "async_client", None) is not None for turn in turns):
+        return run_agent_turns(turns, on_result=on_result, reveal_delay=reveal_delay)
+
+    workers = max(1, min(max_workers, len(turns)))
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="agent-turn", initializer=_script_ctx_initializer()
+    ) as executor:
+        futures = {
+            # Each turn runs in a copy of the caller's context (e.g. the telemetry module tag)
+            executor.submit(contextvars.copy_context().run, agent.chat, prompt, interaction=rest[0] if rest else None): name
+            for name, agent, prompt, *rest in turns
+        }
+        for i, future in enumerate(as_completed(futures)):
+            name = futures[future]
+            response = future.result()  # Agent.chat already turns API errors into a message
+            results[name] = response
+            if reveal_delay and i > 0:
+                time.sleep(reveal_delay)
+            if on_result is not None:
+                on_result(name, response)
+    return results
+
+
+def submit_background(fn, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) on the shared background pool and returns its Future.
+    Used for work that continues across Streamlit reruns, such as preparing the next quiz question.
+    Background work must not call st.* to render: there is no script run to render into.
+    """
+    return _background_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -0,0 +1,226 @@
+# rate_limit.py
+import asyncio
+import contextlib
+import email.utils
+import random
+import threading
+import time
+
+DEFAULT_REQUESTS_PER_MINUTE = 20  # OpenRouter's limit for free models
+DEFAULT_MAX_IN_FLIGHT = 8
+DEFAULT_MAX_RETRIES = 4
+COMPLETION_TOKENS_ESTIMATE = 300  # Reserved per call on top of the prompt until the real usage is known
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+_POLL_SECONDS = 0.05  # How often a caller waiting for an in-flight slot checks again
+
+_limiters = {}  # {key_fingerprint: RateLimiter}
+_limiters_lock = threading.Lock()
+
+
+def retry_after_seconds(error):
+    """Delay requested by the provider in a Retry-After (or retry-after-ms) header, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        try:  # HTTP-date form
+            return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def is_retryable(error):
+    """Rate limits, timeouts, connection drops and 5xx responses are worth retrying; other errors are not."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "TimeoutError")
+
+
+def _usage_tokens(result):
+    usage = getattr(result, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+class RateLimiter:
+    """
+    Client-side limits for one API key, shared by every agent (and session) using it.
+    A call first waits for an in-flight slot and for room in the requests-per-minute and
+    tokens-per-minute buckets; transient failures are retried with jittered exponential
+    backoff, and a 429 pauses the whole key for as long as the provider asks.
+    """
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=0,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_retries=DEFAULT_MAX_RETRIES, base_delay=1.0, max_delay=30.0):
+        self.requests_per_minute = requests_per_minute  # 0 disables the request bucket
+        self.tokens_per_minute = tokens_per_minute  # 0 disables the token bucket
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.in_flight = 0
+        self.stats = {"attempts": 0, "retries": 0, "throttled": 0, "failures": 0, "rate_limited": 0}
+        self._request_allowance = float(requests_per_minute)
+        self._token_allowance = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # --- Buckets ---
+
+    def _refill(self, now):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.requests_per_minute:
+            self._request_allowance = min(
+                self.requests_per_minute, self._request_allowance + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._token_allowance = min(
+                self.tokens_per_minute, self._token_allowance + elapsed * self.tokens_per_minute / 60
+            )
+
+    def _try_acquire(self, estimated_tokens):
+        """Takes an in-flight slot and bucket capacity; returns 0, or how long to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self.in_flight >= self.max_in_flight:
+                return _POLL_SECONDS
+            if self.requests_per_minute and self._request_allowance < 1:
+                return (1 - self._request_allowance) * 60 / self.requests_per_minute
+            needed_tokens = min(estimated_tokens, self.tokens_per_minute)  # A huge prompt must not wait forever
+            if self.tokens_per_minute and self._token_allowance < needed_tokens:
+                return (needed_tokens - self._token_allowance) * 60 / self.tokens_per_minute
+            self._request_allowance -= 1
+            self._token_allowance -= needed_tokens if self.tokens_per_minute else 0
+            self.in_flight += 1
+            self.stats["attempts"] += 1
+            return 0
+
+    def _release(self, estimated_tokens, actual_tokens):
+        with self._lock:
+            self.in_flight -= 1
+            if self.tokens_per_minute and actual_tokens is not None:
+                # Settle the reservation against the real usage (the allowance may go into debt)
+                self._token_allowance += min(estimated_tokens, self.tokens_per_minute) - actual_tokens
+
+    def _note_wait(self):
+        with self._lock:
+            self.stats["throttled"] += 1
+
+    @contextlib.contextmanager
+    def slot(self, estimated_tokens=0):
+        """
+        Holds an in-flight slot for the duration of the block, waiting for one first.
+        The yielded dict's "actual_tokens" may be set to settle the token bucket against the real usage.
+        """
+        waited = False
+        while True:
+            wait = self._try_acquire(estimated_tokens)
+            if not wait:
+                break
+            if not waited:
+                self._note_wait()
+                waited = True
+            time.sleep(wait)
+        reservation = {"actual_tokens": None}
+        try:
+            yield reservation
+        finally:
+            self._release(estimated_tokens, reservation["actual_tokens"])
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, estimated_tokens=0):
+        """Async counterpart of slot(): waiting does not block the event loop."""
+        waited = False
+        while True:
+            wait = self._try_acquire(estimated_tokens)
+            if not wait:
+                break
+            if not waited:
+                self._note_wait()
+                waited = True
+            await asyncio.sleep(wait)
+        reservation = {"actual_tokens": None}
+        try:
+            yield reservation
+        finally:
+            self._release(estimated_tokens, reservation["actual_tokens"])
+
+    # --- Retries ---
+
+    def retry_delay(self, attempt, error):
+        """
+        Seconds to wait before retrying after 'error' on the given (0-based) attempt, or None to give up.
+        Honors Retry-After; otherwise full-jitter exponential backoff. A 429 pauses every caller on this key.
+        """
+        if attempt >= self.max_retries or not is_retryable(error):
+            with self._lock:
+                self.stats["failures"] += 1
+            return None
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        delay = min(delay, self.max_delay)
+        with self._lock:
+            self.stats["retries"] += 1
+            if getattr(error, "status_code", None) == 429:
+                self.stats["rate_limited"] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def call(self, fn, estimated_tokens=0):
+        """Runs fn() (a provider call) within the limits, retrying transient failures. Re-raises the last error."""
+        attempt = 0
+        while True:
+            with self.slot(estimated_tokens) as reservation:
+                try:
+                    result = fn()
+                    reservation["actual_tokens"] = _usage_tokens(result)
+                    return result
+                except Exception as e:
+                    delay = self.retry_delay(attempt, e)
+                    if delay is None:
+                        raise
+            time.sleep(delay)  # Outside the slot, so waiting does not hold back other callers
+            attempt += 1
+
+    async def acall(self, coro_fn, estimated_tokens=0):
+        """Async counterpart of call(); 'coro_fn' returns a fresh awaitable per attempt."""
+        attempt = 0
+        while True:
+            async with self.aslot(estimated_tokens) as reservation:
+                try:
+                    result = await coro_fn()
+                    reservation["actual_tokens"] = _usage_tokens(result)
+                    return result
+                except Exception as e:
+                    delay = self.retry_delay(attempt, e)
+                    if delay is None:
+                        raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def get_rate_limiter(key_fingerprint, **limits):
+    """Returns the process-wide limiter for an API key (by fingerprint), creating it with 'limits' on first use."""
+    with _limiters_lock:
+        limiter = _limiters.get(key_fingerprint)
+        if limiter is None:
+            limiter = RateLimiter(**limits)
+            _limiters[key_fingerprint] = limiter
+    return limiter
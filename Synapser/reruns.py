@@ -0,0 +1,174 @@
+# reruns.py
+import collections
+import contextlib
+import functools
+import threading
+import time
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from telemetry import module_scope
+
+MAX_RUNS = 500  # Per profiler; older runs are dropped
+_OUTCOMES = {"RerunException": "rerun", "StopException": "stopped"}  # Streamlit's control-flow exceptions
+
+_process_profiler = None
+_process_profiler_lock = threading.Lock()
+
+
+def in_fragment_rerun():
+    """True while Streamlit reruns fragments only (not the whole script)."""
+    ctx = get_script_run_ctx()
+    return bool(ctx is not None and ctx.fragment_ids_this_run)
+
+
+def rerun_panel():
+    """
+    Reruns the panel being rendered: just its fragment during a fragment rerun, the whole app
+    otherwise (Streamlit refuses a fragment-scoped rerun while the full script runs).
+    """
+    st.rerun(scope="fragment" if in_fragment_rerun() else "app")
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+class RerunProfiler:
+    """
+    Wall time of the script runs of a session. A run is either a full run of app.py ("app") or a
+    fragment rerun of one panel ("fragment"), tagged with the classroom module it rendered.
+    Runs are split into named sections (sidebar, init, the module panels); each section updates
+    the run's duration when it exits, so runs cut short by st.rerun() or st.stop() are still
+    measured. With 'parent' every run is also kept by the process-wide profiler.
+    """
+
+    def __init__(self, max_runs=MAX_RUNS, parent=None):
+        self.runs = collections.deque(maxlen=max_runs)
+        self.parent = parent
+        self._current = None
+        self._lock = threading.Lock()
+
+    def begin(self, scope="app", module="other"):
+        """Starts timing a new run; the previous one is complete."""
+        run = {"timestamp": round(time.time(), 3), "scope": scope, "module": module, "outcome": "ok",
+               "duration_s": 0.0, "sections": {}, "_started_at": time.perf_counter()}
+        self._current = run
+        self._add(run)
+        return run
+
+    def _add(self, run):
+        with self._lock:
+            self.runs.append(run)
+        if self.parent is not None:
+            self.parent._add(run)
+
+    def tag(self, module):
+        """Sets the module of the current run (known once the sidebar selection was read)."""
+        if self._current is not None:
+            self._current["module"] = module
+
+    @contextlib.contextmanager
+    def section(self, name):
+        """Times the block as section 'name' of the current run (repeated sections add up)."""
+        run = self._current
+        started_at = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            if run is not None:
+                run["outcome"] = _OUTCOMES.get(type(e).__name__, "error")
+            raise
+        finally:
+            if run is not None:
+                now = time.perf_counter()
+                run["sections"][name] = round(run["sections"].get(name, 0.0) + now - started_at, 4)
+                run["duration_s"] = round(now - run["_started_at"], 4)
+
+    def end(self):
+        """Closes the current run at the end of the script."""
+        if self._current is not None:
+            self._current["duration_s"] = round(time.perf_counter() - self._current["_started_at"], 4)
+            self._current = None
+
+    def snapshot(self):
+        with self._lock:
+            return [{key: value for key, value in run.items() if not key.startswith("_")} for run in self.runs]
+
+    def totals(self):
+        """Runs and their p50/p95 duration per scope and per (module, scope), and the mean time of each section."""
+        runs = self.snapshot()
+        def summary(selected):
+            durations = sorted(run["duration_s"] for run in selected)
+            return {"runs": len(durations), "total_s": round(sum(durations), 3),
+                    "p50_s": _percentile(durations, 0.5), "p95_s": _percentile(durations, 0.95)}
+        sections = {}
+        for run in runs:
+            for name, seconds in run["sections"].items():
+                sections.setdefault(name, []).append(seconds)
+        return {
+            "by_scope": {scope: summary([run for run in runs if run["scope"] == scope]) for scope in ("app", "fragment")},
+            "by_module": {
+                (module, scope): summary([run for run in runs if run["module"] == module and run["scope"] == scope])
+                for module, scope in sorted({(run["module"], run["scope"]) for run in runs})
+            },
+            "sections": {name: round(sum(values) / len(values), 4) for name, values in sorted(sections.items())},
+            "reruns": sum(1 for run in runs if run["outcome"] == "rerun"),
+        }
+
+    def prometheus(self):
+        """Run counts and time per scope, module and outcome, in the Prometheus text exposition format."""
+        series = {}
+        for run in self.snapshot():
+            key = (run["scope"], run["module"], run["outcome"])
+            count, seconds = series.get(key, (0, 0.0))
+            series[key] = (count + 1, seconds + run["duration_s"])
+        lines = [
+            "# HELP synapser_script_runs Streamlit script runs (retained) by scope, module and outcome.",
+            "# TYPE synapser_script_runs gauge",
+        ]
+        for (scope, module, outcome), (count, _) in sorted(series.items()):
+            lines.append(f'synapser_script_runs{{scope="{scope}",module="{module}",outcome="{outcome}"}} {count}')
+        lines += [
+            "# HELP synapser_script_run_seconds Wall time of those runs.",
+            "# TYPE synapser_script_run_seconds gauge",
+        ]
+        for (scope, module, outcome), (_, seconds) in sorted(series.items()):
+            lines.append(f'synapser_script_run_seconds{{scope="{scope}",module="{module}",outcome="{outcome}"}} {seconds:.4f}')
+        return "\n".join(lines) + "\n"
+
+
+def get_rerun_profiler():
+    """Returns the process-wide profiler (every session's runs)."""
+    global _process_profiler
+    with _process_profiler_lock:
+        if _process_profiler is None:
+            _process_profiler = RerunProfiler(max_runs=MAX_RUNS * 10)
+    return _process_profiler
+
+
+def fragment_panel(module, get_profiler, after_rerun=None):
+    """
+    Decorator turning a panel renderer into a Streamlit fragment: its widgets rerun only the panel,
+    not the sidebar and the rest of the page. A fragment rerun is timed as its own "fragment" run;
+    during a full run the panel is a section of that run. 'after_rerun' is called after each
+    fragment rerun (e.g. to checkpoint the session, which app.py otherwise does at the end of the script).
+    """
+    def decorate(render):
+        @st.fragment
+        @functools.wraps(render)
+        def panel(*args, **kwargs):
+            profiler = get_profiler()
+            if not in_fragment_rerun():
+                with profiler.section(module):
+                    return render(*args, **kwargs)
+            profiler.begin("fragment", module)
+            with module_scope(module), profiler.section(module): # The script's set_current_module() did not run
+                result = render(*args, **kwargs)
+            profiler.end()
+            if after_rerun is not None:
+                after_rerun()
+            return result
+        return panel
+    return decorate
@@ -0,0 +1,99 @@
+# routing.py
+import json
+import threading
+
+# Interactions worth the strong model: few calls, each reading the whole class's work
+HEAVY_TEACHER_INTERACTIONS = ("ranking", "wrapup", "quiz_questions")
+
+
+def default_routes(main_model, fast_model=None, strong_model=None):
+    """
+    Routing table: AI students' short in-character turns go to the fast model, the teacher's
+    heavy interactions to the strong one, everything else to the main model. Each route lists
+    fallbacks, tried in order when a model keeps failing.
+    """
+    fast_model = fast_model or main_model
+    strong_model = strong_model or main_model
+    routes = {
+        "student": _unique([fast_model, main_model]),
+        "teacher": _unique([main_model, fast_model]),
+    }
+    for interaction in HEAVY_TEACHER_INTERACTIONS:
+        routes[f"teacher:{interaction}"] = _unique([strong_model, main_model])
+    return routes
+
+
+def _unique(models):
+    return list(dict.fromkeys(model for model in models if model))
+
+
+def load_routes(spec, fallback_routes):
+    """Routes from a JSON object such as {"student": ["model-a", "model-b"], "teacher:ranking": ["model-c"]}."""
+    if not spec:
+        return fallback_routes
+    routes = json.loads(spec)
+    if not isinstance(routes, dict) or not all(isinstance(models, list) and models for models in routes.values()):
+        raise ValueError("Model routes must map 'role' or 'role:interaction' to a non-empty list of models.")
+    return {**fallback_routes, **routes}
+
+
+class ModelRouter:
+    """
+    Picks the models for a call from its agent's role and the interaction type (the engine's job
+    kind, e.g. "answer" or "ranking"): "role:interaction" routes win over "role" routes, which win
+    over "*". Keeps latency, token, error and cost statistics per route and model.
+    """
+
+    def __init__(self, routes, prices=None):
+        self.routes = routes
+        self.prices = prices or {}  # {model: (USD per 1M prompt tokens, USD per 1M completion tokens)}
+        self.stats = {}  # {(route, model): {"calls", "errors", "fallbacks", "latency_s", "tokens", "cost_usd"}}
+        self._lock = threading.Lock()
+
+    def route_for(self, role, interaction=None):
+        """Name of the route used for a call, e.g. "teacher:ranking" or "student"."""
+        for route in (f"{role}:{interaction}" if interaction else None, role, "*"):
+            if route in self.routes:
+                return route
+        return None
+
+    def models_for(self, role, interaction=None, default_model=None):
+        """Models to try, in order; [default_model] when no route matches."""
+        route = self.route_for(role, interaction)
+        return list(self.routes[route]) if route else [default_model]
+
+    def record(self, role, interaction, model, latency, prompt_tokens=0, completion_tokens=0, error=False,
+               fallback=False):
+        """Adds a finished call (or a failed attempt) to the statistics of its route."""
+        key = (self.route_for(role, interaction) or "(default)", model)
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        with self._lock:
+            stats = self.stats.setdefault(key, {
+                "calls": 0, "errors": 0, "fallbacks": 0, "latency_s": 0.0, "tokens": 0, "cost_usd": 0.0,
+            })
+            stats["calls"] += 1
+            stats["errors"] += 1 if error else 0
+            stats["fallbacks"] += 1 if fallback else 0
+            stats["latency_s"] += latency
+            stats["tokens"] += prompt_tokens + completion_tokens
+            stats["cost_usd"] += (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+    def summary(self):
+        """Per (route, model): calls, errors, mean latency, tokens and cost, busiest routes first."""
+        with self._lock:
+            items = [(route, model, dict(stats)) for (route, model), stats in self.stats.items()]
+        rows = []
+        for route, model, stats in sorted(items, key=lambda item: -item[2]["calls"]):
+            rows.append({
+                "route": route, "model": model, "calls": stats["calls"], "errors": stats["errors"],
+                "fallbacks": stats["fallbacks"], "tokens": stats["tokens"], "cost_usd": round(stats["cost_usd"], 6),
+                "mean_latency_s": round(stats["latency_s"] / stats["calls"], 3) if stats["calls"] else 0.0,
+            })
+        return rows
+
+
+def load_prices(spec):
+    """Per-model prices from JSON such as {"model-a": [0.1, 0.4]} (USD per 1M prompt / completion tokens)."""
+    if not spec:
+        return {}
+    return {model: tuple(price) for model, price in json.loads(spec).items()}
@@ -0,0 +1,357 @@
+# server.py
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from dotenv import load_dotenv
+from flask import Flask, Response, jsonify, request
+
+from agents import build_classroom_agents
+from budget import TokenBudget
+from routing import ModelRouter, default_routes, load_prices, load_routes
+from hedging import Hedger
+from context import ContextWindow
+from engine import USER_NAME, ClassroomEngine
+from llm_cache import ResponseCache
+from llm_client import OPENROUTER_BASE_URL, get_async_client, get_client, key_fingerprint
+from media_store import DEFAULT_MEDIA_DIR, MediaStore, media_type
+from lesson_pack import DEFAULT_PACK_PATH, load_lesson_pack
+from orchestration import get_event_loop
+from rate_limit import get_rate_limiter
+from singleflight import get_single_flight
+from telemetry import get_telemetry
+
+load_dotenv(override=True)
+
+SUBJECT = "The First Industrial Revolution"
+TOPIC = "The Invention of the Steam Engine and its Societal Impact"
+MODEL_NAME = os.getenv("SYNAPSER_MODEL", "mistralai/mistral-7b-instruct:free")
+MAX_CONTEXT_TOKENS = 6000
+KEEP_RECENT_MESSAGES = 8
+
+# Agent turns in flight across every classroom on this node (the shared worker pool)
+MAX_INFLIGHT_TURNS = int(os.getenv("SYNAPSER_SERVER_TURNS", "64"))
+# Events a single classroom may have waiting; beyond that its requests get 429
+CLASSROOM_QUEUE_LIMIT = int(os.getenv("SYNAPSER_CLASSROOM_QUEUE", "8"))
+# Events waiting across the node; beyond that every request gets 503
+NODE_QUEUE_LIMIT = int(os.getenv("SYNAPSER_NODE_QUEUE", "1000"))
+MAX_CLASSROOMS = int(os.getenv("SYNAPSER_MAX_CLASSROOMS", "500"))
+CLASSROOM_IDLE_SECONDS = int(os.getenv("SYNAPSER_CLASSROOM_IDLE", "3600"))
+RETRY_AFTER_SECONDS = 2
+LLM_BASE_URL = os.getenv("SYNAPSER_BASE_URL", OPENROUTER_BASE_URL)  # OpenAI-compatible endpoint
+LLM_POOL_SIZE = int(os.getenv("SYNAPSER_LLM_POOL_SIZE", "100"))
+LLM_CACHE_PATH = os.getenv("SYNAPSER_LLM_CACHE", "")
+RATE_LIMIT_RPM = int(os.getenv("SYNAPSER_RATE_LIMIT_RPM", "20"))
+RATE_LIMIT_TPM = int(os.getenv("SYNAPSER_RATE_LIMIT_TPM", "0"))
+MAX_IN_FLIGHT_PER_KEY = int(os.getenv("SYNAPSER_MAX_IN_FLIGHT", "8"))
+TELEMETRY_LOG_PATH = os.getenv("SYNAPSER_TELEMETRY_LOG", "")  # Optional JSON-lines log of every LLM call
+MEDIA_CACHE_DIR = os.getenv("SYNAPSER_MEDIA_CACHE", DEFAULT_MEDIA_DIR)  # Lesson images, shared with the Streamlit app
+LESSON_PACK_PATH = os.getenv("SYNAPSER_LESSON_PACK", DEFAULT_PACK_PATH)  # Pre-generated lesson content, if present
+# Models per agent role and interaction type, as in app.py
+FAST_MODEL = os.getenv("SYNAPSER_FAST_MODEL", MODEL_NAME)
+STRONG_MODEL = os.getenv("SYNAPSER_STRONG_MODEL", MODEL_NAME)
+MODEL_ROUTES = load_routes(os.getenv("SYNAPSER_MODEL_ROUTES", ""), default_routes(MODEL_NAME, FAST_MODEL, STRONG_MODEL))
+MODEL_PRICES = load_prices(os.getenv("SYNAPSER_MODEL_PRICES", ""))
+# Hedged requests against the latency tail: "off", "same" or "alternate" (see app.py)
+HEDGING_MODE = os.getenv("SYNAPSER_HEDGING", "off")
+HEDGE_PERCENTILE = float(os.getenv("SYNAPSER_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MAX_RATE = float(os.getenv("SYNAPSER_HEDGE_MAX_RATE", "0.05"))
+
+# Events a client may post for each module, on top of "start" and "restart"
+USER_EVENTS = {
+    "overview": ("user_response",),
+    "quiz": ("user_answer",),
+    "critical_thinking": ("user_initial_answer", "user_elaboration"),
+}
+
+logger = logging.getLogger(__name__)
+
+
+class Backpressure(Exception):
+    """Raised when a classroom's or the node's queue is full; maps to an HTTP status with Retry-After."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Classroom:
+    """One classroom hosted by the server: its agents, engine and queue of pending events."""
+
+    def __init__(self, classroom_id, engine):
+        self.classroom_id = classroom_id
+        self.engine = engine
+        self.queue = deque()  # (module, event) waiting to be applied, in arrival order
+        self.draining = False  # True while a drain task owns this classroom
+        self.busy_modules = set()  # Modules with LLM jobs in flight
+        self.last_active = time.time()
+
+
+class ClassroomServer:
+    """
+    Hosts many classrooms in one process.
+    Every classroom's LLM jobs run on the shared event loop from orchestration.py, so a pending
+    completion holds no thread; a semaphore bounds the agent turns in flight across classrooms.
+    Events are queued per classroom and applied one at a time, in order, by a single drain task.
+    """
+
+    def __init__(self, max_inflight_turns=MAX_INFLIGHT_TURNS, classroom_queue_limit=CLASSROOM_QUEUE_LIMIT,
+                 node_queue_limit=NODE_QUEUE_LIMIT, max_classrooms=MAX_CLASSROOMS):
+        self.max_inflight_turns = max_inflight_turns
+        self.classroom_queue_limit = classroom_queue_limit
+        self.node_queue_limit = node_queue_limit
+        self.max_classrooms = max_classrooms
+        self.loop = get_event_loop()
+        self.turn_slots = asyncio.Semaphore(max_inflight_turns)
+        self.classrooms = {}
+        self.queued_events = 0
+        self._lock = threading.Lock()
+        self.response_cache = ResponseCache(path=LLM_CACHE_PATH) if LLM_CACHE_PATH else None
+        self.router = ModelRouter(MODEL_ROUTES, prices=MODEL_PRICES)
+        self.hedger = (Hedger(percentile=HEDGE_PERCENTILE, max_hedge_rate=HEDGE_MAX_RATE,
+                              alternate_model=HEDGING_MODE == "alternate")
+                       if HEDGING_MODE in ("same", "alternate") else None)
+        self.lesson_pack = load_lesson_pack(LESSON_PACK_PATH)
+
+    def create_classroom(self, api_key, subject=SUBJECT, topic=TOPIC, num_questions=3, structured_quiz=True):
+        with self._lock:
+            self._evict_idle()
+            if len(self.classrooms) >= self.max_classrooms:
+                raise Backpressure(503, "This node hosts the maximum number of classrooms.")
+        agents = build_classroom_agents(
+            get_client(api_key, base_url=LLM_BASE_URL, pool_size=LLM_POOL_SIZE), MODEL_NAME, subject, topic,
+            user_name=USER_NAME,
+            async_client=get_async_client(api_key, base_url=LLM_BASE_URL, pool_size=LLM_POOL_SIZE),
+            cache=self.response_cache,
+            context_window=ContextWindow(max_tokens=MAX_CONTEXT_TOKENS, keep_recent_messages=KEEP_RECENT_MESSAGES),
+            rate_limiter=get_rate_limiter(
+                key_fingerprint(api_key), requests_per_minute=RATE_LIMIT_RPM, tokens_per_minute=RATE_LIMIT_TPM,
+                max_in_flight=MAX_IN_FLIGHT_PER_KEY,
+            ),
+            single_flight=get_single_flight(),
+            telemetry=get_telemetry(TELEMETRY_LOG_PATH),
+            # Tokens the classroom may spend (SYNAPSER_CLASSROOM_TOKEN_BUDGET, unlimited by default)
+            budget=TokenBudget.from_env("SYNAPSER_CLASSROOM_TOKEN_BUDGET", FAST_MODEL),
+            router=self.router, hedger=self.hedger,
+        )
+        student_names = [name for name in agents if name != "teacher"]
+        engine = ClassroomEngine(agents, subject, student_names, num_questions=num_questions,
+                                 structured_quiz=structured_quiz,
+                                 packed=self.lesson_pack.lesson(subject, topic) if self.lesson_pack else None)
+        classroom = Classroom(uuid.uuid4().hex, engine)
+        with self._lock:
+            self.classrooms[classroom.classroom_id] = classroom
+        return classroom
+
+    def _evict_idle(self):
+        now = time.time()
+        for classroom_id, classroom in list(self.classrooms.items()):
+            if not classroom.draining and now - classroom.last_active > CLASSROOM_IDLE_SECONDS:
+                del self.classrooms[classroom_id]
+
+    def get_classroom(self, classroom_id):
+        return self.classrooms.get(classroom_id)
+
+    def remove_classroom(self, classroom_id):
+        with self._lock:
+            classroom = self.classrooms.pop(classroom_id, None)
+            if classroom is not None:
+                self.queued_events -= len(classroom.queue)
+                classroom.queue.clear()
+        return classroom is not None
+
+    def submit(self, classroom, module, event):
+        """Queues an event for a classroom and makes sure a drain task is running. Raises Backpressure."""
+        with self._lock:
+            if len(classroom.queue) >= self.classroom_queue_limit:
+                raise Backpressure(429, "Too many pending requests for this classroom.")
+            if self.queued_events >= self.node_queue_limit:
+                raise Backpressure(503, "The server is at capacity.")
+            classroom.queue.append((module, event))
+            classroom.last_active = time.time()
+            self.queued_events += 1
+            start_drain = not classroom.draining
+            classroom.draining = True
+        if start_drain:
+            asyncio.run_coroutine_threadsafe(self._drain(classroom), self.loop)
+        return len(classroom.queue)
+
+    async def _drain(self, classroom):
+        """Applies a classroom's queued events in order, running the LLM jobs each one unlocks."""
+        while True:
+            with self._lock:
+                if not classroom.queue:
+                    classroom.draining = False
+                    return
+                module, event = classroom.queue.popleft()
+                self.queued_events -= 1
+            engine = classroom.engine
+            classroom.busy_modules.add(module)
+            try:
+                if event["type"] == "restart":
+                    engine.restart(module)
+                elif event["type"] != "start":
+                    engine.dispatch(module, event)
+                await engine.arun_until_idle(module, turn_slots=self.turn_slots)
+            except Exception:
+                logger.exception("Classroom %s failed to process %s on %s", classroom.classroom_id, event["type"], module)
+            finally:
+                classroom.busy_modules.discard(module)
+                classroom.last_active = time.time()
+
+    def describe(self, classroom, module):
+        engine = classroom.engine
+        return {
+            "module": module,
+            "state": engine.states[module],
+            "busy": module in classroom.busy_modules or any(m == module for m, _ in list(classroom.queue)),
+            "pending_jobs": [job.job_id for job in engine.pending_jobs(module)],
+            "tokens_used": engine.agents["teacher"].budget.used_tokens,  # The classroom's budget, shared by its agents
+        }
+
+    def stats(self):
+        return {
+            "classrooms": len(self.classrooms),
+            "queued_events": self.queued_events,
+            "draining_classrooms": sum(1 for c in list(self.classrooms.values()) if c.draining),
+            "max_inflight_turns": self.max_inflight_turns,
+            "coalesced_calls": get_single_flight().avoided_calls(),
+            "model_routes": self.router.summary(),
+            "hedging": dict(self.hedger.stats) if self.hedger else None,
+        }
+
+
+app = Flask(__name__)
+server = ClassroomServer()
+media_store = MediaStore(root=MEDIA_CACHE_DIR) if MEDIA_CACHE_DIR else None
+
+
+def _error(status, message, retry_after=None):
+    response = jsonify({"error": message})
+    response.status_code = status
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def _api_key():
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        return auth_header[len("Bearer "):]
+    return os.getenv("OPENROUTER_API_KEY", "")
+
+
+def _lookup(classroom_id, module=None):
+    classroom = server.get_classroom(classroom_id)
+    if classroom is None:
+        return None, _error(404, "Unknown classroom.")
+    if module is not None and module not in ClassroomEngine.MODULES:
+        return None, _error(404, f"Unknown module: {module}")
+    return classroom, None
+
+
+@app.errorhandler(Backpressure)
+def handle_backpressure(error):
+    return _error(error.status, str(error), retry_after=RETRY_AFTER_SECONDS)
+
+
+@app.get("/healthz")
+def healthz():
+    return jsonify({**server.stats(), "media": dict(media_store.stats) if media_store else None})
+
+
+@app.get("/metrics")
+def metrics():
+    """LLM call counters and latency histograms of every classroom, for Prometheus to scrape."""
+    return Response(get_telemetry(TELEMETRY_LOG_PATH).prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+@app.get("/media/<digest>/<variant>")
+def get_media(digest, variant):
+    """
+    A cached lesson image ("thumb", "display" or "original"). Files are content-addressed, so the
+    ETag is stable and browsers may keep them for good; a matching If-None-Match gets 304.
+    """
+    if media_store is None or variant not in ("original", *media_store.variant_widths) or not digest.isalnum():
+        return _error(404, "Unknown media.")
+    headers = {"ETag": media_store.etag(digest, variant), "Cache-Control": "public, max-age=31536000, immutable"}
+    if headers["ETag"] in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers=headers)
+    stored = media_store.read(digest, variant)
+    if stored is None:
+        return _error(404, "Unknown media.")
+    return Response(stored[0], mimetype=media_type(stored[0]), headers=headers)
+
+
+@app.post("/classrooms")
+def create_classroom():
+    api_key = _api_key()
+    if not api_key:
+        return _error(401, "An OpenRouter API key is required (Authorization: Bearer <key>).")
+    body = request.get_json(silent=True) or {}
+    classroom = server.create_classroom(
+        api_key,
+        subject=body.get("subject", SUBJECT),
+        topic=body.get("topic", TOPIC),
+        num_questions=int(body.get("num_questions", 3)),
+        structured_quiz=bool(body.get("structured_quiz", True)),
+    )
+    return jsonify({"classroom_id": classroom.classroom_id, "modules": list(ClassroomEngine.MODULES)}), 201
+
+
+@app.get("/classrooms/<classroom_id>")
+def get_classroom(classroom_id):
+    classroom, error = _lookup(classroom_id)
+    if error:
+        return error
+    return jsonify({module: server.describe(classroom, module) for module in ClassroomEngine.MODULES})
+
+
+@app.delete("/classrooms/<classroom_id>")
+def delete_classroom(classroom_id):
+    if not server.remove_classroom(classroom_id):
+        return _error(404, "Unknown classroom.")
+    return "", 204
+
+
+@app.get("/classrooms/<classroom_id>/<module>")
+def get_module(classroom_id, module):
+    classroom, error = _lookup(classroom_id, module)
+    if error:
+        return error
+    return jsonify(server.describe(classroom, module))
+
+
+@app.post("/classrooms/<classroom_id>/<module>/events")
+def post_event(classroom_id, module):
+    """
+    Queues an event and returns 202 right away; poll the module to see its effect.
+    Body: {"type": "start" | "restart" | <user event>, "text": "..."}.
+    """
+    classroom, error = _lookup(classroom_id, module)
+    if error:
+        return error
+    body = request.get_json(silent=True) or {}
+    event_type = body.get("type")
+    if event_type in ("start", "restart"):
+        event = {"type": event_type}
+    elif event_type in USER_EVENTS[module]:
+        text = str(body.get("text", "")).strip()
+        if not text:
+            return _error(400, "'text' is required.")
+        event = {"type": event_type, "text": text}
+    else:
+        allowed = ", ".join(("start", "restart") + USER_EVENTS[module])
+        return _error(400, f"Unknown event type for {module}; expected one of: {allowed}")
+    queued = server.submit(classroom, module, event)
+    return jsonify({"queued": queued}), 202
+
+
+if __name__ == "__main__":
+    # Flask's threaded server is enough here: handlers only queue work, LLM calls never block them
+    app.run(host=os.getenv("SYNAPSER_SERVER_HOST", "127.0.0.1"), port=int(os.getenv("SYNAPSER_SERVER_PORT", "8000")),
+            threaded=True)
@@ -0,0 +1,258 @@
+# session_store.py
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+DEFAULT_SESSION_DB = os.path.join(".cache", "sessions.sqlite3")
+MAX_TRACKED_SESSIONS = 1000  # Sessions whose last checkpoint is remembered; the others are re-read from the log
+
+# Module state kept in st.session_state that is worth surviving a restart
+PERSISTED_STATE_KEYS = [
+    "focal_points",
+    "current_focal_point_descriptions",
+    "overview_interaction",
+    "quiz_state",
+    "ct_state",
+]
+
+
+def _encode(value):
+    """JSON-encodes a value, tagging dicts with non-string keys (e.g. quiz answers keyed by question index)."""
+    def tag(obj):
+        if isinstance(obj, dict):
+            if obj and all(isinstance(k, int) for k in obj):
+                return {"__int_keys__": {str(k): tag(v) for k, v in obj.items()}}
+            return {k: tag(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [tag(v) for v in obj]
+        return obj
+    return json.dumps(tag(value), sort_keys=True, ensure_ascii=False)
+
+
+def _decode(payload):
+    def untag(obj):
+        if isinstance(obj, dict):
+            if set(obj) == {"__int_keys__"}:
+                return {int(k): untag(v) for k, v in obj["__int_keys__"].items()}
+            return {k: untag(v) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [untag(v) for v in obj]
+        return obj
+    return untag(json.loads(payload))
+
+
+def _digest(encoded):
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def _chain(digest, messages):
+    """Rolling digest of a history: each message's digest is folded into the digest of the ones before it."""
+    for message in messages:
+        digest = _digest((digest or "") + _digest(_encode(message)))
+    return digest
+
+
+def _messages_mark(messages, count):
+    """
+    What a checkpoint remembers of the first 'count' messages of a history: their number and rolling digest.
+    Any edit of that prefix (clearing, compacting, a new system prompt, a rewritten turn) changes the digest.
+    """
+    return (count, _chain(None, messages[:count]))
+
+
+def _is_serializable(value):
+    try:
+        _encode(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+class SessionStore:
+    """
+    Append-only event log of classroom sessions in an SQLite file.
+    Each checkpoint only appends what changed since the previous one (new messages,
+    changed state keys), so completions that were already paid for survive a server
+    restart or a lost websocket and can be replayed without calling the provider again.
+    What was persisted is tracked as digests for the 'max_sessions' most recently checkpointed
+    sessions; a session forgotten (or evicted) in between is re-read from its log at its next checkpoint.
+    """
+
+    def __init__(self, path=DEFAULT_SESSION_DB, max_sessions=MAX_TRACKED_SESSIONS):
+        self.path = path
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # {session_id: {("messages", name): messages mark, (kind, name): {key: digest}, ("state_value", key): digest}}
+        self._persisted = collections.OrderedDict()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, kind TEXT, name TEXT, payload TEXT, created_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS events_session ON events (session_id, id)")
+        self._db.commit()
+
+    def _append(self, session_id, kind, name, payload):
+        self._db.execute(
+            "INSERT INTO events (session_id, kind, name, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+            (session_id, kind, name, payload, time.time()),
+        )
+
+    # --- Recording ---
+
+    def _tracked(self, session_id, snapshot=None):
+        """What was persisted for the session, re-read from its log (or 'snapshot') when it is not tracked anymore."""
+        tracked = self._persisted.get(session_id)
+        if tracked is None:
+            snapshot = snapshot if snapshot is not None else self._load(session_id)
+            tracked = self._persisted[session_id] = self._track_snapshot(snapshot)
+            while len(self._persisted) > self.max_sessions:
+                self._persisted.popitem(last=False)
+        self._persisted.move_to_end(session_id)
+        return tracked
+
+    @staticmethod
+    def _track_snapshot(snapshot):
+        tracked = {}
+        for name, agent_snapshot in snapshot["agents"].items():
+            messages = agent_snapshot["messages"]
+            tracked[("messages", name)] = _messages_mark(messages, len(messages))
+            tracked[("agent_state", name)] = {key: _digest(_encode(v)) for key, v in agent_snapshot["state"].items()}
+        for key, value in snapshot["states"].items():
+            if isinstance(value, dict):
+                tracked[("state_patch", key)] = {k: _digest(_encode(v)) for k, v in value.items()}
+            else:
+                tracked[("state_value", key)] = _digest(_encode(value))
+        return tracked
+
+    def _record_agent(self, session_id, tracked, name, agent):
+        messages = agent.messages
+        mark = tracked.get(("messages", name), _messages_mark(messages, 0))
+        count = mark[0]
+        if len(messages) >= count and _messages_mark(messages, count) == mark:
+            if len(messages) > count:
+                self._append(session_id, "messages_append", name, _encode(messages[count:]))
+            tracked[("messages", name)] = (len(messages), _chain(mark[1], messages[count:]))
+        else:  # History was cleared, compacted or edited
+            self._append(session_id, "messages_reset", name, _encode(messages))
+            tracked[("messages", name)] = _messages_mark(messages, len(messages))
+
+        agent_state = getattr(agent, "state", None)
+        if agent_state is not None:
+            self._record_mapping(session_id, tracked, "agent_state", name, agent_state)
+
+    def _record_mapping(self, session_id, tracked, kind, name, mapping):
+        """Appends a patch with the top-level keys of 'mapping' that changed since the last checkpoint."""
+        encoded = {key: _encode(value) for key, value in mapping.items() if _is_serializable(value)}
+        persisted = tracked.get((kind, name), {})
+        changed = {key: value for key, value in encoded.items() if persisted.get(key) != _digest(value)}
+        removed = [key for key in persisted if key not in encoded]
+        if changed or removed:
+            payload = json.dumps({"set": changed, "removed": removed}, ensure_ascii=False)
+            self._append(session_id, kind, name, payload)
+            tracked[(kind, name)] = {key: _digest(value) for key, value in encoded.items()}
+
+    def checkpoint(self, session_id, agents, session_state):
+        """Appends everything that changed in the session's agents and persisted module state."""
+        with self._lock:
+            tracked = self._tracked(session_id)
+            for name, agent in agents.items():
+                self._record_agent(session_id, tracked, name, agent)
+            for key in PERSISTED_STATE_KEYS:
+                if key in session_state:
+                    value = session_state[key]
+                    if isinstance(value, dict):
+                        self._record_mapping(session_id, tracked, "state_patch", key, value)
+                    elif tracked.get(("state_value", key)) != _digest(_encode(value)):
+                        self._append(session_id, "state_value", key, _encode(value))
+                        tracked[("state_value", key)] = _digest(_encode(value))
+                elif ("state_patch", key) in tracked or ("state_value", key) in tracked:
+                    self._append(session_id, "state_delete", key, "null")
+                    tracked.pop(("state_patch", key), None)
+                    tracked.pop(("state_value", key), None)
+            self._db.commit()
+
+    def forget(self, session_id):
+        """Drops what is tracked about a session that ended (its log is kept, and re-read if it comes back)."""
+        with self._lock:
+            self._persisted.pop(session_id, None)
+
+    # --- Replay ---
+
+    def load(self, session_id):
+        """Replays the event log into {"agents": {name: {"messages", "state"}}, "states": {key: value}}."""
+        with self._lock:
+            return self._load(session_id)
+
+    def _load(self, session_id):
+        rows = self._db.execute(
+            "SELECT kind, name, payload FROM events WHERE session_id = ? ORDER BY id", (session_id,)
+        ).fetchall()
+        snapshot = {"agents": {}, "states": {}}
+        for kind, name, payload in rows:
+            if kind in ("messages_append", "messages_reset", "agent_state"):
+                agent_snapshot = snapshot["agents"].setdefault(name, {"messages": [], "state": {}})
+                if kind == "messages_append":
+                    agent_snapshot["messages"].extend(_decode(payload))
+                elif kind == "messages_reset":
+                    agent_snapshot["messages"] = _decode(payload)
+                else:
+                    self._apply_patch(agent_snapshot["state"], payload)
+            elif kind == "state_patch":
+                if not isinstance(snapshot["states"].get(name), dict):
+                    snapshot["states"][name] = {}
+                self._apply_patch(snapshot["states"][name], payload)
+            elif kind == "state_value":
+                snapshot["states"][name] = _decode(payload)
+            elif kind == "state_delete":
+                snapshot["states"].pop(name, None)
+        return snapshot
+
+    @staticmethod
+    def _apply_patch(target, payload):
+        patch = json.loads(payload)
+        for key, value in patch["set"].items():
+            target[key] = _decode(value)
+        for key in patch["removed"]:
+            target.pop(key, None)
+
+    def restore(self, session_id, agents, session_state):
+        """
+        Rebuilds a session from its event log into freshly constructed agents and the session state.
+        Returns True if there was anything to restore.
+        """
+        snapshot = self.load(session_id)
+        if not snapshot["agents"] and not snapshot["states"]:
+            return False
+        with self._lock:
+            tracked = self._tracked(session_id, snapshot)
+            for name, agent_snapshot in snapshot["agents"].items():
+                agent = agents.get(name)
+                if agent is None:
+                    continue
+                if agent_snapshot["messages"]:
+                    agent.messages = agent_snapshot["messages"]
+                if hasattr(agent, "state"):
+                    agent.state = agent_snapshot["state"]
+                tracked[("messages", name)] = _messages_mark(agent.messages, len(agent.messages))
+            for key, value in snapshot["states"].items():
+                session_state[key] = value
+        return True
+
+
+class SessionRelease:
+    """
+    Kept in a Streamlit session's state: once Streamlit drops the session (and its state is
+    garbage-collected), the store stops tracking it. Its log stays on disk for a reconnect.
+    """
+
+    def __init__(self, store, session_id):
+        self.session_id = session_id
+        weakref.finalize(self, store.forget, session_id)
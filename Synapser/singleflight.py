@@ -0,0 +1,100 @@
+# singleflight.py
+import asyncio
+import threading
+from concurrent.futures import Future
+
+_LEADER_CANCELLED = object()  # Handed to followers instead of the cancelled leader's CancelledError
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls that are in flight at the same time.
+    The first caller for a key (the leader) does the work; callers arriving with the same key
+    before it finishes wait for its result instead of repeating the call. Nothing is kept
+    once the call completes: this is not a cache, only de-duplication of concurrent work.
+    Sync and async callers can share a key, since the result travels through a concurrent Future.
+    A leader cancelled by its own caller (e.g. the losing side of a hedged call) does not cancel
+    its followers: they retry, and one of them leads the call again. A cancelled follower only stops waiting.
+    """
+
+    def __init__(self):
+        self._in_flight = {}  # {key: Future}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    def _join(self, key):
+        """Returns (future, is_leader)."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            self.stats["leaders"] += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if future.done():  # Only a caller cancelling the shared future could settle it first
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _followed(self, result):
+        """False when the leader was cancelled, so the follower has to retry (and was not coalesced after all)."""
+        if result is not _LEADER_CANCELLED:
+            return True
+        with self._lock:
+            self.stats["coalesced"] -= 1
+        return False
+
+    def do(self, key, fn):
+        """Runs fn() unless an identical call is in flight. Returns (result, shared); errors propagate to everyone."""
+        future, is_leader = self._join(key)
+        while not is_leader:
+            result = future.result()
+            if self._followed(result):
+                return result, True
+            future, is_leader = self._join(key)
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result, False
+
+    async def ado(self, key, coro_fn):
+        """Async counterpart of do(); 'coro_fn' returns the awaitable to run when this caller leads."""
+        future, is_leader = self._join(key)
+        while not is_leader:
+            # Shielded: a follower cancelled by its own caller (e.g. a losing hedge) must not cancel the shared call
+            result = await asyncio.shield(asyncio.wrap_future(future))
+            if self._followed(result):
+                return result, True
+            future, is_leader = self._join(key)
+        try:
+            result = await coro_fn()
+        except asyncio.CancelledError:
+            self._finish(key, future, result=_LEADER_CANCELLED) # Only this caller gave up
+            raise
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result, False
+
+    def avoided_calls(self):
+        return self.stats["coalesced"]
+
+
+_shared_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    """The process-wide SingleFlight, shared by every session's agents."""
+    return _shared_single_flight
@@ -0,0 +1,194 @@
+# telemetry.py
+import bisect
+import collections
+import contextlib
+import contextvars
+import json
+import statistics
+import threading
+import time
+
+MAX_RECORDS = 2000  # Per collector; older records are dropped, the Prometheus counters keep counting
+LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)  # Seconds, for the duration histogram
+
+_current_module = contextvars.ContextVar("synapser_module", default="other")
+_process_telemetry = None
+_process_telemetry_lock = threading.Lock()
+
+
+def current_module():
+    """Classroom module (overview, focal, quiz, critical_thinking) the running code works for."""
+    return _current_module.get()
+
+
+def set_current_module(module):
+    """Tags the calls that follow with 'module'; for script-style callers that pick the module once per run."""
+    return _current_module.set(module)
+
+
+@contextlib.contextmanager
+def module_scope(module):
+    """Tags the calls made inside the block (and in the threads and tasks it starts) with 'module'."""
+    token = _current_module.set(module)
+    try:
+        yield
+    finally:
+        _current_module.reset(token)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+class Telemetry:
+    """
+    Records one entry per Agent call: agent, module, model, kind (chat/stream/summary), latency,
+    time to first token, tokens, response-cache hits, coalesced calls and errors.
+    A session keeps its own collector for the sidebar; with 'parent' every record is also passed to
+    the process-wide collector, which backs the Prometheus export and the optional JSONL log.
+    """
+
+    def __init__(self, max_records=MAX_RECORDS, sink_path=None, parent=None):
+        self.records = collections.deque(maxlen=max_records)
+        self.sink_path = sink_path  # Optional JSON-lines file every record is appended to
+        self.parent = parent
+        self._series = {}  # {(agent, module, model, outcome): counters} for the Prometheus export
+        self._lock = threading.Lock()
+
+    def record(self, agent, model, kind, latency, ttft=None, prompt_tokens=0, completion_tokens=0, cached_tokens=0,
+               outcome="ok", error=None, module=None):
+        """Adds a call record; 'outcome' is "ok", "error", "cache_hit" (response cache) or "coalesced"."""
+        entry = {
+            "timestamp": round(time.time(), 3),
+            "agent": agent,
+            "module": module or current_module(),
+            "model": model,
+            "kind": kind,
+            "outcome": outcome,
+            "latency_s": round(latency, 4),
+            "ttft_s": round(ttft, 4) if ttft is not None else None,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "error": error,
+        }
+        self._add(entry)
+        return entry
+
+    def _add(self, entry):
+        with self._lock:
+            self.records.append(entry)
+            key = (entry["agent"], entry["module"], entry["model"], entry["outcome"])
+            series = self._series.setdefault(key, {
+                "calls": 0, "latency_sum": 0.0, "buckets": [0] * len(LATENCY_BUCKETS), "ttft_sum": 0.0,
+                "ttft_count": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+            })
+            series["calls"] += 1
+            series["latency_sum"] += entry["latency_s"]
+            bucket = bisect.bisect_left(LATENCY_BUCKETS, entry["latency_s"])
+            if bucket < len(LATENCY_BUCKETS):
+                series["buckets"][bucket] += 1  # Made cumulative when exported
+            if entry["ttft_s"] is not None:
+                series["ttft_sum"] += entry["ttft_s"]
+                series["ttft_count"] += 1
+            for tokens in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                series[tokens] += entry[tokens]
+            if self.sink_path:
+                with open(self.sink_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+        if self.parent is not None:
+            self.parent._add(entry)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.records)
+
+    def totals(self):
+        """Session totals, overall and per module, over the retained records."""
+        records = self.snapshot()
+        provider_calls = [r for r in records if r["outcome"] in ("ok", "error")]
+        latencies = sorted(r["latency_s"] for r in provider_calls)
+        by_module = {}
+        for r in provider_calls:
+            module = by_module.setdefault(r["module"], {"calls": 0, "latency_s": 0.0, "tokens": 0})
+            module["calls"] += 1
+            module["latency_s"] += r["latency_s"]
+            module["tokens"] += r["prompt_tokens"] + r["completion_tokens"]
+        ttfts = [r["ttft_s"] for r in provider_calls if r["ttft_s"] is not None]
+        return {
+            "calls": len(provider_calls),
+            "errors": sum(1 for r in records if r["outcome"] == "error"),
+            "cache_hits": sum(1 for r in records if r["outcome"] == "cache_hit"),
+            "coalesced": sum(1 for r in records if r["outcome"] == "coalesced"),
+            "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+            "completion_tokens": sum(r["completion_tokens"] for r in records),
+            "latency_s": round(sum(latencies), 3),
+            "p50_latency_s": round(latencies[len(latencies) // 2], 3) if latencies else 0.0,
+            "p95_latency_s": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else 0.0,
+            "mean_ttft_s": round(statistics.mean(ttfts), 3) if ttfts else 0.0,
+            "by_module": by_module,
+        }
+
+    def slowest(self, n=5):
+        return sorted(self.snapshot(), key=lambda r: r["latency_s"], reverse=True)[:n]
+
+    def to_jsonl(self):
+        return "".join(json.dumps(r) + "\n" for r in self.snapshot())
+
+    def prometheus(self):
+        """Counters and a latency histogram in the Prometheus text exposition format."""
+        with self._lock:
+            series = {key: {**value, "buckets": list(value["buckets"])} for key, value in self._series.items()}
+        lines = [
+            "# HELP synapser_llm_calls_total Agent calls by agent, module, model and outcome.",
+            "# TYPE synapser_llm_calls_total counter",
+        ]
+        for (agent, module, model, outcome), s in sorted(series.items()):
+            lines.append(f"synapser_llm_calls_total{_labels(agent=agent, module=module, model=model, outcome=outcome)} {s['calls']}")
+        lines += [
+            "# HELP synapser_llm_tokens_total Tokens reported by the provider (cached = served from its prompt cache).",
+            "# TYPE synapser_llm_tokens_total counter",
+        ]
+        tokens = {}
+        for (agent, module, model, _), s in series.items():
+            for token_type in ("prompt", "completion", "cached"):
+                key = (agent, module, model, token_type)
+                tokens[key] = tokens.get(key, 0) + s[f"{token_type}_tokens"]
+        for (agent, module, model, token_type), count in sorted(tokens.items()):
+            lines.append(f"synapser_llm_tokens_total{_labels(agent=agent, module=module, model=model, type=token_type)} {count}")
+        lines += [
+            "# HELP synapser_llm_call_duration_seconds Agent call latency.",
+            "# TYPE synapser_llm_call_duration_seconds histogram",
+        ]
+        for (agent, module, model, outcome), s in sorted(series.items()):
+            label_values = {"agent": agent, "module": module, "model": model, "outcome": outcome}
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, s["buckets"]):
+                cumulative += count
+                lines.append(f"synapser_llm_call_duration_seconds_bucket{_labels(**label_values, le=bound)} {cumulative}")
+            lines.append(f"synapser_llm_call_duration_seconds_bucket{_labels(**label_values, le='+Inf')} {s['calls']}")
+            lines.append(f"synapser_llm_call_duration_seconds_sum{_labels(**label_values)} {s['latency_sum']:.4f}")
+            lines.append(f"synapser_llm_call_duration_seconds_count{_labels(**label_values)} {s['calls']}")
+        lines += [
+            "# HELP synapser_llm_time_to_first_token_seconds Time until the first response token arrived.",
+            "# TYPE synapser_llm_time_to_first_token_seconds summary",
+        ]
+        for (agent, module, model, outcome), s in sorted(series.items()):
+            if s["ttft_count"]:
+                labels = _labels(agent=agent, module=module, model=model, outcome=outcome)
+                lines.append(f"synapser_llm_time_to_first_token_seconds_sum{labels} {s['ttft_sum']:.4f}")
+                lines.append(f"synapser_llm_time_to_first_token_seconds_count{labels} {s['ttft_count']}")
+        return "\n".join(lines) + "\n"
+
+
+def get_telemetry(sink_path=None):
+    """Returns the process-wide collector, creating it on first use ('sink_path' only applies then)."""
+    global _process_telemetry
+    with _process_telemetry_lock:
+        if _process_telemetry is None:
+            _process_telemetry = Telemetry(sink_path=sink_path or None)
+    return _process_telemetry
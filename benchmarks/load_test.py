@@ -0,0 +1,359 @@
+# load_test.py
+"""
+Load generator: N simulated students, each taking the quiz and the critical-thinking exercise with
+scripted answers, against a local mock provider. Students run concurrently at each level of
+--levels; per level it reports throughput, p50/p95/p99 turn latency, memory per session (process
+RSS growth and the size of the agents' message histories) and flags the first level whose p95
+latency exceeds --degradation-factor times the p95 of the lowest level.
+
+A "turn" is one user action until the app is ready for the next one (all LLM work it triggered done).
+
+    python benchmarks/load_test.py --target server --levels 10,50,100,200
+    python benchmarks/load_test.py --target streamlit --levels 5,10,20
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from mock_provider import MockProvider
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SYNAPSER_DIR = os.path.join(REPO_ROOT, "Synapser")
+POLL_SECONDS = 0.05
+
+QUIZ_ANSWERS = [
+    "Steam engines let factories run anywhere, not only next to rivers.",
+    "It made coal mining deeper and cheaper because pumps removed the water.",
+    "Railways cut travel times and connected markets across the country.",
+    "James Watt's separate condenser made the engine far more efficient.",
+    "Cities grew quickly as workers moved to the new factories.",
+]
+CT_ANSWERS = [
+    "I think the benefits were real but arrived much later for ordinary workers.",
+    "Progress depended on who owned the machines, not only on the machines themselves.",
+]
+CT_ELABORATIONS = [
+    "I agree with the point, but child labour shows the costs were not shared evenly.",
+    "That is a good argument; I would add the environmental cost of burning coal.",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def rss_bytes():
+    """Resident memory of this process (Linux /proc, falling back to the peak from getrusage)."""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def history_footprint(agents):
+    """Messages, characters and estimated tokens held in one session's agent histories."""
+    from context import count_message_tokens
+    return {
+        "messages": sum(len(agent.messages) for agent in agents.values()),
+        "history_chars": sum(len(str(m.get("content", ""))) for agent in agents.values() for m in agent.messages),
+        "history_tokens": sum(count_message_tokens(agent.messages) for agent in agents.values()),
+    }
+
+
+class Student(threading.Thread):
+    """One simulated student; subclasses implement the target-specific steps."""
+
+    def __init__(self, student_id, think_time, seed, timeout):
+        super().__init__(name=f"student-{student_id}", daemon=True)
+        self.student_id = student_id
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+        self.timeout = timeout
+        self.turn_latencies = []
+        self.rejections = 0
+        self.error = None
+        self.footprint = None  # history_footprint() of the finished session
+        self.rss_growth = None  # Bytes, when the session ran in its own process
+
+    def think(self):
+        time.sleep(self.rng.uniform(0.5, 1.5) * self.think_time)
+
+    def timed(self, fn, *args):
+        started_at = time.time()
+        result = fn(*args)
+        self.turn_latencies.append(time.time() - started_at)
+        return result
+
+    def run(self):
+        try:
+            self.run_student()
+        except Exception as e:
+            self.error = repr(e)
+
+    def cleanup(self):
+        pass
+
+
+class ServerStudent(Student):
+    """Talks to server.py over HTTP."""
+
+    def __init__(self, student_id, think_time, seed, timeout, base_url, classroom_server):
+        super().__init__(student_id, think_time, seed, timeout)
+        self.base_url = base_url
+        self.classroom_server = classroom_server
+        self.classroom_id = None
+
+    def request(self, method, path, body=None):
+        """Sends a request, waiting out 429/503 responses as told by Retry-After."""
+        while True:
+            data = json.dumps(body).encode("utf-8") if body is not None else None
+            req = urllib.request.Request(self.base_url + path, data=data, method=method, headers={
+                "Content-Type": "application/json", "Authorization": "Bearer load-test-key",
+            })
+            try:
+                with urllib.request.urlopen(req, timeout=120) as response:
+                    payload = response.read()
+                    return json.loads(payload) if payload else None
+            except urllib.error.HTTPError as e:
+                if e.code not in (429, 503):
+                    raise
+                self.rejections += 1
+                time.sleep(float(e.headers.get("Retry-After", "1")))
+
+    def wait_until_ready(self, module):
+        deadline = time.time() + self.timeout
+        while True:
+            status = self.request("GET", f"/classrooms/{self.classroom_id}/{module}")
+            if not status["busy"] and not status["pending_jobs"]:
+                return status
+            if time.time() > deadline:  # e.g. a job that keeps failing stays pending
+                raise TimeoutError(f"{module} still has pending jobs: {status['pending_jobs']}")
+            time.sleep(POLL_SECONDS)
+
+    def act(self, module, event):
+        self.request("POST", f"/classrooms/{self.classroom_id}/{module}/events", event)
+        return self.wait_until_ready(module)
+
+    def run_student(self):
+        self.classroom_id = self.request("POST", "/classrooms", {})["classroom_id"]
+
+        status = self.timed(self.act, "quiz", {"type": "start"})
+        while not status["state"]["quiz_complete"]:
+            self.think()
+            status = self.timed(self.act, "quiz", {"type": "user_answer", "text": self.rng.choice(QUIZ_ANSWERS)})
+
+        self.timed(self.act, "critical_thinking", {"type": "start"})
+        self.think()
+        self.timed(self.act, "critical_thinking", {"type": "user_initial_answer", "text": self.rng.choice(CT_ANSWERS)})
+        self.think()
+        self.timed(self.act, "critical_thinking", {"type": "user_elaboration", "text": self.rng.choice(CT_ELABORATIONS)})
+        self.footprint = history_footprint(self.classroom_server.get_classroom(self.classroom_id).engine.agents)
+
+    def cleanup(self):
+        if self.classroom_id is not None:
+            self.classroom_server.remove_classroom(self.classroom_id)
+
+
+def play_streamlit_student(think_time, seed, timeout):
+    """
+    Plays app.py through Streamlit's AppTest. Runs in a worker process: AppTest sessions share
+    process-wide Streamlit state, so two of them cannot run in one process at the same time.
+    """
+    from streamlit.testing.v1 import AppTest
+    sys.path.insert(0, SYNAPSER_DIR)
+    os.chdir(REPO_ROOT)
+    import quiz, critical_thinking, utils, llm_client  # noqa: F401 - loaded up front so imports don't count as session memory
+    student = Student(0, think_time, seed, timeout)
+    baseline_rss = rss_bytes()
+    at = AppTest.from_file(os.path.join(SYNAPSER_DIR, "app.py"), default_timeout=timeout)
+
+    def check():
+        if at.exception:
+            raise RuntimeError([e.value for e in at.exception])
+
+    def open_module(module):
+        student.timed(at.radio(key="demo_selection").set_value(module).run)
+        check()
+
+    def submit(input_key, text, label_prefix):
+        student.think()
+        at.text_area(key=input_key).input(text)
+        button = next(b for b in at.button if b.label.startswith(label_prefix))
+        student.timed(button.click().run)
+        check()
+
+    try:
+        student.timed(at.run)
+        check()
+        open_module("📝 Interactive Quiz")
+        question_idx = 0
+        while any(b.label.startswith("Submit Answer") for b in at.button):
+            submit(f"user_answer_q{question_idx}", student.rng.choice(QUIZ_ANSWERS), "Submit Answer")
+            question_idx += 1
+        open_module("🤔 Critical Thinking Challenge")
+        submit("ct_user_initial_answer", student.rng.choice(CT_ANSWERS), "Submit Your Initial Answer")
+        submit("ct_user_elaboration", student.rng.choice(CT_ELABORATIONS), "Submit Your Elaboration")
+        footprint = history_footprint(at.session_state["agents"])
+        error = None
+    except Exception as e:
+        footprint, error = None, repr(e)
+    return {"turn_latencies": student.turn_latencies, "footprint": footprint, "error": error,
+            "rss_growth": rss_bytes() - baseline_rss}
+
+
+class StreamlitStudent(Student):
+    """Hands the session to a worker process (see play_streamlit_student) and collects its measurements."""
+
+    def __init__(self, student_id, think_time, seed, timeout, pool):
+        super().__init__(student_id, think_time, seed, timeout)
+        self.pool = pool
+        self.seed = seed
+
+    def run_student(self):
+        # By module name: AppTest swaps the worker's __main__ for app.py, so __main__.play_streamlit_student would not resolve
+        import load_test
+        result = self.pool.submit(load_test.play_streamlit_student, self.think_time, self.seed, self.timeout).result()
+        self.turn_latencies = result["turn_latencies"]
+        self.footprint = result["footprint"]
+        self.rss_growth = result["rss_growth"]
+        if result["error"]:
+            raise RuntimeError(result["error"])
+
+
+def start_server(max_classrooms):
+    """Runs server.py's Flask app in this process (so sessions can be inspected) on a free port."""
+    from werkzeug.serving import make_server
+    import server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # One access-log line per poll otherwise
+    server.server.max_classrooms = max_classrooms
+    http_server = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, name="classroom-server", daemon=True).start()
+    return http_server, f"http://127.0.0.1:{http_server.server_port}", server.server
+
+
+def run_level(args, level, make_student):
+    baseline_rss = rss_bytes()
+    rng = random.Random(args.seed + level)
+    students = [make_student(i, rng.randrange(2 ** 32)) for i in range(level)]
+    started_at = time.time()
+    for student in students:
+        student.start()
+        time.sleep(args.ramp_up / max(level, 1))
+    for student in students:
+        student.join()
+    elapsed = time.time() - started_at
+
+    latencies = [latency for student in students for latency in student.turn_latencies]
+    footprints = [student.footprint for student in students if student.footprint]
+    own_process = [student.rss_growth for student in students if student.rss_growth is not None]
+    rss_per_session = (statistics.mean(own_process) if own_process
+                       else (rss_bytes() - baseline_rss) / max(level, 1))
+    result = {
+        "students": level,
+        "completed": sum(1 for s in students if s.error is None),
+        "errors": [s.error for s in students if s.error][:3],
+        "turns": len(latencies),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_turns_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "p99_s": round(percentile(latencies, 99), 3),
+        "rejections": sum(s.rejections for s in students),
+        "rss_per_session_kb": round(rss_per_session / 1024, 1),
+    }
+    for key in ("messages", "history_chars", "history_tokens"):
+        result[f"{key}_per_session"] = round(statistics.mean(f[key] for f in footprints), 1) if footprints else 0
+    for student in students:
+        student.cleanup()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many concurrent students against a local mock provider")
+    parser.add_argument("--target", choices=["server", "streamlit"], default="server")
+    parser.add_argument("--levels", default="10,50,100,200", help="Comma-separated numbers of concurrent students")
+    parser.add_argument("--latency", default="lognormal:0.4:0.4")
+    parser.add_argument("--tps", type=float, default=80.0)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--think-time", type=float, default=2.0, help="Mean seconds a student spends per answer")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="Seconds over which a level's students join")
+    parser.add_argument("--degradation-factor", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--output", help="Optional JSON file for the per-level results")
+    args = parser.parse_args()
+
+    provider = MockProvider(latency=args.latency, tokens_per_second=args.tps, completion_tokens=args.completion_tokens,
+                            error_rate=args.error_rate, seed=args.seed).start()
+    os.environ.update({
+        "OPENROUTER_API_KEY": "load-test-key",
+        "SYNAPSER_BASE_URL": provider.base_url,
+        "SYNAPSER_SESSION_DB": "",
+        "SYNAPSER_LLM_CACHE": "",
+        "SYNAPSER_RATE_LIMIT_RPM": "0",  # The mock has no quota; measure the deployment itself
+        "SYNAPSER_MAX_IN_FLIGHT": os.getenv("SYNAPSER_MAX_IN_FLIGHT", "256"),
+    })
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, SYNAPSER_DIR)
+    levels = [int(level) for level in args.levels.split(",")]
+
+    http_server = pool = None
+    if args.target == "server":
+        http_server, base_url, classroom_server = start_server(max(levels))
+        make_student = lambda i, seed: ServerStudent(i, args.think_time, seed, args.timeout, base_url, classroom_server)
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=max(levels),
+                                                      mp_context=multiprocessing.get_context("spawn"))
+        make_student = lambda i, seed: StreamlitStudent(i, args.think_time, seed, args.timeout, pool)
+
+    results = []
+    try:
+        run_level(args, 1, make_student)  # Warm-up: imports and connection pools would otherwise count as session memory
+        print(f"{'students':>8}{'turns/s':>9}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'429/503':>8}{'KB/sess':>9}{'msgs/sess':>10}")
+        for level in levels:
+            result = run_level(args, level, make_student)
+            results.append(result)
+            print(f"{result['students']:>8}{result['throughput_turns_per_s']:>9.2f}{result['p50_s']:>8.2f}"
+                  f"{result['p95_s']:>8.2f}{result['p99_s']:>8.2f}{result['rejections']:>8}"
+                  f"{result['rss_per_session_kb']:>9.0f}{result['messages_per_session']:>10}"
+                  + (f"  ({result['students'] - result['completed']} failed: {result['errors']})" if result["errors"] else ""))
+    finally:
+        if http_server is not None:
+            http_server.shutdown()
+        if pool is not None:
+            pool.shutdown()
+        provider.stop()
+
+    degraded = next((r["students"] for r in results[1:] if r["p95_s"] > results[0]["p95_s"] * args.degradation_factor), None)
+    if degraded is None:
+        print(f"\nNo degradation beyond {args.degradation_factor}x the p95 of {results[0]['students']} students.")
+    else:
+        print(f"\nLatency degrades at {degraded} concurrent students "
+              f"(p95 over {args.degradation_factor}x that of {results[0]['students']} students).")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "levels": results, "degrades_at": degraded}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# mock_provider.py
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FOCAL_POINTS = ["The Development of the Steam Engine", "Impact on Manufacturing Processes", "The Transportation Revolution"]
+LOREM_WORDS = (
+    "steam engines pumped water from mines then drove looms mills and locomotives changing where people "
+    "worked and how goods moved across Britain and beyond"
+).split()
+
+
+def parse_distribution(spec, rng=random):
+    """
+    Returns a sampler (seconds) from a spec such as "fixed:0.3", "uniform:0.2:0.8" or
+    "lognormal:0.4:0.5" (median and sigma), drawing from 'rng' (a seeded random.Random for reproducible runs).
+    """
+    kind, *params = spec.split(":")
+    params = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda: params[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(params[0], params[1])
+    if kind == "lognormal":
+        median, sigma = params
+        return lambda: rng.lognormvariate(0, sigma) * median
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def message_text(message):
+    content = message.get("content") or ""
+    if isinstance(content, list):  # Content parts (cache_control breakpoints)
+        content = "".join(part.get("text", "") for part in content)
+    return content
+
+
+class MockProvider:
+    """
+    Local OpenAI-compatible chat-completions server for benchmarks.
+    Replies are canned but shaped like the real ones (JSON quizzes, focal point lists, rankings), so
+    every classroom flow runs end to end. Latency = time to first token + completion tokens / tokens_per_second.
+    Every call is recorded with its start and end time so runs can compute call counts and critical paths.
+    """
+
+    def __init__(self, latency="lognormal:0.4:0.4", tokens_per_second=80.0, completion_tokens=60, error_rate=0.0,
+                 error_status=429, host="127.0.0.1", port=0, seed=None):
+        self._random = random.Random(seed)
+        self.sample_ttft = parse_distribution(latency, self._random)  # Same seed, same latencies
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.records = []
+        self._question_counter = itertools.count(1)
+        self._lock = threading.Lock()
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+                else:
+                    self._send_json(404, {"error": {"message": "Not found"}})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "Not found"}})
+                    return
+                try:
+                    provider.handle_completion(self, body)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True # The client gave up on the request (e.g. a cancelled hedge)
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-provider", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        """Clears the recorded calls; returns the previous records."""
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+    # --- Replies ---
+
+    def reply_for(self, messages):
+        prompt = message_text(messages[-1]) if messages else ""
+        if '{"questions"' in prompt:
+            count = int((re.search(r"Write (\d+) distinct", prompt) or [None, 3])[1])
+            questions = [f"What changed because of invention #{next(self._question_counter)}?" for _ in range(count)]
+            return json.dumps({"questions": questions})
+        if "python list of strings" in prompt:
+            return repr(FOCAL_POINTS)
+        if "Final Ranking:" in prompt:
+            return "Final Ranking:\n1. Paola - Accurate.\n2. User - Thoughtful.\n3. Alex - Sharp.\n4. Marc - Enthusiastic."
+        if "Final Wrap-up and Feedback:" in prompt:
+            return "Final Wrap-up and Feedback: " + self.lorem(self.completion_tokens)
+        if "Provide Question" in prompt or "critical thinking question" in prompt or "Write one new quiz question" in prompt:
+            return f"How did the steam engine change aspect #{next(self._question_counter)} of daily life?"
+        return self.lorem(self.completion_tokens)
+
+    def lorem(self, num_tokens):
+        with self._lock:
+            return " ".join(self._random.choice(LOREM_WORDS) for _ in range(max(1, int(num_tokens * 0.75))))
+
+    def handle_completion(self, handler, body):
+        started_at = time.time()
+        messages = body.get("messages", [])
+        with self._lock:
+            fail = self._random.random() < self.error_rate
+            ttft = self.sample_ttft()
+        if fail:
+            time.sleep(ttft / 4)
+            self._record(started_at, messages, "", error=self.error_status)
+            handler._send_json(self.error_status, {"error": {"message": "Mock provider error", "code": self.error_status}},
+                               headers={"Retry-After": "1"} if self.error_status == 429 else None)
+            return
+
+        text = self.reply_for(messages)
+        prompt_tokens = sum(estimate_tokens(message_text(m)) + 4 for m in messages)
+        completion_tokens = estimate_tokens(text)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        generation_time = completion_tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+        time.sleep(ttft)
+
+        if body.get("stream"):
+            handler.send_response(200)
+            handler.send_header("Content-Type", "text/event-stream")
+            handler.send_header("Cache-Control", "no-cache")
+            handler.send_header("Connection", "close")
+            handler.end_headers()
+            words = text.split(" ")
+            for i, word in enumerate(words):
+                delta = word if i == 0 else " " + word
+                self._send_event(handler, {"id": "mock", "object": "chat.completion.chunk", "model": body.get("model"),
+                                           "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]})
+                time.sleep(generation_time / len(words))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._send_event(handler, {"id": "mock", "object": "chat.completion.chunk", "model": body.get("model"),
+                                           "choices": [], "usage": usage})
+            handler.wfile.write(b"data: [DONE]\n\n")
+            handler.wfile.flush()
+            handler.close_connection = True
+        else:
+            time.sleep(generation_time)
+            handler._send_json(200, {
+                "id": "mock", "object": "chat.completion", "created": int(started_at), "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        self._record(started_at, messages, text, usage=usage, stream=bool(body.get("stream")), ttft=ttft)
+
+    @staticmethod
+    def _send_event(handler, payload):
+        handler.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+        handler.wfile.flush()
+
+    def _record(self, started_at, messages, text, usage=None, error=None, stream=False, ttft=None):
+        with self._lock:
+            self.records.append({
+                "start": started_at, "end": time.time(), "error": error, "stream": stream, "ttft": ttft,
+                "prompt_tokens": (usage or {}).get("prompt_tokens", 0),
+                "completion_tokens": (usage or {}).get("completion_tokens", 0),
+                "prompt": message_text(messages[-1])[:80] if messages else "",
+            })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock provider")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", default="lognormal:0.4:0.4", help='e.g. "fixed:0.3", "uniform:0.2:0.8"')
+    parser.add_argument("--tps", type=float, default=80.0, help="Completion tokens per second")
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--seed", type=int, default=None, help="Makes latencies, errors and replies reproducible")
+    args = parser.parse_args()
+    provider = MockProvider(latency=args.latency, tokens_per_second=args.tps, completion_tokens=args.completion_tokens,
+                            error_rate=args.error_rate, error_status=args.error_status, port=args.port, seed=args.seed)
+    print(f"Mock provider listening on {provider.base_url} (set SYNAPSER_BASE_URL to use it)")
+    try:
+        provider._server.serve_forever()
+    except KeyboardInterrupt:
+        provider.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# run_benchmarks.py
+"""
+Drives the classroom flows of Synapser/app.py end to end against the local mock provider and
+reports, per flow: wall time, time spent waiting on the app (wall time minus simulated think time),
+LLM calls, prompt/completion tokens and the critical path (longest chain of calls that had to run
+one after another). Each run is appended to benchmarks/results.jsonl and compared with the latest
+run of a different commit under the same configuration.
+
+    python benchmarks/run_benchmarks.py --latency lognormal:0.4:0.4 --think-time 1.0
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from mock_provider import MockProvider
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "Synapser", "app.py")
+RESULTS_PATH = os.path.join(REPO_ROOT, "benchmarks", "results.jsonl")
+REGRESSION_THRESHOLD = 0.15  # Relative increase in wait time reported as a regression
+FLOWS = ["startup_overview", "overview_feedback", "focal_points", "quiz", "critical_thinking"]
+
+
+def critical_path(records):
+    """
+    Longest chain of calls where each one started after the previous one ended, i.e. the calls
+    that could not overlap. Returns (number of calls, seconds spent in them).
+    """
+    calls = sorted(records, key=lambda r: r["end"])
+    best = []  # best[i] = (length, seconds) of the longest chain ending with calls[i]
+    for i, call in enumerate(calls):
+        length, seconds = 1, call["end"] - call["start"]
+        for j in range(i):
+            if calls[j]["end"] <= call["start"]:
+                candidate = (best[j][0] + 1, best[j][1] + call["end"] - call["start"])
+                if candidate > (length, seconds):
+                    length, seconds = candidate
+        best.append((length, seconds))
+    return max(best, default=(0, 0.0))
+
+
+def summarize(records, wall_time, think_time):
+    path_calls, path_seconds = critical_path(records)
+    return {
+        "wall_time": round(wall_time, 3),
+        "wait_time": round(wall_time - think_time, 3),
+        "llm_calls": len(records),
+        "errors": sum(1 for r in records if r["error"]),
+        "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+        "completion_tokens": sum(r["completion_tokens"] for r in records),
+        "critical_path_calls": path_calls,
+        "critical_path_seconds": round(path_seconds, 3),
+    }
+
+
+class AppDriver:
+    """Plays one student through the app with Streamlit's AppTest, pausing 'think_time' before each answer."""
+
+    def __init__(self, think_time, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.think_time = think_time
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.thought = 0.0
+
+    def _check(self):
+        if self.at.exception:
+            raise RuntimeError(f"App raised: {[e.value for e in self.at.exception]}")
+
+    def _think(self):
+        time.sleep(self.think_time)
+        self.thought += self.think_time
+
+    def _submit(self, input_widget, text, button):
+        self._think()
+        input_widget.input(text)
+        button.click().run()
+        self._check()
+
+    def _button(self, label_prefix):
+        return next(b for b in self.at.button if b.label.startswith(label_prefix))
+
+    def _open(self, module):
+        self.at.radio(key="demo_selection").set_value(module).run()
+        self._check()
+
+    def startup_overview(self):
+        self.at.run()  # Key check, agents, focal points, then the overview's AI answers
+        self._check()
+
+    def overview_feedback(self):
+        self._submit(self.at.text_input(key="overview_user_response"), "It turns heat into motion.",
+                     self.at.button(key="overview_submit"))
+
+    def focal_points(self):
+        self._open("💡 Focal Points & Media")
+
+    def quiz(self):
+        self._open("📝 Interactive Quiz")
+        question_idx = 0
+        while any(b.label.startswith("Submit Answer") for b in self.at.button):
+            self._submit(self.at.text_area(key=f"user_answer_q{question_idx}"), "Coal and water made steam.",
+                         self._button("Submit Answer"))
+            question_idx += 1
+
+    def critical_thinking(self):
+        self._open("🤔 Critical Thinking Challenge")
+        self._submit(self.at.text_area(key="ct_user_initial_answer"), "It mostly helped factory owners.",
+                     self._button("Submit Your Initial Answer"))
+        self._submit(self.at.text_area(key="ct_user_elaboration"), "I would add the workers' view.",
+                     self._button("Submit Your Elaboration"))
+
+
+def run_once(provider, think_time, timeout):
+    driver = AppDriver(think_time, timeout)
+    results = {}
+    for flow in FLOWS:
+        provider.reset()
+        driver.thought = 0.0
+        started_at = time.time()
+        getattr(driver, flow)()
+        results[flow] = summarize(provider.reset(), time.time() - started_at, driver.thought)
+    return results
+
+
+def median_results(runs):
+    return {
+        flow: {metric: round(statistics.median(run[flow][metric] for run in runs), 3) for metric in runs[0][flow]}
+        for flow in runs[0]
+    }
+
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                             cwd=REPO_ROOT, text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(record, history):
+    """Prints the deltas against the latest run of another commit with the same config; returns regressions."""
+    baseline = next(
+        (r for r in reversed(history) if r["config"] == record["config"] and r["commit"] != record["commit"]), None
+    )
+    print(f"\n{'flow':<20}{'wait s':>9}{'calls':>7}{'tokens':>9}{'path':>6}{'path s':>9}")
+    regressions = []
+    for flow, m in record["flows"].items():
+        line = (f"{flow:<20}{m['wait_time']:>9.2f}{m['llm_calls']:>7}{m['prompt_tokens'] + m['completion_tokens']:>9}"
+                f"{m['critical_path_calls']:>6}{m['critical_path_seconds']:>9.2f}")
+        if baseline is not None and flow in baseline["flows"]:
+            b = baseline["flows"][flow]
+            line += f"   vs {baseline['commit']}: wait {m['wait_time'] - b['wait_time']:+.2f}s, calls {m['llm_calls'] - b['llm_calls']:+d}"
+            if m["wait_time"] > b["wait_time"] * (1 + REGRESSION_THRESHOLD) or m["llm_calls"] > b["llm_calls"]:
+                regressions.append(flow)
+                line += "  <-- regression"
+        print(line)
+    if baseline is None:
+        print("\nNo earlier run of another commit with this configuration to compare against.")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the classroom flows against a local mock provider")
+    parser.add_argument("--latency", default="lognormal:0.4:0.4", help='Time to first token, e.g. "fixed:0.3"')
+    parser.add_argument("--tps", type=float, default=80.0, help="Completion tokens per second")
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--think-time", type=float, default=1.0, help="Seconds the simulated student takes per answer")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per flow; the median is reported")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--results", default=RESULTS_PATH)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    provider = MockProvider(latency=args.latency, tokens_per_second=args.tps, completion_tokens=args.completion_tokens,
+                            error_rate=args.error_rate, seed=args.seed).start()
+    os.environ.update({
+        "OPENROUTER_API_KEY": "benchmark-key",
+        "SYNAPSER_BASE_URL": provider.base_url,
+        "SYNAPSER_SESSION_DB": "",  # Every run starts from scratch
+        "SYNAPSER_LLM_CACHE": "",
+        "SYNAPSER_RATE_LIMIT_RPM": "0",  # Measure the flows, not the client-side budget
+    })
+    os.chdir(REPO_ROOT)  # The app loads media/ relative to the repository root
+    sys.path.insert(0, os.path.dirname(APP_PATH))
+
+    try:
+        runs = [run_once(provider, args.think_time, args.timeout) for _ in range(args.repeat)]
+    finally:
+        provider.stop()
+
+    commit, dirty = git_revision()
+    record = {
+        "commit": commit + ("-dirty" if dirty else ""),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: getattr(args, key) for key in ("latency", "tps", "completion_tokens", "error_rate", "think_time")},
+        "flows": median_results(runs),
+    }
+    history = load_history(args.results)
+    regressions = compare(record, history)
+    with open(args.results, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"\nResults appended to {args.results}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+# conftest.py
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app's modules import each other by their bare names (they run from Synapser/), as do the benchmarks
+sys.path[:0] = [os.path.join(REPO_ROOT, "Synapser"), os.path.join(REPO_ROOT, "benchmarks")]
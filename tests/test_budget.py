@@ -0,0 +1,32 @@
+# test_budget.py
+import pytest
+
+from budget import BudgetExceeded, TokenBudget
+
+
+def test_budget_from_env_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("SYNAPSER_SESSION_TOKEN_BUDGET", raising=False)
+    monkeypatch.delenv("SYNAPSER_BUDGET_FALLBACK_MODEL", raising=False)
+    budget = TokenBudget.from_env("SYNAPSER_SESSION_TOKEN_BUDGET", "fast")
+    budget.charge(10_000_000)
+    assert budget.admit("main", 1000) == "main"
+    assert budget.remaining() is None
+
+
+def test_budget_from_env_downgrades_then_refuses(monkeypatch):
+    monkeypatch.setenv("SYNAPSER_CLASSROOM_TOKEN_BUDGET", "1000")
+    monkeypatch.delenv("SYNAPSER_BUDGET_FALLBACK_MODEL", raising=False)
+    budget = TokenBudget.from_env("SYNAPSER_CLASSROOM_TOKEN_BUDGET", "fast")
+    assert budget.admit("main", 100) == "main"
+    budget.charge(850)
+    assert budget.admit("main", 100) == "fast"
+    with pytest.raises(BudgetExceeded):
+        budget.admit("main", 200)
+
+
+def test_budget_fallback_model_can_be_disabled(monkeypatch):
+    monkeypatch.setenv("SYNAPSER_SESSION_TOKEN_BUDGET", "1000")
+    monkeypatch.setenv("SYNAPSER_BUDGET_FALLBACK_MODEL", "")
+    budget = TokenBudget.from_env("SYNAPSER_SESSION_TOKEN_BUDGET", "fast")
+    budget.charge(900)
+    assert budget.fallback_model is None and budget.admit("main", 50) == "main"
@@ -0,0 +1,158 @@
+# test_engine_machines.py
+import json
+
+import pytest
+
+from engine import CriticalThinkingMachine, OverviewMachine, QuizMachine, USER_NAME, parse_focal_points
+
+STUDENTS = ["Marc", "Paola", "Alex", USER_NAME]
+
+
+def job_ids(machine, state):
+    return [job.job_id for job in machine.pending_jobs(state)]
+
+
+def result(job_id, text):
+    return {"type": "llm_result", "job_id": job_id, "text": text}
+
+
+# --- Quiz ---
+
+def test_quiz_runs_question_answers_then_ranking():
+    machine = QuizMachine("History", 2, STUDENTS)
+    state = machine.initial_state()
+    assert job_ids(machine, state) == ["question:0"]
+
+    state = machine.apply(state, result("question:0", "Why steam?"))
+    assert job_ids(machine, state) == ["answer:0:Marc", "answer:0:Paola", "answer:0:Alex"]
+    for name in ("Alex", "Marc", "Paola"):  # Results may arrive in any order
+        state = machine.apply(state, result(f"answer:0:{name}", f"{name} says coal."))
+    assert job_ids(machine, state) == [] and machine.awaiting_user(state)
+
+    state = machine.apply(state, {"type": "user_answer", "text": "Mines."})
+    assert state["current_question_idx"] == 1 and job_ids(machine, state) == ["question:1"]
+    state = machine.apply(state, result("question:1", "Why rails?"))
+    for name in ("Marc", "Paola", "Alex"):
+        state = machine.apply(state, result(f"answer:1:{name}", "Trade."))
+    state = machine.apply(state, {"type": "user_answer", "text": "Speed."})
+    assert state["quiz_complete"] and job_ids(machine, state) == ["ranking"]
+    assert "User: Speed." in machine.pending_jobs(state)[0].prompt
+
+    state = machine.apply(state, result("ranking", "Final Ranking:\n1. User"))
+    assert job_ids(machine, state) == [] and not machine.awaiting_user(state)
+
+
+def test_quiz_ignores_late_answers_and_rejects_unknown_events():
+    machine = QuizMachine("History", 1, STUDENTS)
+    state = machine.apply(machine.initial_state(), result("question:0", "Why?"))
+    state = machine.apply(state, {"type": "user_answer", "text": "First."})
+    assert machine.apply(state, {"type": "user_answer", "text": "Again."}) == state
+    with pytest.raises(ValueError):
+        machine.apply(state, {"type": "shout"})
+
+
+def test_quiz_question_results_apply_once():
+    machine = QuizMachine("History", 2, STUDENTS)
+    state = machine.apply(machine.initial_state(), result("question:0", "Why?"))
+    assert machine.apply(state, result("question:0", "Duplicate?"))["questions_text"] == ["Why?"]
+
+
+def test_advance_preview_shows_the_next_question_jobs():
+    machine = QuizMachine("History", 2, STUDENTS)
+    state = machine.apply(machine.initial_state(), result("question:0", "Why?"))
+    preview = machine.advance_preview(state)
+    assert job_ids(machine, preview) == ["question:1"] and state["current_question_idx"] == 0
+
+
+def test_structured_quiz_repairs_invalid_questions():
+    machine = QuizMachine("History", 3, STUDENTS, structured=True)
+    state = machine.initial_state()
+    assert job_ids(machine, state) == ["quiz_questions"]
+    assert machine.pending_jobs(state)[0].response_format["json_schema"]["name"] == "quiz"
+
+    reply = json.dumps({"questions": ["Why steam?", "not a question", "Why steam?"]})
+    state = machine.apply(state, result("quiz_questions", reply))
+    assert state["question_drafts"] == ["Why steam?", None, None] and job_ids(machine, state) == ["repair:1"]
+
+    state = machine.apply(state, result("repair:1", "Why rails?"))
+    assert job_ids(machine, state) == ["repair:2"]
+    state = machine.apply(state, result("repair:2", "still not one"))
+    assert job_ids(machine, state) == ["repair:2"]  # Second and last attempt
+    state = machine.apply(state, result("repair:2", "nope"))
+    assert state["questions_text"] == ["Why steam?", "Why rails?", "nope"]
+    assert job_ids(machine, state) == ["answer:0:Marc", "answer:0:Paola", "answer:0:Alex"]
+
+
+# --- Classroom overview ---
+
+def test_overview_waits_for_the_user_before_feedback():
+    machine = OverviewMachine(STUDENTS)
+    state = machine.initial_state()
+    assert job_ids(machine, state) == ["response:Marc", "response:Paola", "response:Alex"]
+    for name in ("Marc", "Paola", "Alex"):
+        state = machine.apply(state, result(f"response:{name}", "It pumps water."))
+    assert job_ids(machine, state) == []
+    state = machine.apply(state, {"type": "user_response", "text": "It turns heat into motion."})
+    assert job_ids(machine, state) == ["feedback"]
+    assert "User answered: 'It turns heat into motion.'" in machine.pending_jobs(state)[0].prompt
+    state = machine.apply(state, result("feedback", "Well done."))
+    assert state["feedback"] == "Well done." and job_ids(machine, state) == []
+
+
+# --- Critical thinking ---
+
+def test_critical_thinking_graph_lets_elaborations_start_early():
+    machine = CriticalThinkingMachine("History", STUDENTS)
+    state = machine.initial_state()
+    assert job_ids(machine, state) == ["ct_question"] and machine.stage(state) == "formulate_question"
+
+    state = machine.apply(state, result("ct_question", "Who gained most?"))
+    assert state["current_stage"] == "initial_answers"
+    assert job_ids(machine, state) == ["initial:Marc", "initial:Paola", "initial:Alex"]
+    assert machine.awaiting_user(state) == [f"initial:{USER_NAME}"]
+
+    state = machine.apply(state, result("initial:Marc", "Owners."))
+    assert job_ids(machine, state) == ["initial:Paola", "initial:Alex"]
+    state = machine.apply(state, result("initial:Paola", "Workers, later."))
+    # Marc elaborates on Paola: both answers exist, so he need not wait for the user
+    assert "elaboration:Marc" in job_ids(machine, state)
+    state = machine.apply(state, result("initial:Alex", "Cities."))
+    assert job_ids(machine, state) == ["elaboration:Marc", "elaboration:Paola"]  # Alex elaborates on the user
+    assert state["current_stage"] == "initial_answers"
+
+
+def test_critical_thinking_user_steps_and_wrapup():
+    machine = CriticalThinkingMachine("History", STUDENTS)
+    state = machine.apply(machine.initial_state(), result("ct_question", "Who gained most?"))
+    for name in ("Marc", "Paola", "Alex"):
+        state = machine.apply(state, result(f"initial:{name}", f"{name}'s view."))
+
+    early = machine.apply(state, {"type": "user_elaboration", "text": "Too soon."})
+    assert USER_NAME not in early["elaborations"]
+
+    state = machine.apply(state, {"type": "user_initial_answer", "text": "Everyone, eventually."})
+    assert state["current_stage"] == "elaboration"
+    assert machine.awaiting_user(state) == [f"elaboration:{USER_NAME}"]
+    assert "elaboration:Alex" in job_ids(machine, state)
+    assert machine.user_elaboration_target() == "Marc"
+
+    for name in ("Marc", "Paola", "Alex"):
+        state = machine.apply(state, result(f"elaboration:{name}", "Building on that."))
+    assert job_ids(machine, state) == []  # The wrap-up waits for the user's elaboration
+    state = machine.apply(state, {"type": "user_elaboration", "text": "Marc forgets the workers."})
+    assert state["current_stage"] == "feedback" and job_ids(machine, state) == ["wrapup"]
+    assert state["elaborations"][USER_NAME]["on_student"] == "Marc"
+
+    state = machine.apply(state, result("wrapup", "Final Wrap-up and Feedback: good."))
+    assert job_ids(machine, state) == [] and machine.awaiting_user(state) == []
+    with pytest.raises(ValueError):
+        machine.apply(state, {"type": "shout"})
+
+
+# --- Focal points ---
+
+def test_parse_focal_points():
+    assert parse_focal_points("Here: ['Steam', 'Rails', 'Mills'] done") == ["Steam", "Rails", "Mills"]
+    assert parse_focal_points("no list here") is None
+    assert parse_focal_points("[1, 2]") is None
+    assert parse_focal_points("[]") is None
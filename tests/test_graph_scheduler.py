@@ -0,0 +1,135 @@
+# test_graph_scheduler.py
+import threading
+import time
+
+from engine import USER_NAME, CriticalThinkingMachine, GraphScheduler, QuizMachine, run_until_idle
+
+STUDENTS = ["Marc", "Paola", "Alex", USER_NAME]
+
+
+class SlowAgent:
+    """Agent.chat stand-in answering after 'delay' seconds; records when each call ran."""
+
+    def __init__(self, name, calls, delay=0.05):
+        self.name = name
+        self.calls = calls
+        self.delay = delay
+
+    def chat(self, prompt, response_format=None, interaction=None):
+        started_at = time.perf_counter()
+        time.sleep(self.delay)
+        self.calls.append((self.name, interaction, started_at, time.perf_counter()))
+        return f"What about {self.name}?" if self.name == "teacher" else f"{self.name} answers."
+
+
+class PreemptedScheduler(GraphScheduler):
+    """Its worker threads pause before starting the jobs a result unblocked, as a preempted thread would."""
+
+    def _start_ready(self):
+        if threading.current_thread() is not threading.main_thread():
+            time.sleep(0.02)
+        super()._start_ready()
+
+
+def slow_agents(delay=0.05):
+    calls = []
+    return {name: SlowAgent(name, calls, delay) for name in ["teacher"] + STUDENTS}, calls
+
+
+def test_run_until_idle_runs_jobs_unblocked_by_a_finished_job():
+    agents, calls = slow_agents()
+    machine = QuizMachine("History", 2, STUDENTS)
+    state, events = run_until_idle(machine, machine.initial_state(), agents)
+    assert [event["job_id"] for event in events][0] == "question:0"
+    assert set(state["all_answers"][0]) == {"Marc", "Paola", "Alex"}
+    assert machine.awaiting_user(state)
+
+
+def test_results_do_not_stop_while_the_next_jobs_are_being_started():
+    agents, _ = slow_agents()
+    machine = QuizMachine("History", 2, STUDENTS)
+    scheduler = PreemptedScheduler(machine, machine.initial_state(), agents).start()
+    job_ids = [job.job_id for job, _ in scheduler.results()]
+    scheduler.close()
+    assert job_ids[0] == "question:0"
+    assert sorted(job_ids[1:]) == ["answer:0:Alex", "answer:0:Marc", "answer:0:Paola"]
+
+
+def test_next_result_waits_for_jobs_started_by_a_result():
+    agents, _ = slow_agents()
+    machine = CriticalThinkingMachine("History", STUDENTS)
+    scheduler = GraphScheduler(machine, machine.initial_state(), agents).start()
+    job_ids = [job.job_id for job, _ in scheduler.results()]
+    scheduler.close()
+    assert job_ids[0] == "ct_question"
+    assert {"initial:Marc", "initial:Paola", "initial:Alex", "elaboration:Marc", "elaboration:Paola"} <= set(job_ids)
+    assert machine.awaiting_user(scheduler.state) == [f"initial:{USER_NAME}"]
+
+
+def test_jobs_start_once_their_inputs_exist():
+    agents, calls = slow_agents()
+    machine = CriticalThinkingMachine("History", STUDENTS)
+    state, _ = run_until_idle(machine, machine.initial_state(), agents)
+    state = machine.apply(state, {"type": "user_initial_answer", "text": "Mine."})
+    state, _ = run_until_idle(machine, state, agents)
+    state = machine.apply(state, {"type": "user_elaboration", "text": "More."})
+    state, _ = run_until_idle(machine, state, agents)
+
+    assert state["current_stage"] == "feedback" and state["final_feedback_text"]
+    ended = {(name, interaction): end for name, interaction, _, end in calls}
+    started = {(name, interaction): start for name, interaction, start, _ in calls}
+    # Marc elaborates on Paola: he needs both initial answers, not the user's
+    assert started[("Marc", "elaboration")] >= max(ended[("Marc", "initial_answer")], ended[("Paola", "initial_answer")])
+    assert started[("teacher", "wrapup")] >= max(end for (_, interaction), end in ended.items() if interaction == "elaboration")
+
+
+def test_dispatch_from_another_thread_while_reading_results():
+    agents, _ = slow_agents(delay=0.02)
+    machine = CriticalThinkingMachine("History", STUDENTS)
+    scheduler = GraphScheduler(machine, machine.initial_state(), agents).start()
+    list(scheduler.results())
+    answer = threading.Timer(0.01, scheduler.dispatch, [{"type": "user_initial_answer", "text": "Mine."}])
+    answer.start()
+    answer.join()
+    job_ids = [job.job_id for job, _ in scheduler.results()]
+    scheduler.close()
+    assert job_ids == ["elaboration:Alex"]
+    assert machine.awaiting_user(scheduler.state) == [f"elaboration:{USER_NAME}"]
+
+
+def test_cancel_drops_replies_in_flight():
+    agents, _ = slow_agents(delay=0.1)
+    machine = CriticalThinkingMachine("History", STUDENTS)
+    scheduler = GraphScheduler(machine, machine.initial_state(), agents).start()
+    scheduler.cancel()
+    assert scheduler.next_result() is None
+    time.sleep(0.15)
+    assert scheduler.state["question"] is None
+
+
+def test_close_releases_the_worker_threads():
+    agents, _ = slow_agents(delay=0.01)
+    machine = QuizMachine("History", 1, STUDENTS)
+    scheduler = GraphScheduler(machine, machine.initial_state(), agents).start()
+    list(scheduler.results())
+    assert any(thread.name.startswith("graph-turn") for thread in threading.enumerate())
+    scheduler.close()
+    time.sleep(0.05)
+    assert not any(thread.name.startswith("graph-turn") for thread in threading.enumerate())
+
+
+def test_results_arrive_in_completion_order_and_agents_take_one_turn_at_a_time():
+    agents, calls = slow_agents()
+    for name, delay in (("teacher", 0.01), ("Marc", 0.15), ("Paola", 0.01), ("Alex", 0.05)):
+        agents[name].delay = delay
+    machine = CriticalThinkingMachine("History", STUDENTS)
+    scheduler = GraphScheduler(machine, machine.initial_state(), agents).start()
+    job_ids = [job.job_id for job, _ in scheduler.results()]
+    scheduler.close()
+
+    assert job_ids[:3] == ["ct_question", "initial:Paola", "initial:Alex"]
+    # Paola elaborates on Alex as soon as both answered, before Marc's slow answer is in
+    assert job_ids.index("elaboration:Paola") < job_ids.index("initial:Marc")
+    for name in STUDENTS[:3]:
+        turns = sorted((start, end) for agent_name, _, start, end in calls if agent_name == name)
+        assert all(previous_end <= start for (_, previous_end), (start, _) in zip(turns, turns[1:]))
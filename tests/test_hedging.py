@@ -0,0 +1,160 @@
+# test_hedging.py
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from agents import Agent
+from hedging import Hedger
+from singleflight import SingleFlight
+
+
+class FakeAsyncClient:
+    """AsyncOpenAI stand-in: the n-th request takes delays[n] seconds (later ones 10 ms)."""
+
+    def __init__(self, delays=()):
+        self.delays = list(delays)
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, **request_options):
+        self.requests += 1
+        number = self.requests
+        await asyncio.sleep(self.delays.pop(0) if self.delays else 0.01)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=f"Reply {number}"))],
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15),
+        )
+
+
+def trained_hedger():
+    """Hedges any call to model "m" still running after 50 ms."""
+    hedger = Hedger(max_hedge_rate=1.0, min_samples=1, min_delay=0.05)
+    hedger.observe("m", 0.01)
+    return hedger
+
+
+def test_coalesced_follower_survives_its_leader_losing_a_hedge():
+    client = FakeAsyncClient(delays=[1.0])  # The leader's request is stuck in the tail
+    single_flight = SingleFlight()
+    leader = Agent("Marc", None, "m", "You are a student.", async_client=client, single_flight=single_flight,
+                   hedger=trained_hedger())
+    follower = Agent("Paola", None, "m", "You are a student.", async_client=client, single_flight=single_flight)
+
+    async def both():
+        leading = asyncio.ensure_future(leader.achat("Why steam?"))
+        await asyncio.sleep(0.01)  # The follower joins the leader's request
+        return await asyncio.gather(leading, follower.achat("Why steam?"))
+
+    leader_reply, follower_reply = asyncio.run(both())
+    assert leader_reply == "Reply 2"  # The hedge won; the stuck request was cancelled
+    assert not follower_reply.startswith("Error") and follower_reply != "Reply 1"
+    assert leader.hedger.stats["hedge_wins"] == 1
+    assert single_flight.stats["coalesced"] == 0  # The follower had to send its own request
+
+
+
+def test_hedging_follower_does_not_cancel_the_call_it_joined():
+    client = FakeAsyncClient(delays=[0.3])  # The leader's request is slow; the follower's hedge is not
+    single_flight = SingleFlight()
+    def student(name, hedger=None):
+        return Agent(name, None, "m", "You are a student.", async_client=client, single_flight=single_flight,
+                     hedger=hedger)
+    leader, hedging_follower, follower = student("Marc"), student("Paola", trained_hedger()), student("Alex")
+
+    async def all_three():
+        leading = asyncio.ensure_future(leader.achat("Why steam?"))
+        await asyncio.sleep(0.01)
+        return await asyncio.gather(leading, hedging_follower.achat("Why steam?"), follower.achat("Why steam?"))
+
+    leader_reply, hedged_reply, follower_reply = asyncio.run(all_three())
+    assert hedged_reply == "Reply 2"  # The hedge won and the follower's wait was cancelled
+    assert leader_reply == follower_reply == "Reply 1"
+    assert hedging_follower.hedger.stats["hedge_wins"] == 1 and client.requests == 2
+
+def slow_then_fast(delay, reply):
+    def call():
+        time.sleep(delay)
+        return reply
+    return call
+
+
+def test_no_hedge_until_enough_latencies_were_seen():
+    hedger = Hedger(max_hedge_rate=1.0, min_samples=2, min_delay=0.01)
+    assert hedger.hedge_delay("m") is None
+    assert hedger.call("m", lambda: "primary", lambda: "hedge") == "primary"
+    assert hedger.stats == {"calls": 1, "hedged": 0, "hedge_wins": 0, "discarded_tokens": 0}
+    hedger.call("m", lambda: "primary", lambda: "hedge")
+    assert hedger.hedge_delay("m") == 0.01  # Never earlier than min_delay
+
+
+def test_slow_primary_loses_to_the_hedge():
+    hedger = trained_hedger()
+    discarded = []
+    result = hedger.call("m", slow_then_fast(0.3, "primary"), slow_then_fast(0.01, "hedge"), on_discarded=discarded.append)
+    assert result == "hedge"
+    assert hedger.stats["hedged"] == 1 and hedger.stats["hedge_wins"] == 1
+    time.sleep(0.35)
+    assert discarded == ["primary"]  # The loser's tokens can still be charged
+
+
+def test_fast_primary_is_not_hedged():
+    hedger = trained_hedger()
+    hedges = []
+    assert hedger.call("m", slow_then_fast(0.01, "primary"), lambda: hedges.append(1) or "hedge") == "primary"
+    assert not hedges and hedger.stats["hedged"] == 0
+
+
+def test_hedge_rate_cap():
+    hedger = Hedger(max_hedge_rate=0.0, min_samples=1, min_delay=0.01)
+    hedger.observe("m", 0.01)
+    assert hedger.call("m", slow_then_fast(0.05, "primary"), lambda: "hedge") == "primary"
+    assert hedger.stats["hedged"] == 0
+
+
+def test_primary_wins_when_the_hedge_fails():
+    hedger = trained_hedger()
+    def failing_hedge():
+        raise RuntimeError("hedge failed")
+    assert hedger.call("m", slow_then_fast(0.1, "primary"), failing_hedge) == "primary"
+    assert hedger.stats["hedge_wins"] == 0
+
+
+def test_async_hedge_win_cancels_the_primary():
+    hedger = trained_hedger()
+    cancelled = []
+
+    async def primary():
+        try:
+            await asyncio.sleep(1.0)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "primary"
+
+    async def hedge():
+        await asyncio.sleep(0.01)
+        return "hedge"
+
+    async def run():
+        result = await hedger.acall("m", primary, hedge)
+        await asyncio.sleep(0)  # Let the cancellation land
+        return result
+
+    assert asyncio.run(run()) == "hedge"
+    assert cancelled == [True] and hedger.stats["hedge_wins"] == 1
+
+
+def test_async_both_failing_raises_the_primary_error():
+    hedger = trained_hedger()
+
+    async def primary():
+        await asyncio.sleep(0.1)
+        raise ValueError("primary failed")
+
+    async def hedge():
+        raise RuntimeError("hedge failed")
+
+    with pytest.raises(ValueError):
+        asyncio.run(hedger.acall("m", primary, hedge))
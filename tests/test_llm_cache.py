@@ -0,0 +1,43 @@
+# test_llm_cache.py
+from types import SimpleNamespace
+
+from agents import Agent
+from llm_cache import ResponseCache
+
+QUIZ_FORMAT = {"type": "json_schema", "json_schema": {"name": "quiz", "schema": {"type": "object"}}}
+
+
+class FakeClient:
+    """OpenAI client stand-in answering JSON to structured requests and prose otherwise."""
+
+    def __init__(self):
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **request_options):
+        self.requests.append(request_options)
+        content = '{"questions": ["Why?"]}' if "response_format" in request_options else "Because of steam."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                               usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5))
+
+
+def test_request_options_are_part_of_the_key(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite3"))
+    messages = [{"role": "user", "content": "Write the quiz."}]
+    cache.put("m", messages, "Prose.")
+    assert cache.get("m", messages, {"response_format": QUIZ_FORMAT}) is None
+    cache.put("m", messages, '{"questions": []}', {"response_format": QUIZ_FORMAT})
+    assert cache.get("m", messages, {"response_format": QUIZ_FORMAT}) == '{"questions": []}'
+    assert cache.get("m", messages) == cache.get("m", messages, {}) == "Prose."
+
+
+def test_structured_and_free_text_replies_are_cached_apart(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite3"))
+    client = FakeClient()
+    prose = Agent("teacher", client, "m", "You are a teacher.", cache=cache)
+    structured = Agent("teacher", client, "m", "You are a teacher.", cache=cache)
+    assert prose.chat("Write the quiz.") == "Because of steam."
+    assert structured.chat("Write the quiz.", response_format=QUIZ_FORMAT) == '{"questions": ["Why?"]}'
+    again = Agent("teacher", client, "m", "You are a teacher.", cache=cache)
+    assert again.chat("Write the quiz.", response_format=QUIZ_FORMAT) == '{"questions": ["Why?"]}'
+    assert len(client.requests) == 2  # The last one was a cache hit
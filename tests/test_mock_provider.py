@@ -0,0 +1,21 @@
+# test_mock_provider.py
+import random
+
+from mock_provider import MockProvider, parse_distribution
+
+
+def test_same_seed_same_latencies():
+    random.seed(1)  # The module-level generator must not matter
+    first = MockProvider(latency="lognormal:0.4:0.4", seed=7).start()
+    random.seed(2)
+    second = MockProvider(latency="lognormal:0.4:0.4", seed=7).start()
+    assert [first.sample_ttft() for _ in range(5)] == [second.sample_ttft() for _ in range(5)]
+    first.stop()
+    second.stop()
+
+
+def test_distributions_draw_from_the_given_generator():
+    expected = random.Random(3)
+    uniform = parse_distribution("uniform:0.2:0.8", random.Random(3))
+    assert [uniform() for _ in range(3)] == [expected.uniform(0.2, 0.8) for _ in range(3)]
+    assert parse_distribution("fixed:0.3", random.Random(3))() == 0.3
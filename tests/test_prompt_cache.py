@@ -0,0 +1,65 @@
+# test_prompt_cache.py
+import asyncio
+import copy
+from types import SimpleNamespace
+
+from agents import Agent
+
+
+class RecordingAsyncClient:
+    """AsyncOpenAI stand-in keeping every request; reports 'cached_tokens' of the prompt as served from cache."""
+
+    def __init__(self, cached_tokens=0):
+        self.cached_tokens = cached_tokens
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, **request_options):
+        self.requests.append(copy.deepcopy(messages))  # The agent keeps growing its history list
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=f"Reply {len(self.requests)}"))],
+            usage=SimpleNamespace(prompt_tokens=100, completion_tokens=10,
+                                  prompt_tokens_details=SimpleNamespace(cached_tokens=self.cached_tokens)),
+        )
+
+
+def converse(agent, prompts):
+    async def turns():
+        for prompt in prompts:
+            await agent.achat(prompt)
+    asyncio.run(turns())
+
+
+def is_breakpoint(message):
+    return isinstance(message["content"], list) and message["content"][0].get("cache_control") == {"type": "ephemeral"}
+
+
+def test_requests_share_a_byte_identical_prefix():
+    client = RecordingAsyncClient()
+    agent = Agent("teacher", None, "m", "You are a teacher.", async_client=client)
+    converse(agent, ["Question 1?", "Question 2?"])
+    first, second = client.requests
+    assert second[:len(first)] == first
+    assert [m["role"] for m in second] == ["system", "user", "assistant", "user"]
+    assert second[-1]["content"] == "Question 2?"  # Newest prompt last
+    assert not any(is_breakpoint(m) for m in second)
+
+
+def test_breakpoints_mark_the_system_prompt_and_the_older_history():
+    client = RecordingAsyncClient()
+    agent = Agent("teacher", None, "m", "You are a teacher.", async_client=client, prompt_cache_breakpoints=True)
+    converse(agent, ["Question 1?", "Question 2?"])
+    first, second = client.requests
+    assert [is_breakpoint(m) for m in first] == [True, False]  # No older history yet
+    assert [is_breakpoint(m) for m in second] == [True, False, True, False]
+    assert second[0]["content"][0]["text"] == "You are a teacher."
+    assert second[2]["content"][0]["text"] == "Reply 1"
+    assert all(isinstance(m["content"], str) for m in agent.messages)  # The history itself is left plain
+
+
+def test_cached_tokens_are_recorded_from_usage():
+    client = RecordingAsyncClient(cached_tokens=80)
+    agent = Agent("teacher", None, "m", "You are a teacher.", async_client=client, prompt_cache_breakpoints=True)
+    converse(agent, ["Question 1?", "Question 2?"])
+    assert agent.last_call_usage == {"prompt_tokens": 100, "completion_tokens": 10, "cached_tokens": 80}
+    assert agent.token_usage["cached_tokens"] == 160 and agent.token_usage["calls"] == 2
@@ -0,0 +1,102 @@
+# test_rate_limit.py
+import email.utils
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter, retry_after_seconds
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(monotonic=clock.monotonic, time=time.time, sleep=time.sleep))
+    return clock
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def test_request_bucket_refills_over_time(clock):
+    limiter = RateLimiter(requests_per_minute=2, max_in_flight=10)
+    assert limiter._try_acquire(0) == 0
+    assert limiter._try_acquire(0) == 0
+    assert limiter._try_acquire(0) == pytest.approx(30.0)  # One request every 30 s
+    clock.now += 15
+    assert limiter._try_acquire(0) == pytest.approx(15.0)
+    clock.now += 15
+    assert limiter._try_acquire(0) == 0
+
+
+def test_refill_is_capped_at_one_minute_of_requests(clock):
+    limiter = RateLimiter(requests_per_minute=2, max_in_flight=10)
+    clock.now += 3600
+    assert [limiter._try_acquire(0) for _ in range(3)] == [0, 0, pytest.approx(30.0)]
+
+
+def test_token_bucket_reserves_the_estimate_and_settles_on_real_usage(clock):
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=600, max_in_flight=10)
+    assert limiter._try_acquire(300) == 0
+    assert limiter._try_acquire(300) == 0
+    assert limiter._try_acquire(300) == pytest.approx(30.0)
+    limiter._release(300, actual_tokens=100)  # The call used less than reserved
+    assert limiter._try_acquire(300) == pytest.approx(10.0)
+
+
+def test_in_flight_cap(clock):
+    limiter = RateLimiter(requests_per_minute=0, max_in_flight=1)
+    assert limiter._try_acquire(0) == 0
+    assert limiter._try_acquire(0) == rate_limit._POLL_SECONDS
+    limiter._release(0, None)
+    assert limiter._try_acquire(0) == 0
+
+
+def test_retry_after_headers():
+    assert retry_after_seconds(ProviderError(429, {"retry-after": "2"})) == 2.0
+    assert retry_after_seconds(ProviderError(429, {"retry-after-ms": "1500"})) == 1.5
+    http_date = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert 55 < retry_after_seconds(ProviderError(429, {"retry-after": http_date})) <= 60
+    assert retry_after_seconds(ProviderError(429)) is None
+
+
+def test_429_honors_retry_after_and_pauses_the_key(clock):
+    limiter = RateLimiter(requests_per_minute=0, max_in_flight=10)
+    assert limiter.retry_delay(0, ProviderError(429, {"retry-after": "5"})) == 5.0
+    assert limiter._try_acquire(0) == pytest.approx(5.0)  # Every caller on the key waits
+    clock.now += 5
+    assert limiter._try_acquire(0) == 0
+    assert limiter.stats["rate_limited"] == 1
+
+
+def test_retry_delay_gives_up_on_permanent_errors_and_after_max_retries():
+    limiter = RateLimiter(max_retries=2, base_delay=0.01, max_delay=0.02)
+    assert limiter.retry_delay(0, ProviderError(400)) is None
+    assert 0 <= limiter.retry_delay(1, ProviderError(503)) <= 0.02
+    assert limiter.retry_delay(2, ProviderError(503)) is None
+    assert limiter.stats["failures"] == 2
+
+
+def test_call_retries_transient_failures():
+    limiter = RateLimiter(requests_per_minute=0, base_delay=0.01)
+    outcomes = [ProviderError(503, {"retry-after": "0"}), "reply"]
+    def flaky():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    assert limiter.call(flaky) == "reply"
+    assert limiter.stats["retries"] == 1 and limiter.in_flight == 0
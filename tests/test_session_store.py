@@ -0,0 +1,90 @@
+# test_session_store.py
+import gc
+from types import SimpleNamespace
+
+from session_store import SessionRelease, SessionStore
+
+
+def agent(*contents):
+    messages = [{"role": "system", "content": "You are a teacher."}]
+    messages += [{"role": "user" if i % 2 == 0 else "assistant", "content": c} for i, c in enumerate(contents)]
+    return SimpleNamespace(messages=messages, state={})
+
+
+def event_kinds(store, session_id):
+    return [row[0] for row in store._db.execute("SELECT kind FROM events WHERE session_id = ? ORDER BY id", (session_id,))]
+
+
+def test_checkpoints_append_only_what_changed(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.sqlite3"))
+    teacher = agent("Question 1?", "Answer 1.")
+    session_state = {"quiz_state": {"all_answers": {0: {"Marc": "Yes."}}}}
+    store.checkpoint("s1", {"teacher": teacher}, session_state)
+    teacher.messages.append({"role": "user", "content": "Question 2?"})
+    session_state["quiz_state"]["all_answers"][1] = {}
+    store.checkpoint("s1", {"teacher": teacher}, session_state)
+    store.checkpoint("s1", {"teacher": teacher}, session_state)  # Nothing changed
+    teacher.messages = teacher.messages[:1]  # Cleared
+    store.checkpoint("s1", {"teacher": teacher}, session_state)
+
+    assert event_kinds(store, "s1") == ["messages_append", "state_patch", "messages_append", "state_patch", "messages_reset"]
+    snapshot = store.load("s1")
+    assert snapshot["agents"]["teacher"]["messages"] == teacher.messages
+    assert snapshot["states"]["quiz_state"] == {"all_answers": {0: {"Marc": "Yes."}, 1: {}}}
+
+
+def test_an_edited_middle_turn_resets_the_history(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.sqlite3"))
+    teacher = agent("Question 1?", "Answer 1.", "Question 2?")
+    store.checkpoint("s1", {"teacher": teacher}, {})
+    teacher.messages[2] = {"role": "assistant", "content": "A rewritten answer."}  # Same count, first and last
+    store.checkpoint("s1", {"teacher": teacher}, {})
+
+    assert event_kinds(store, "s1") == ["messages_append", "messages_reset"]
+    assert store.load("s1")["agents"]["teacher"]["messages"] == teacher.messages
+
+
+def test_forgotten_session_is_reread_from_its_log(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.sqlite3"))
+    teacher = agent("Question 1?")
+    session_state = {"ct_state": {"question": "Why?", "initial_answers": {}}, "focal_points": ["Steam"]}
+    store.checkpoint("s1", {"teacher": teacher}, session_state)
+    store.forget("s1")
+    assert "s1" not in store._persisted
+
+    teacher.messages.append({"role": "assistant", "content": "Answer 1."})
+    del session_state["focal_points"]
+    store.checkpoint("s1", {"teacher": teacher}, session_state)
+    assert event_kinds(store, "s1")[-2:] == ["messages_append", "state_delete"]
+    snapshot = store.load("s1")
+    assert snapshot["agents"]["teacher"]["messages"] == teacher.messages
+    assert "focal_points" not in snapshot["states"]
+
+
+def test_tracking_is_bounded_and_holds_no_history(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.sqlite3"), max_sessions=2)
+    for session_id in ("s1", "s2", "s3"):
+        store.checkpoint(session_id, {"teacher": agent("A long question? " * 100)}, {})
+    assert list(store._persisted) == ["s2", "s3"]
+    assert "long question" not in repr(store._persisted)
+
+
+def test_restore_then_checkpoint_appends_nothing(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    store = SessionStore(path)
+    store.checkpoint("s1", {"teacher": agent("Question 1?", "Answer 1.")}, {"quiz_state": {"quiz_complete": False}})
+    restarted = SessionStore(path)
+    teacher, session_state = agent(), {}
+    assert restarted.restore("s1", {"teacher": teacher}, session_state)
+    restarted.checkpoint("s1", {"teacher": teacher}, session_state)
+    assert len(event_kinds(restarted, "s1")) == 2
+    assert session_state == {"quiz_state": {"quiz_complete": False}}
+
+
+def test_release_forgets_the_session_when_dropped(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.sqlite3"))
+    store.checkpoint("s1", {"teacher": agent("Question 1?")}, {})
+    session_state = {"session_release": SessionRelease(store, "s1")}
+    del session_state
+    gc.collect()
+    assert "s1" not in store._persisted
@@ -0,0 +1,107 @@
+# test_singleflight.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_identical_calls_run_once():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    def slow_call():
+        calls.append(1)
+        release.wait(1)
+        return "reply"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(single_flight.do("k", slow_call)))
+    leader.start()
+    while not single_flight._in_flight:
+        time.sleep(0.001)
+    follower = threading.Thread(target=lambda: results.append(single_flight.do("k", slow_call)))
+    follower.start()
+    while single_flight.stats["coalesced"] < 1:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert sorted(results, key=lambda result: result[1]) == [("reply", False), ("reply", True)]
+    assert len(calls) == 1 and single_flight.avoided_calls() == 1
+    assert single_flight.do("k", lambda: "fresh") == ("fresh", False)  # Nothing is kept once it completed
+
+
+def test_leader_errors_reach_followers():
+    single_flight = SingleFlight()
+
+    async def both():
+        async def failing_call():
+            await asyncio.sleep(0.02)
+            raise ValueError("provider down")
+        leader = asyncio.ensure_future(single_flight.ado("k", failing_call))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(single_flight.ado("k", failing_call))
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    leader_error, follower_error = asyncio.run(both())
+    assert isinstance(leader_error, ValueError) and follower_error is leader_error
+    assert single_flight.stats == {"leaders": 1, "coalesced": 1}
+
+
+def test_different_keys_do_not_coalesce():
+    single_flight = SingleFlight()
+
+    async def both():
+        async def call(reply):
+            await asyncio.sleep(0.01)
+            return reply
+        return await asyncio.gather(single_flight.ado("a", lambda: call("A")), single_flight.ado("b", lambda: call("B")))
+
+    assert asyncio.run(both()) == [("A", False), ("B", False)]
+
+
+def test_followers_of_a_cancelled_leader_lead_again():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def scenario():
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "reply"
+        leader = asyncio.ensure_future(single_flight.ado("k", call))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(single_flight.ado("k", call))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == ("reply", False)
+    assert len(calls) == 2 and single_flight.stats == {"leaders": 2, "coalesced": 0}
+
+
+def test_cancelling_a_follower_leaves_the_call_to_the_others():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def scenario():
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "reply"
+        leader = asyncio.ensure_future(single_flight.ado("k", call))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(single_flight.ado("k", call)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        followers[0].cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await followers[0]
+        return await asyncio.gather(leader, followers[1])
+
+    assert asyncio.run(scenario()) == [("reply", False), ("reply", True)]
+    assert len(calls) == 1